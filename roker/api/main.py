@@ -1,27 +1,213 @@
 import asyncio
+import dataclasses
 import json
-import docker
-from fastapi import FastAPI
+import time
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
 import os
-
-from roker.controllers.docker_controller import AgentController, DC_SC
-from roker.controllers.db_controller import DB_Controller, Agent
+from datetime import datetime, timezone
+
+from roker.controllers.docker_controller import (
+    AgentController, ContainerCreation, DC_SC)
+from roker.controllers.db_controller import (
+    DB_Controller, DB_new_agent_status, DB_query_status, Agent)
+from roker.controllers.event_controller import ContainerState
+from roker.controllers.fanout_controller import FanoutController
+from roker.controllers.gh_controller import GHController, GHMetadata, GH_SC
+from roker.controllers.health_controller import HealthController
+from roker.controllers.job_controller import JOB_SC, JobController
+from roker.controllers.log_controller import LOG_SC
+from roker.controllers.proxy_controller import (
+    PROXY_SC, ProxyController, forward_headers)
+from roker.controllers.registry_controller import (
+    AgentRegistry, parse_agent_id)
+from roker.controllers.snapshot_controller import SnapshotController
+from roker.controllers.tournament_controller import (
+    TOURNAMENT_SC, Table, TournamentController)
 load_dotenv()
 
-app = FastAPI()
-ac = AgentController()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts and stops the background parts of roker"""
+    ac.events.add_listener(mirror_active)
+    ac.events.add_listener(health.on_state)
+    health.start()
+    ac.stats.start()
+    ac.log_store.start()
+    await ac.start()
+    await ac.pool.start()
+    jobs.start()
+    yield
+    await jobs.stop()
+    await ac.pool.stop()
+    ac.events.stop()
+    ac.stats.stop()
+    ac.logs.shutdown()
+    ac.log_shipper.stop()
+    ac.log_store.stop()
+    await tournaments.stop()
+    await health.stop()
+    await fanout.aclose()
+    await proxy.aclose()
+    await gh.aclose()
+    # Flushes any queued write-behind updates
+    db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 db = DB_Controller()
 db.connect()
+registry = AgentRegistry(db)
+registry.load()
+ac = AgentController(db)
+gh = GHController(db=db)
+health = HealthController(registry)
+fanout = FanoutController(registry)
+proxy = ProxyController(registry)
+
+TOURNAMENT_GAME_PATH = os.getenv("TOURNAMENT_GAME_PATH", "/start_game")
+TOURNAMENT_TABLE_DEADLINE = float(os.getenv(
+    "TOURNAMENT_TABLE_DEADLINE", 300))
+
+
+async def play_table(table: Table) -> dict[int, float]:
+    """
+    Plays a tournament table by sending it to every seated agent's
+    TOURNAMENT_GAME_PATH, each answering with its {"score": ...}. Agents
+    that did not answer score 0.
+    """
+    result = await fanout.send(list(table.seats), {
+        "tournament_id": table.tournament_id,
+        "table": table.number,
+        "round": table.round,
+        "seats": list(table.seats),
+    }, path=TOURNAMENT_GAME_PATH, deadline=TOURNAMENT_TABLE_DEADLINE)
+
+    scores = {}
+    for (agent_id, response) in result.responses.items():
+        if isinstance(response, dict):
+            scores[agent_id] = float(response.get("score", 0))
+    return scores
+
+
+tournaments = TournamentController(db, play_table)
+
+
+async def active_containers() -> dict[str, str]:
+    """Container id of every active agent, keyed by port"""
+    return {str(agent.port_number): agent.container_id
+            for agent in registry.all() if agent.active}
+
+
+containers_snapshot = SnapshotController(active_containers)
+
+
+def mirror_active(state: ContainerState):
+    """
+    Marks an agent inactive as soon as its container stops. Whether a
+    running agent is active is for the health probes to say.
+    """
+    if state.status == "running":
+        return
+    (status, agent) = registry.get_agent_data(state.container_id)
+    if status == DB_query_status.SUCCESS and agent.active:
+        registry.update_agent_data(agent.id, {"active": False})
+
+
+def team_data(meta: GHMetadata) -> dict:
+    """agents columns to fill in from a repo's metadata files"""
+    data = {}
+    if meta.team_name.status == GH_SC.OK:
+        data["team_name"] = meta.team_name.response.strip()
+    if meta.team_members.status == GH_SC.OK:
+        data["team_members"] = meta.team_members.response.strip()
+    return data
+
+
+# How long a launch job waits for a new agent's first passing probe
+JOB_HEALTHY_TIMEOUT = float(os.getenv("JOB_HEALTHY_TIMEOUT", 120))
+# How long a restart waits for the agent to pass a probe again
+RESTART_HEALTHY_TIMEOUT = float(os.getenv("RESTART_HEALTHY_TIMEOUT", 120))
+
+
+async def launch_agent(params: dict, progress) -> (bool, dict | str):
+    """
+    Job runner for /add_agent. Launches a container for params["gh_url"],
+    registers the agent and waits for it to become healthy, reporting each
+    stage to `progress`.
+    """
+    (task, meta) = await asyncio.gather(
+        ac.create_new_container(
+            params["gh_url"],
+            params.get("priority", 0),
+            on_queued=lambda position: progress(
+                "admission", queue_position=position),
+            on_stage=progress),
+        gh.get_gh_metadata(params["gh_url"])
+    )
+
+    if task.status != DC_SC.OK:
+        return (False, task.status.name)
+
+    new_agent: Agent = Agent(
+        container_id=task.container_id,
+        container_name=task.container_name,
+        start_time=task.start_time,
+        port_number=task.port,
+        active=True
+    )
+
+    progress("register")
+    (status, agent_id) = registry.add_new_agent(new_agent)
+    if status != DB_new_agent_status.SUBMITTED:
+        return (False, str(agent_id))
+
+    if team_data(meta):
+        registry.update_agent_data(agent_id, team_data(meta))
+    health.watch(agent_id, task.container_id, task.port)
+
+    progress("health")
+    healthy = await health.wait_healthy(agent_id, JOB_HEALTHY_TIMEOUT)
+
+    return (True, {
+        "agent_id": agent_id,
+        "port": task.port,
+        "container_id": task.container_id,
+        "healthy": healthy
+    })
+
+
+jobs = JobController(db, {"add_agent": launch_agent})
+
 
 PORT_NUMBER = int(os.getenv("PORT_NUMBER", 8000))
 API_RELOAD = bool(os.getenv("API_RELOAD", True))
+MAX_BATCH_PARALLELISM = int(os.getenv("MAX_BATCH_PARALLELISM", 8))
 
 
 class AddAgentReq(BaseModel):
     gh_url: str
+    priority: int = 0
+
+
+class AddAgentsReq(BaseModel):
+    gh_urls: list[str]
+    parallelism: int = MAX_BATCH_PARALLELISM
+    priority: int = 0
+
+
+class GetAllAgentsReq(BaseModel):
+    active: bool | None = None
+    team_name: str | None = None
+    port_min: int | None = None
+    port_max: int | None = None
+    after_id: int = 0
+    limit: int | None = None
 
 
 class GetLogsReq(BaseModel):
@@ -32,76 +218,590 @@ class KillAgentReq(BaseModel):
     container_id: str
 
 
+class FanoutReq(BaseModel):
+    agent_ids: list[int | str]
+    payload: dict | list
+    path: str | None = None
+    deadline: float | None = None
+
+
+class TournamentReq(BaseModel):
+    agent_ids: list[int]
+    format: str = "round_robin"
+    table_size: int = 2
+    rounds: int | None = None
+
+
+class RestartAgentReq(BaseModel):
+    agent_ids: list[int | str]
+    parallelism: int = MAX_BATCH_PARALLELISM
+    timeout: float = RESTART_HEALTHY_TIMEOUT
+
+
 class CommandReq(BaseModel):
     container_id: str
 
 
 @app.post("/add_agent")
-async def add_agent(req: AddAgentReq) -> str:
+def add_agent(req: AddAgentReq) -> str:
     """
     Add an agent to the pool of existing agents.
     Takes in a gh_url to be pulled down, compiled, and
     eventually exectuted.
+
+    Returns a job id at once; the agent is launched in the background
+    (higher `priority` first). Follow it with /jobs/{id} or
+    /jobs/{id}/events. The finished job's result has the agent id, port,
+    container id and whether the agent became healthy.
     """
-    task = await asyncio.create_task(ac.create_new_container(req.gh_url))
+    (status, job_id) = jobs.submit(
+        "add_agent", {"gh_url": req.gh_url, "priority": req.priority},
+        req.priority)
 
-    if task.status != DC_SC.OK:
-        return json.dumps({"status": "bad"})
+    if status != JOB_SC.OK:
+        return json.dumps({"status": "bad", "message": status.name})
+    return json.dumps({"status": "ok", "job_id": job_id})
 
-    new_agent: Agent = Agent(
-        container_id=task.container_id,
-        container_name=task.container_name,
-        start_time=task.start_time,
-        port_number=task.port_number
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, version: int | None = None,
+                  wait: float = 0) -> str:
+    """
+    Returns a job's status, the stages it went through and, once it is
+    finished, its result or error.
+
+    Long poll: pass the last `version` seen and up to `wait` seconds to
+    hold the request until the job changes.
+    """
+    if wait > 0:
+        job = await jobs.wait(job_id, version, wait)
+    else:
+        job = jobs.get_job(job_id)
+
+    if job is None:
+        return json.dumps({"status": "bad",
+                           "message": f"unknown job {job_id}"})
+    return json.dumps(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: int) -> StreamingResponse:
+    """
+    Streams a job as server-sent events, one every time it changes, until
+    it is finished.
+    """
+    async def events():
+        async for job in jobs.follow(job_id):
+            if job is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/job_stats")
+def job_stats() -> str:
+    """Returns job queue and worker counters"""
+    return json.dumps(jobs.get_stats())
+
+
+@app.post("/add_agents")
+async def add_agents(req: AddAgentsReq) -> StreamingResponse:
+    """
+    Add many agents at once.
+
+    Containers are launched concurrently, at most `parallelism` at a time
+    (capped by MAX_BATCH_PARALLELISM), and each agent is registered as
+    soon as its container is up. The response is newline delimited json:
+    one line per agent as its launch finishes, followed by a final summary
+    line. Launches already running when the client goes away still finish
+    and are registered; those that had not started are dropped.
+    """
+    parallelism = max(1, min(req.parallelism, MAX_BATCH_PARALLELISM))
+
+    async def results():
+        # container id -> agent id, or the reason it was not registered
+        registered: dict[str, int | str] = {}
+        # Team metadata is fetched while the containers launch. Not
+        # cancelled if the client goes away, as launches still running
+        # register their agent's team.
+        metadata = {gh_url: asyncio.create_task(gh.get_gh_metadata(gh_url))
+                    for gh_url in set(req.gh_urls)}
+
+        async def register(task: ContainerCreation):
+            (status, agent_id) = registry.add_new_agent(Agent(
+                container_id=task.container_id,
+                container_name=task.container_name,
+                start_time=task.start_time,
+                port_number=task.port,
+                active=True
+            ))
+            if status != DB_new_agent_status.SUBMITTED:
+                print(f"[add_agents] can't register {task.container_id}: "
+                      f"{agent_id}")
+                registered[task.container_id] = str(agent_id)
+                return
+            registered[task.container_id] = agent_id
+            health.watch(agent_id, task.container_id, task.port)
+
+            data = team_data(await metadata[task.gh_url])
+            if data:
+                registry.update_agent_data(agent_id, data)
+
+        agent_ids = []
+        failed = 0
+        # Closed as soon as the client goes away, so launches that have
+        # not started are dropped at once
+        async with aclosing(ac.create_new_containers(
+                req.gh_urls, parallelism, req.priority, register)) as launches:
+            async for task in launches:
+                agent_id = registered.get(task.container_id)
+                if task.status != DC_SC.OK or not isinstance(agent_id, int):
+                    failed += 1
+                    yield json.dumps({
+                        "gh_url": task.gh_url,
+                        "status": "bad",
+                        "message": task.status.name
+                        if task.status != DC_SC.OK else agent_id,
+                    }) + "\n"
+                    continue
+
+                agent_ids.append(agent_id)
+                yield json.dumps({
+                    "gh_url": task.gh_url,
+                    "agent_id": agent_id,
+                    "port": task.port,
+                    "status": "ok",
+                    "container_id": task.container_id
+                }) + "\n"
+
+        yield json.dumps({
+            # Only failing to register makes the whole batch bad
+            "status": "ok" if all(isinstance(agent_id, int)
+                                  for agent_id in registered.values())
+            else "bad",
+            "launched": len(agent_ids),
+            "failed": failed,
+            "agent_ids": agent_ids,
+        }) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/admission_stats")
+def admission_stats() -> str:
+    """
+    Returns the memory and CPUs committed against the host budget, and the
+    launches waiting for room, in the order they will be admitted.
+    """
+    return json.dumps({**ac.admission.get_stats(),
+                       "queue": ac.admission.get_queue()})
+
+
+@app.get("/pool_stats")
+def pool_stats() -> str:
+    """
+    Returns warm pool hit/miss counters and sizing, used to tune
+    POOL_TARGET_SIZE and POOL_IDLE_MEM_BUDGET.
+    """
+    return json.dumps(ac.pool.get_stats())
+
+
+@app.post("/get_all_agents")
+def get_all_agents(req: GetAllAgentsReq | None = None):
+    """
+    Returns every agent matching the optional filters, in id order.
+
+    Responds with {"agents": [...], "next_after_id": int | null}, streamed
+    as it is read from the database. When `limit` cut the listing short,
+    pass `next_after_id` back as `after_id` to get the next page.
+    """
+    if req is None:
+        req = GetAllAgentsReq()
+
+    (status, agents) = db.list_agents(
+        active=req.active,
+        team_name=req.team_name,
+        port_min=req.port_min,
+        port_max=req.port_max,
+        after_id=req.after_id,
+        limit=req.limit
     )
 
-    db.add_new_agent(new_agent)
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agents)})
+
+    def body():
+        yield '{"agents": ['
+        count = 0
+        last_id = None
+        for agent in agents:
+            yield ("," if count else "") + db.agent_to_json(agent)
+            count += 1
+            last_id = agent.id
+        more = req.limit is not None and count == req.limit
+        yield f'], "next_after_id": {json.dumps(last_id if more else None)}}}'
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+@app.get("/agents/{agent_id}")
+def get_agent(agent_id: str) -> str:
+    """
+    Returns one agent, looked up by agent id or container id.
+    Served from the agent registry.
+    """
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agent)})
+    return db.agent_to_json(agent)
+
+
+@app.get("/agents/{agent_id}/logs")
+async def get_agent_logs(
+        agent_id: str,
+        tail: int | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        follow: bool = False,
+        timestamps: bool = False):
+    """
+    Streams an agent's stdout and stderr as chunked plain text.
+
+    `tail` returns only the last lines, `since`/`until` (unix seconds)
+    a time window, and `follow` keeps the response open for new output.
+    The log is read from the daemon only as fast as the client reads it.
+    """
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    container_id = (agent.container_id if status == DB_query_status.SUCCESS
+                    else agent_id)
+
+    (status, stream) = await ac.logs.open(
+        container_id, tail=tail, since=since, until=until,
+        follow=follow, timestamps=timestamps)
+
+    if status != LOG_SC.OK:
+        return json.dumps({"status": "bad", "message": status.name})
+
+    async def body():
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            stream.close()
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/agents/{agent_id}/logs/history")
+def get_agent_log_history(
+        agent_id: str,
+        since: float = 0,
+        until: float | None = None,
+        timestamps: bool = False):
+    """
+    Streams an agent's stored log lines between `since` and `until` (unix
+    seconds) as plain text. Served from roker's log store, so it works
+    after the container is gone.
+    """
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    container_id = (agent.container_id if status == DB_query_status.SUCCESS
+                    else agent_id)
+
+    lines = ac.log_store.read(
+        container_id,
+        since=int(since * 1_000_000_000),
+        until=None if until is None else int(until * 1_000_000_000))
+
+    def body():
+        for (ts, line) in lines:
+            if timestamps:
+                (seconds, nanos) = divmod(ts, 1_000_000_000)
+                stamp = datetime.fromtimestamp(seconds, timezone.utc)
+                yield (f"{stamp:%Y-%m-%dT%H:%M:%S}.{nanos:09d}Z "
+                       ).encode("ascii")
+            yield line + b"\n"
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/agents/{agent_id}/stats")
+def get_agent_stats(agent_id: str, resolution: int = 60,
+                    since: int = 0) -> str:
+    """
+    Returns an agent's downsampled resource usage, oldest bucket first.
+    `resolution` is the bucket width in seconds: 1, 60 or 3600.
+    """
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agent)})
+
+    (status, rows) = db.get_agent_stats(agent.container_id, resolution, since)
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(rows)})
+
+    columns = ("container_id", "resolution", "bucket", "samples", "cpu_avg",
+               "cpu_max", "mem_avg", "mem_max", "net_rx", "net_tx",
+               "blk_read", "blk_write")
+    return json.dumps([dict(zip(columns, row)) for row in rows])
+
+
+@app.get("/agents/{agent_id}/health")
+def get_agent_health(agent_id: str) -> str:
+    """
+    Returns whether an agent answers its health probes, and a histogram
+    of how long they take.
+    """
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agent)})
+
+    health_data = health.get_health(agent.id)
+    if health_data is None:
+        return json.dumps({"status": "bad",
+                           "message": f"agent {agent.id} is not probed"})
+    return json.dumps(health_data)
+
+
+@app.get("/health_stats")
+def health_stats() -> str:
+    """Returns health probe counters"""
+    return json.dumps(health.get_stats())
+
+
+@app.post("/fanout")
+async def fanout_send(req: FanoutReq) -> str:
+    """
+    Sends `payload` to every agent in `agent_ids` at once (POST to `path`,
+    FANOUT_PATH by default) and returns what each one answered.
+
+    Each agent gets `deadline` seconds. Agents that did not answer in time,
+    or at all, are listed in `failures` with the reason instead.
+    """
+    # Numeric strings are row ids, as on every other endpoint
+    agent_ids = list(dict.fromkeys(
+        parse_agent_id(str(agent_id)) for agent_id in req.agent_ids))
+    result = await fanout.send(
+        agent_ids, req.payload, path=req.path, deadline=req.deadline)
 
     return json.dumps({
-        "port": task.port,
-        "status": "ok",
-        "container_id": task.container_id
+        "responses": result.responses,
+        "failures": {agent_id: status.name
+                     for (agent_id, status) in result.failures.items()},
+        "latency": result.latency,
     })
 
 
-@app.post("/get_all_agents")
-def get_all_agents() -> str:
+@app.get("/fanout_stats")
+def fanout_stats(agent_id: str | None = None) -> str:
+    """
+    Returns fan-out counters, or with `agent_id`, a histogram of how long
+    that agent takes to answer.
     """
-    [unimplemented]
+    if agent_id is None:
+        return json.dumps(fanout.get_stats())
+
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agent)})
+    return json.dumps(fanout.get_latency(agent.id))
 
-    Will eventually return every agent, their name, and
-    container id.
+
+@app.api_route(
+    "/agents/{agent_id}/proxy/{path:path}",
+    methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+async def proxy_agent(agent_id: str, path: str, request: Request):
     """
-    return json.dumps({"unimplemented": "unimplemented"})
+    Forwards a request to `path` on an agent, looked up by agent id or
+    container id, and streams its response back.
 
+    Calls go over a kept alive connection to the agent, and bodies are
+    streamed both ways. Answers 404 for unknown agents, 504 when the
+    agent timed out and 502 when it could not be reached.
+    """
+    has_body = ("content-length" in request.headers
+                or "transfer-encoding" in request.headers)
+    (status, response) = await proxy.open(
+        parse_agent_id(agent_id),
+        request.method,
+        path,
+        query=request.url.query,
+        headers=request.headers,
+        body=request.stream() if has_body else None
+    )
+
+    match status:
+        case PROXY_SC.OK:
+            pass
+        case PROXY_SC.NOT_FOUND:
+            return Response(
+                json.dumps({"status": "bad",
+                            "message": f"unknown agent {agent_id}"}),
+                status_code=404, media_type="application/json")
+        case PROXY_SC.TIMEOUT:
+            return Response(status_code=504)
+        case _:
+            return Response(status_code=502)
 
-@app.post("/get_all_containers")
-def get_all_containers() -> str:
+    async def body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await proxy.close(response)
+
+    return StreamingResponse(
+        body(),
+        status_code=response.status_code,
+        headers=forward_headers(response.headers)
+    )
+
+
+@app.get("/proxy_stats")
+def proxy_stats(agent_id: str | None = None) -> str:
+    """
+    Returns proxy counters, or with `agent_id`, a histogram of that
+    agent's upstream latency.
+    """
+    if agent_id is None:
+        return json.dumps(proxy.get_stats())
+
+    (status, agent) = registry.get_agent_data(parse_agent_id(agent_id))
+    if status != DB_query_status.SUCCESS:
+        return json.dumps({"status": "bad", "message": str(agent)})
+    return json.dumps(proxy.get_latency(agent.id))
+
+
+@app.post("/tournaments")
+async def start_tournament(req: TournamentReq) -> str:
+    """
+    Starts a tournament between agents, seeded in the given order.
+    `format` is round_robin, swiss or knockout; `rounds` only applies to
+    swiss. Returns the tournament id at once; poll /tournaments/{id}.
+    """
+    (status, tournament_id) = await tournaments.start(
+        req.agent_ids, req.format, req.table_size, req.rounds)
+
+    if status != TOURNAMENT_SC.OK:
+        return json.dumps({"status": "bad", "message": status.name})
+    return json.dumps({"status": "ok", "tournament_id": tournament_id})
+
+
+@app.get("/tournaments/{tournament_id}")
+def get_tournament(tournament_id: int) -> str:
+    """Returns a tournament's status, standings and tables"""
+    tournament = tournaments.get_tournament(tournament_id)
+    if tournament is None:
+        return json.dumps({"status": "bad",
+                           "message": f"unknown tournament {tournament_id}"})
+    return json.dumps(tournament)
+
+
+@app.get("/tournament_stats")
+def tournament_stats() -> str:
+    """Returns tournament scheduler counters"""
+    return json.dumps(tournaments.get_stats())
+
+
+@app.get("/stats/top")
+def stats_top(by: str = "cpu", n: int = 10) -> str:
+    """
+    Returns the `n` containers using the most CPU (`by=cpu`) or memory
+    (`by=mem`), going by each one's latest stats sample.
+    """
+    try:
+        return json.dumps(ac.stats.top(by, n))
+    except ValueError as e:
+        return json.dumps({"status": "bad", "message": str(e)})
+
+
+@app.get("/registry_stats")
+def registry_stats() -> str:
+    """Returns agent registry hit/miss counters"""
+    return json.dumps(registry.get_stats())
+
+
+@app.get("/gh_stats")
+def gh_stats() -> str:
+    """Returns repo metadata cache counters"""
+    return json.dumps(gh.get_stats())
+
+
+@app.api_route("/get_all_containers", methods=["GET", "POST"])
+async def get_all_containers(
+        response: Response,
+        since: int | None = None,
+        if_none_match: str | None = Header(default=None)):
     """
-    Returns all known containers.
-    Not entirely useful at the moment.
+    Returns the container id of every active agent, keyed by port.
+
+    Served from a snapshot shared by every poller and refreshed at most
+    every SNAPSHOT_TTL seconds. The snapshot version is sent as the ETag
+    (and X-Roker-Version) header:
+        - send it back as If-None-Match to get a 304 if nothing changed
+        - pass the version as `since` to get only what changed:
+          {"version", "complete", "changed", "removed"}. When `complete`
+          is false, `changed` is the whole fleet and replaces the client's
+          copy.
     """
-    res = {}
-    print(ac.client.containers.list(all=True))
-    for container in ac.active_containers.values():
-        res[container.port_number] = container.container.id
-    return json.dumps(res)
+    snapshot = await containers_snapshot.get()
+    headers = {"ETag": snapshot.etag,
+               "X-Roker-Version": str(snapshot.version)}
+
+    if if_none_match == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    if since is None:
+        return json.dumps(snapshot.data)
+
+    delta = await containers_snapshot.delta(since)
+    # The snapshot may have been refreshed in between
+    response.headers.update({"ETag": delta.etag,
+                             "X-Roker-Version": str(delta.version)})
+    return json.dumps(dataclasses.asdict(delta))
 
 
-# TODO: Need to work on all returns!
-# Should return that it failed to kill agents
 @app.delete("/kill_all_agents")
-def kill_all_agents():
+async def kill_all_agents() -> str:
     """
-    Kills all docker containers on the machine.
-    DANGEROUS AF
+    Kills and removes every container roker started (containers of other
+    programs on the host are left alone), concurrently.
+
+    Every agent whose container was removed is marked inactive in a
+    single transaction. Returns a result per container.
     """
-    for container in ac.client.containers.list(all=True):
-        try:
-            container.remove()
-        except docker.errors.APIError as e:
-            print(f"failed to remove a conatiner: {e}")
-    return json.dumps({"ok": "ok"})
+    results = await ac.teardown_all()
+
+    updates = []
+    for res in results:
+        if res.status != DC_SC.OK:
+            continue
+        (status, agent) = registry.get_agent_data(res.container_id)
+        if status == DB_query_status.SUCCESS:
+            updates.append((agent.id, {"active": False}))
+
+    if len(updates) > 0:
+        registry.update_agents_data(updates)
+        for (agent_id, _) in updates:
+            health.unwatch(agent_id)
+            fanout.forget(agent_id)
+            await proxy.forget(agent_id)
+            registry.invalidate(agent_id)
+
+    removed = sum(1 for res in results if res.status == DC_SC.OK)
+    return json.dumps({
+        "removed": removed,
+        "failed": len(results) - removed,
+        "containers": [{
+            "container_id": res.container_id,
+            "status": "ok" if res.status == DC_SC.OK else "bad",
+            "port": res.port,
+            "message": res.message
+        } for res in results],
+    })
 
 
 @app.post("/kill_agent")
@@ -109,7 +809,21 @@ async def kill_agent(req: KillAgentReq) -> str:
     """
     Kills a specific docker container given a container id
     """
-    res = await ac.kill_conatiner(req.container_id)
+    # Agents are registered under full container ids, so short ids and
+    # names are resolved with the daemon first
+    container_id = await ac.resolve_container_id(req.container_id)
+    if container_id is None:
+        return json.dumps({"message": f"No container {req.container_id}"})
+    (status, agent) = registry.get_agent_data(container_id)
+
+    res = await ac.kill_conatiner(container_id)
+
+    if res == DC_SC.OK and status == DB_query_status.SUCCESS:
+        health.unwatch(agent.id)
+        fanout.forget(agent.id)
+        await proxy.forget(agent.id)
+        registry.update_agent_data(agent.id, {"active": False})
+        registry.invalidate(agent.id)
 
     match res:
         case DC_SC.FAILED_TO_KILL_DOCKER_C:
@@ -122,33 +836,120 @@ async def kill_agent(req: KillAgentReq) -> str:
 
 
 @app.post('/test/print_conatiner_logs')
-def get_conatiner_logs(req: GetLogsReq) -> str:
-    try:
-        print(ac.client.containers.get(req.container_id).logs().decode('utf-8'))
-    except docker.errors.APIError as e:
-        print(f"[/test/print_conatiner_logs] ERROR: {e}")
+async def get_conatiner_logs(req: GetLogsReq) -> str:
+    (status, stream) = await ac.logs.open(req.container_id)
+    if status != LOG_SC.OK:
+        print(f"[/test/print_conatiner_logs] ERROR: {status.name} {stream}")
         return json.dumps({"bad": "bad"})
 
+    try:
+        async for chunk in stream:
+            print(chunk.decode('utf-8', errors='replace'), end="")
+    finally:
+        stream.close()
+
     return json.dumps({"ok": "ok"})
 
 
 @app.post("/restart_agent")
-def restart_agent() -> str:
+async def restart_agent(req: RestartAgentReq) -> StreamingResponse:
     """
-    Will eventually restart a docker container given a
-    container id.
+    Restarts agents in place, looked up by agent id or container id.
+
+    Each agent keeps its container, port, agents row and compiled
+    artifact, so it comes back without a rebuild. At most `parallelism`
+    agents (capped by MAX_BATCH_PARALLELISM) are restarted or coming back
+    up at once. Agents that were killed are refused.
+
+    The response is newline delimited json: one line per agent once it
+    passed a health probe again (or `timeout` seconds ran out), with the
+    seconds it took to restart and to become healthy, followed by a
+    summary line.
     """
-    ac.restart_conatiner("")
-    return json.dumps({"unimplemented": "unimplemented"})
+    parallelism = max(1, min(req.parallelism, MAX_BATCH_PARALLELISM))
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async def restart(agent_id: int | str) -> dict:
+        async with semaphore:
+            (status, agent) = registry.get_agent_data(
+                parse_agent_id(str(agent_id)))
+            if status != DB_query_status.SUCCESS:
+                return {"agent_id": agent_id, "status": "bad",
+                        "message": f"unknown agent {agent_id}"}
+
+            started = time.monotonic()
+            # The restart's own die and start events must not touch the
+            # watch set up here
+            health.hold(agent.id)
+            try:
+                # Probes must not pass on the agent that is going away
+                health.unwatch(agent.id)
+                res = await ac.restart_conatiner(agent.container_id)
+                restarted = time.monotonic() - started
+                if res != DC_SC.OK:
+                    # A killed agent's port may belong to another by now;
+                    # it is not watched again
+                    return {"agent_id": agent.id, "status": "bad",
+                            "message": res.name}
+                health.watch(agent.id, agent.container_id,
+                             agent.port_number)
+
+                # Kept alive connections died with the old process
+                await proxy.forget(agent.id)
+                healthy = await health.wait_healthy(agent.id, req.timeout)
+            finally:
+                health.release(agent.id)
+            return {
+                "agent_id": agent.id,
+                "container_id": agent.container_id,
+                "port": agent.port_number,
+                "status": "ok",
+                "healthy": healthy,
+                "restart_time": restarted,
+                "time_to_healthy": time.monotonic() - started
+                if healthy else None,
+            }
+
+    async def results():
+        tasks = [asyncio.create_task(restart(agent_id))
+                 for agent_id in dict.fromkeys(req.agent_ids)]
+        times = []
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                res = await next_done
+                if res["status"] != "ok":
+                    failed += 1
+                elif res["healthy"]:
+                    times.append(res["time_to_healthy"])
+                yield json.dumps(res) + "\n"
+        finally:
+            # Client went away early; do not start the restarts still queued
+            for task in tasks:
+                task.cancel()
+
+        yield json.dumps({
+            "status": "ok",
+            "restarted": len(tasks) - failed,
+            "failed": failed,
+            "healthy": len(times),
+            "max_time_to_healthy": max(times) if times else None,
+        }) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 
 @app.post("/commands")
 def command(req: CommandReq) -> str:
-    container = ac.client.containers.get(req.container_id)
-    print(container.status)
-    container.reload()
-    print(container.status)
-    return json.dumps({"ok": "ok"})
+    """
+    Returns a container's status, exit code and whether it was OOM killed.
+    Served from the docker events subscriber, without asking the daemon.
+    """
+    state = ac.events.get_state(req.container_id)
+    if state is None:
+        return json.dumps({"status": "bad",
+                           "message": f"unknown container {req.container_id}"})
+    return json.dumps(dataclasses.asdict(state))
 
 
 def start():
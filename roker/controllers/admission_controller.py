@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import os
+from dataclasses import dataclass
+from enum import IntEnum
+from time import monotonic
+from dotenv import load_dotenv
+
+from roker.controllers.engine_controller import mem_limit_to_bytes
+
+load_dotenv()
+
+# Share of the host's memory containers may commit, when
+# ADMISSION_MEM_BUDGET is not set
+DEFAULT_ADMISSION_MEM_FRACTION = 0.8
+DEFAULT_ADMISSION_QUEUE_LIMIT = 1024
+
+
+def host_mem_bytes() -> int:
+    """Physical memory of the host, 0 when it can not be read"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def default_mem_budget() -> int:
+    budget = os.getenv("ADMISSION_MEM_BUDGET", "")
+    if budget != "":
+        return mem_limit_to_bytes(budget)
+    return int(host_mem_bytes() * DEFAULT_ADMISSION_MEM_FRACTION)
+
+
+class ADM_SC(IntEnum):
+    QUEUE_FULL = -2
+    TOO_LARGE = -1
+    OK = 0
+
+
+@dataclass
+class Reservation:
+    """
+    Memory (bytes) and CPUs committed to one container.
+
+    container_id: set once the container exists, so the reservation can be
+                  released when it is killed
+    """
+    ticket: int
+    mem: int
+    cpus: float
+    priority: int = 0
+    container_id: str | None = None
+    queued_at: float = 0.0
+
+
+class AdmissionController:
+    """
+    Keeps the memory and CPUs committed to containers within a host budget.
+
+    `acquire` commits a container's share right away if it fits and nobody
+    is waiting, and otherwise queues the request until it does. Waiters
+    are admitted highest `priority` first, first come first served within
+    a priority. The head of the queue is never skipped for a smaller
+    request behind it, so large requests are not starved.
+
+    `try_acquire` never waits and never jumps the queue; it is for
+    optional work, like filling the warm pool.
+    """
+
+    def __init__(
+        self,
+        mem_budget: int | None = None,
+        cpu_budget: float = float(os.getenv(
+            "ADMISSION_CPU_BUDGET", os.cpu_count() or 1)),
+        queue_limit: int = int(os.getenv(
+            "ADMISSION_QUEUE_LIMIT", DEFAULT_ADMISSION_QUEUE_LIMIT))
+    ):
+        self._mem_budget: int = (default_mem_budget() if mem_budget is None
+                                 else mem_budget)
+        self._cpu_budget: float = cpu_budget
+        self._queue_limit: int = queue_limit
+
+        self._tickets = itertools.count(1)
+        self._mem: int = 0
+        self._cpus: float = 0.0
+        self._committed: dict[int, Reservation] = {}
+        self._by_container: dict[str, int] = {}
+        # (-priority, ticket, reservation, future, on_queued)
+        self._queue: list[tuple] = []
+
+        self._admitted: int = 0
+        self._queued: int = 0
+        self._rejected: int = 0
+        self._waits: int = 0
+        self._wait_total: float = 0.0
+
+    # PUBLIC
+
+    async def acquire(
+            self,
+            mem: int,
+            cpus: float,
+            priority: int = 0,
+            on_queued=None) -> (ADM_SC, Reservation | None):
+        """
+        Commits `mem` bytes and `cpus` CPUs, waiting in the queue for them
+        if need be.
+
+        `on_queued` is called with the request's 1 based queue position
+        when it is queued, and again every time the queue moves.
+        """
+        if mem > self._mem_budget or cpus > self._cpu_budget:
+            self._rejected += 1
+            return (ADM_SC.TOO_LARGE, None)
+
+        reservation = Reservation(next(self._tickets), mem, cpus, priority)
+        if len(self._queue) == 0 and self._fits(reservation):
+            self._commit(reservation)
+            return (ADM_SC.OK, reservation)
+
+        if len(self._queue) >= self._queue_limit:
+            self._rejected += 1
+            return (ADM_SC.QUEUE_FULL, None)
+
+        reservation.queued_at = monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = (-priority, reservation.ticket, reservation, future,
+                 on_queued)
+        heapq.heappush(self._queue, entry)
+        self._queued += 1
+        self._notify_positions()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller gave up
+                self.release(reservation)
+            elif entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._admit()
+            raise
+
+        self._waits += 1
+        self._wait_total += monotonic() - reservation.queued_at
+        return (ADM_SC.OK, reservation)
+
+    def try_acquire(self, mem: int, cpus: float) -> Reservation | None:
+        """Commits `mem` and `cpus` only if they fit with nobody waiting"""
+        reservation = Reservation(next(self._tickets), mem, cpus)
+        if len(self._queue) > 0 or not self._fits(reservation):
+            return None
+        self._commit(reservation)
+        return reservation
+
+    def adopt(self, container_id: str, mem: int, cpus: float) -> Reservation:
+        """
+        Commits `mem` and `cpus` for a container that is running already,
+        like one left from before a restart of roker, unless it holds a
+        reservation. The container uses them whether they fit or not, so
+        they are committed even past the budget, and waiters wait for the
+        host to free up.
+        """
+        ticket = self._by_container.get(container_id)
+        if ticket is not None:
+            return self._committed[ticket]
+        reservation = Reservation(next(self._tickets), mem, cpus)
+        self._commit(reservation)
+        self.bind(reservation, container_id)
+        return reservation
+
+    def bind(self, reservation: Reservation, container_id: str):
+        """Ties a reservation to the container it was made for"""
+        reservation.container_id = container_id
+        self._by_container[container_id] = reservation.ticket
+
+    def release(self, reservation: Reservation):
+        """Hands a reservation back and admits whoever now fits"""
+        if self._committed.pop(reservation.ticket, None) is None:
+            return
+        if reservation.container_id is not None:
+            self._by_container.pop(reservation.container_id, None)
+        self._mem -= reservation.mem
+        self._cpus -= reservation.cpus
+        self._admit()
+
+    def release_container(self, container_id: str):
+        """Releases the reservation of a container that is gone"""
+        ticket = self._by_container.get(container_id)
+        if ticket is not None:
+            self.release(self._committed[ticket])
+
+    def get_queue(self) -> list[dict]:
+        """Waiting requests, in the order they will be admitted"""
+        now = monotonic()
+        return [{
+            "position": i + 1,
+            "ticket": reservation.ticket,
+            "priority": reservation.priority,
+            "mem": reservation.mem,
+            "cpus": reservation.cpus,
+            "waited": now - reservation.queued_at,
+        } for (i, (_, _, reservation, _, _))
+            in enumerate(sorted(self._queue, key=lambda e: e[:2]))]
+
+    def get_stats(self) -> dict:
+        return {
+            "mem_budget": self._mem_budget,
+            "mem_committed": self._mem,
+            "cpu_budget": self._cpu_budget,
+            "cpus_committed": self._cpus,
+            "reservations": len(self._committed),
+            "waiting": len(self._queue),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": self._rejected,
+            "mean_wait": self._wait_total / self._waits
+            if self._waits else 0.0,
+        }
+
+    # PRIVATE
+
+    def _fits(self, reservation: Reservation) -> bool:
+        return (self._mem + reservation.mem <= self._mem_budget
+                and self._cpus + reservation.cpus <= self._cpu_budget)
+
+    def _commit(self, reservation: Reservation):
+        self._committed[reservation.ticket] = reservation
+        self._mem += reservation.mem
+        self._cpus += reservation.cpus
+        self._admitted += 1
+
+    def _admit(self):
+        admitted = False
+        while len(self._queue) > 0:
+            (_, _, reservation, future, _) = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._fits(reservation):
+                break
+            heapq.heappop(self._queue)
+            self._commit(reservation)
+            future.set_result(None)
+            admitted = True
+
+        if admitted:
+            self._notify_positions()
+
+    def _notify_positions(self):
+        for (i, (_, _, _, _, on_queued)) in enumerate(
+                sorted(self._queue, key=lambda e: e[:2])):
+            if on_queued is None:
+                continue
+            try:
+                on_queued(i + 1)
+            except Exception as e:
+                print(f"[AdmissionController._notify_positions] {e}")
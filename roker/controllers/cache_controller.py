@@ -0,0 +1,403 @@
+import asyncio
+import functools
+import hashlib
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import IntEnum
+from dotenv import load_dotenv
+
+from roker.controllers.engine_controller import mem_limit_to_bytes
+
+load_dotenv()
+
+DEFAULT_ARTIFACT_CACHE_DIR = "/.roker/artifacts/"
+DEFAULT_ARTIFACT_CACHE_BUDGET = "2g"
+DEFAULT_GIT_LS_REMOTE_TIMEOUT = 15.0
+
+# File every build recipe is expected to leave in its output directory
+ARTIFACT_NAME = "agent.jar"
+
+# In-progress builds are written here and renamed into place when done
+_PARTIAL_SUFFIX = ".partial"
+
+
+class CACHE_SC(IntEnum):
+    BUILD_FAILED = -2
+    MISSING_ARTIFACT = -1
+    HIT = 0
+    BUILT = 1
+
+
+@dataclass
+class Artifact:
+    """
+    status: status code
+    key:    content address of the artifact
+    path:   host directory holding ARTIFACT_NAME
+    size:   size of the directory in bytes
+    """
+    status: CACHE_SC
+    key: str = ""
+    path: str = ""
+    size: int = 0
+
+
+def artifact_key(repo_url: str, commit_sha: str, recipe_hash: str) -> str:
+    """Content address for a build of `repo_url` at `commit_sha`"""
+    return hashlib.sha256(
+        f"{repo_url}\n{commit_sha}\n{recipe_hash}".encode("utf-8")
+    ).hexdigest()
+
+
+def recipe_hash(recipe_path: str) -> str | None:
+    """
+    Hashes a build recipe (script) so that changing the recipe invalidates
+    every artifact built with it.
+
+    @return the hex digest, or None if the recipe can not be read
+    """
+    try:
+        with open(recipe_path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except OSError:
+        return None
+
+
+async def resolve_commit(
+        repo_url: str,
+        ref: str = "HEAD",
+        timeout: float = DEFAULT_GIT_LS_REMOTE_TIMEOUT) -> str | None:
+    """
+    Resolves `ref` of a remote repo to a commit sha without cloning it.
+
+    @return the commit sha, or None if it could not be resolved
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "git", "ls-remote", repo_url, ref,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+        )
+    except OSError as e:
+        print(f"[resolve_commit] failed to run git: {e}")
+        return None
+
+    try:
+        (out, _) = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        print(f"[resolve_commit] timed out resolving {repo_url}")
+        return None
+
+    if proc.returncode != 0 or out == b"":
+        return None
+    return out.split()[0].decode("utf-8")
+
+
+@dataclass
+class _Build:
+    """
+    A build owned by the cache.
+
+    waiters: callers awaiting the build. It is cancelled when they all
+             gave up.
+    """
+    task: asyncio.Task
+    waiters: int = 0
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class ArtifactCache:
+    """
+    Host side cache of build artifacts, keyed by
+    (repo url, commit sha, build recipe hash).
+
+    `builder` is an async callable `builder(repo_url, commit_sha, out_dir)`
+    that must leave ARTIFACT_NAME in `out_dir` and return True on success.
+
+    Concurrent requests for the same key share one build, run by the cache
+    rather than by any one caller, so a caller giving up does not fail
+    the others. Artifacts are
+    evicted least recently used first once the cache exceeds `disk_budget`
+    bytes. Pinned artifacts (mounted by a running container) are never
+    evicted.
+    """
+
+    def __init__(
+        self,
+        builder,
+        cache_dir: str = os.path.expanduser("~") + os.getenv(
+            "ARTIFACT_CACHE_DIR", DEFAULT_ARTIFACT_CACHE_DIR),
+        disk_budget: int = mem_limit_to_bytes(os.getenv(
+            "ARTIFACT_CACHE_BUDGET", DEFAULT_ARTIFACT_CACHE_BUDGET))
+    ):
+        self._builder = builder
+        self._cache_dir: str = cache_dir
+        self._disk_budget: int = disk_budget
+
+        # key -> size in bytes, least recently used first
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._building: dict[str, _Build] = {}
+        self._pins: dict[str, int] = {}
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._builds: int = 0
+        self._evictions: int = 0
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        self._load()
+
+    # PUBLIC
+
+    async def get(
+            self,
+            repo_url: str,
+            commit_sha: str,
+            recipe: str) -> Artifact:
+        """
+        Returns the artifact for `repo_url` at `commit_sha` built with the
+        recipe hashed as `recipe`, building it if needed.
+
+        A successful result comes back pinned, so it can not be evicted
+        before the caller mounts it. The caller must `unpin(artifact.key)`
+        once it no longer needs the artifact.
+
+        @return Artifact with status
+            CACHE_SC.HIT:              already cached
+            CACHE_SC.BUILT:            built by this call, or by a concurrent
+                                       call this one waited on
+            CACHE_SC.BUILD_FAILED:     the builder failed
+            CACHE_SC.MISSING_ARTIFACT: the builder did not produce
+                                       ARTIFACT_NAME
+        """
+        key = artifact_key(repo_url, commit_sha, recipe)
+
+        if key in self._entries:
+            self._hits += 1
+            self._touch(key)
+            self.pin(key)
+            return self._artifact(CACHE_SC.HIT, key)
+
+        self._misses += 1
+
+        build = self._start_build(key, repo_url, commit_sha)
+        build.waiters += 1
+        try:
+            return await asyncio.shield(build.task)
+        except asyncio.CancelledError:
+            if not build.task.done():
+                build.waiters -= 1
+                if build.waiters == 0:
+                    build.task.cancel()
+            elif (not build.task.cancelled()
+                  and build.task.exception() is None
+                  and build.task.result().status == CACHE_SC.BUILT):
+                # The build pinned the artifact for this caller
+                self.unpin(key)
+            raise
+
+    def lookup(
+            self,
+            repo_url: str,
+            commit_sha: str,
+            recipe: str) -> Artifact | None:
+        """
+        Like `get`, but never builds: returns the artifact pinned if it is
+        already cached, and None otherwise.
+        """
+        key = artifact_key(repo_url, commit_sha, recipe)
+        if key not in self._entries:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._touch(key)
+        self.pin(key)
+        return self._artifact(CACHE_SC.HIT, key)
+
+    def prefetch(self, repo_url: str, commit_sha: str, recipe: str):
+        """Builds an artifact in the background, if it is not cached yet"""
+        key = artifact_key(repo_url, commit_sha, recipe)
+        if key in self._entries:
+            return
+        build = self._start_build(key, repo_url, commit_sha)
+        # Nobody awaits it; keep asyncio from complaining if it raises
+        build.task.add_done_callback(
+            lambda task: task.cancelled() or task.exception())
+
+    def pin(self, key: str):
+        """Protects an artifact from eviction while it is mounted"""
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, key: str):
+        """Releases a pin taken with `pin`"""
+        if key not in self._pins:
+            return
+        self._pins[key] -= 1
+        if self._pins[key] <= 0:
+            del self._pins[key]
+            self._evict()
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "builds": self._builds,
+            "evictions": self._evictions,
+            "entries": len(self._entries),
+            "bytes": sum(self._entries.values()),
+            "disk_budget": self._disk_budget,
+        }
+
+    # PRIVATE
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key)
+
+    def _artifact(self, status: CACHE_SC, key: str) -> Artifact:
+        return Artifact(
+            status=status,
+            key=key,
+            path=self._path(key),
+            size=self._entries.get(key, 0)
+        )
+
+    def _load(self):
+        """Rebuilds the LRU index from what is already on disk"""
+        found = []
+        for name in os.listdir(self._cache_dir):
+            path = self._path(name)
+            if name.endswith(_PARTIAL_SUFFIX):
+                # Left over from a build that never finished
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if os.path.isfile(os.path.join(path, ARTIFACT_NAME)):
+                found.append((os.path.getmtime(path), name, _dir_size(path)))
+
+        for (_, name, size) in sorted(found):
+            self._entries[name] = size
+        self._evict()
+
+    def _touch(self, key: str):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _start_build(
+            self,
+            key: str,
+            repo_url: str,
+            commit_sha: str) -> _Build:
+        """The build of `key` in progress, starting it if there is none"""
+        build = self._building.get(key)
+        # A build whose waiters all gave up is on its way out
+        if build is None or build.task.cancelling():
+            build = _Build(task=asyncio.create_task(
+                self._run_build(key, repo_url, commit_sha)))
+            self._building[key] = build
+        return build
+
+    async def _run_build(
+            self,
+            key: str,
+            repo_url: str,
+            commit_sha: str) -> Artifact:
+        build = self._building[key]
+        try:
+            res = await self._build(key, repo_url, commit_sha)
+        finally:
+            if self._building.get(key) is build:
+                del self._building[key]
+
+        if res.status == CACHE_SC.BUILT:
+            # One pin per caller sharing this build
+            for _ in range(build.waiters):
+                self.pin(key)
+        return res
+
+    async def _build(
+            self,
+            key: str,
+            repo_url: str,
+            commit_sha: str) -> Artifact:
+        partial = self._path(f"{key}.{uuid.uuid4().hex}{_PARTIAL_SUFFIX}")
+        os.makedirs(partial)
+        self._builds += 1
+
+        try:
+            try:
+                ok = await self._builder(repo_url, commit_sha, partial)
+            except Exception as e:
+                print(f"[ArtifactCache._build] builder raised: {e}")
+                ok = False
+
+            if not ok:
+                return Artifact(status=CACHE_SC.BUILD_FAILED, key=key)
+
+            if not os.path.isfile(os.path.join(partial, ARTIFACT_NAME)):
+                return Artifact(status=CACHE_SC.MISSING_ARTIFACT, key=key)
+
+            size = await asyncio.to_thread(_dir_size, partial)
+            await asyncio.to_thread(
+                shutil.rmtree, self._path(key), ignore_errors=True)
+            os.rename(partial, self._path(key))
+        finally:
+            # Failed, cancelled, or raised before the rename
+            if os.path.exists(partial):
+                await asyncio.shield(asyncio.to_thread(
+                    shutil.rmtree, partial, ignore_errors=True))
+
+        self._entries[key] = size
+        self._touch(key)
+        # The new artifact is about to be mounted; never evict it here
+        self._evict(keep=key)
+
+        return self._artifact(CACHE_SC.BUILT, key)
+
+    def _evict(self, keep: str = None):
+        """Drops least recently used, unpinned artifacts until under budget"""
+        total = sum(self._entries.values())
+
+        for key in list(self._entries.keys()):
+            if total <= self._disk_budget:
+                return
+            if key in self._pins or key == keep:
+                continue
+            total -= self._entries.pop(key)
+            self._remove(key)
+            self._evictions += 1
+
+    def _remove(self, key: str):
+        """
+        Moves an artifact out of the way at once, then deletes it off the
+        event loop. Left overs are cleaned up by `_load`.
+        """
+        doomed = self._path(f"{key}.{uuid.uuid4().hex}{_PARTIAL_SUFFIX}")
+        try:
+            os.rename(self._path(key), doomed)
+        except OSError:
+            return
+        try:
+            asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(
+                    shutil.rmtree, doomed, ignore_errors=True))
+        except RuntimeError:
+            # No loop running
+            shutil.rmtree(doomed, ignore_errors=True)
@@ -1,5 +1,14 @@
+import dataclasses
+import functools
+import json
 import os
+import queue
 import sqlite3
+import threading
+import uuid
+
+from concurrent.futures import Future
+from time import monotonic
 
 from enum import IntEnum
 from dataclasses import dataclass
@@ -11,6 +20,163 @@ load_dotenv()
 
 DEFAULT_SQLITE3_DB_DIR = "/.roker/"
 DEFAULT_SQLITE3_DB_NAME = "database.db"
+DEFAULT_SQLITE3_SYNCHRONOUS = "NORMAL"
+DEFAULT_SQLITE3_BUSY_TIMEOUT_MS = 5000
+DEFAULT_SQLITE3_CACHED_STATEMENTS = 256
+DEFAULT_SQLITE3_WB_INTERVAL_MS = 50
+DEFAULT_SQLITE3_WB_BATCH_SIZE = 256
+DEFAULT_LIST_AGENTS_CHUNK_SIZE = 500
+
+# Every table roker uses. Run in order by _initialize_db on connect.
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS agents\
+        (\
+            id              INTEGER PRIMARY KEY,\
+            container_name  TEXT NOT NULL UNIQUE,\
+            container_id    TEXT NOT NULL UNIQUE,\
+            start_time      TEXT NOT NULL,\
+            team_name       TEXT,\
+            team_members    TEXT,\
+            port_number     INT NOT NULL,\
+            active          INT\
+         )",
+    # Secondary indexes for DB_Controller.list_agents. Each ends in id so
+    # the keyset (id > ?) ordering is served straight from the index.
+    "CREATE INDEX IF NOT EXISTS agents_active_idx ON agents(active, id)",
+    "CREATE INDEX IF NOT EXISTS agents_team_name_idx\
+        ON agents(team_name, id)",
+    "CREATE INDEX IF NOT EXISTS agents_port_number_idx\
+        ON agents(port_number, id)",
+    # container_id is NULL between reserving a port and the container
+    # being created
+    "CREATE TABLE IF NOT EXISTS port_leases\
+        (\
+            port            INTEGER PRIMARY KEY,\
+            container_id    TEXT,\
+            leased_at       TEXT NOT NULL\
+         )",
+    # Downsampled container resource usage, written by StatsController.
+    # resolution is the bucket width in seconds (1, 60 or 3600) and bucket
+    # the unix time the bucket starts at. Network and block I/O are the
+    # cumulative byte counters at the end of the bucket.
+    "CREATE TABLE IF NOT EXISTS agent_stats\
+        (\
+            container_id    TEXT NOT NULL,\
+            resolution      INT NOT NULL,\
+            bucket          INT NOT NULL,\
+            samples         INT NOT NULL,\
+            cpu_avg         REAL,\
+            cpu_max         REAL,\
+            mem_avg         INT,\
+            mem_max         INT,\
+            net_rx          INT,\
+            net_tx          INT,\
+            blk_read        INT,\
+            blk_write       INT,\
+            PRIMARY KEY (container_id, resolution, bucket)\
+         )",
+    "CREATE INDEX IF NOT EXISTS agent_stats_bucket_idx\
+        ON agent_stats(resolution, bucket)",
+    # Repo metadata files cached by GHController, with the validators to
+    # revalidate them. fetched_at is the unix time of the last fetch or
+    # successful revalidation.
+    "CREATE TABLE IF NOT EXISTS gh_metadata\
+        (\
+            url             TEXT PRIMARY KEY,\
+            status_code     INT NOT NULL,\
+            body            TEXT NOT NULL,\
+            etag            TEXT,\
+            last_modified   TEXT,\
+            fetched_at      REAL NOT NULL\
+         )",
+    # Tournaments run by TournamentController. agents is the json list of
+    # entrants, in seeding order.
+    "CREATE TABLE IF NOT EXISTS tournaments\
+        (\
+            id              INTEGER PRIMARY KEY,\
+            format          TEXT NOT NULL,\
+            table_size      INT NOT NULL,\
+            agents          TEXT NOT NULL,\
+            status          TEXT NOT NULL,\
+            created_at      TEXT NOT NULL,\
+            finished_at     TEXT\
+         )",
+    # One row per table of a tournament. seats is the json list of agent
+    # ids and scores the json object of agent id -> score once played.
+    "CREATE TABLE IF NOT EXISTS tournament_tables\
+        (\
+            tournament_id   INT NOT NULL,\
+            number          INT NOT NULL,\
+            round           INT NOT NULL,\
+            seats           TEXT NOT NULL,\
+            scores          TEXT,\
+            status          TEXT NOT NULL,\
+            started_at      REAL,\
+            finished_at     REAL,\
+            PRIMARY KEY (tournament_id, number)\
+         )",
+    # Background jobs run by JobController. params and result are json,
+    # stages the json list of [stage, unix time] the job went through.
+    "CREATE TABLE IF NOT EXISTS jobs\
+        (\
+            id              INTEGER PRIMARY KEY,\
+            kind            TEXT NOT NULL,\
+            params          TEXT NOT NULL,\
+            status          TEXT NOT NULL,\
+            stages          TEXT NOT NULL,\
+            result          TEXT,\
+            error           TEXT,\
+            created_at      REAL NOT NULL,\
+            finished_at     REAL\
+         )",
+]
+
+INSERT_AGENT_STATS_SQL = "INSERT OR REPLACE INTO agent_stats(\
+        container_id, resolution, bucket, samples, cpu_avg, cpu_max,\
+        mem_avg, mem_max, net_rx, net_tx, blk_read, blk_write)\
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?)"
+
+INSERT_AGENT_SQL = "INSERT INTO agents(\
+        container_name, container_id,\
+        start_time, team_name, team_members,\
+        port_number, active)\
+        VALUES(?,?,?,?,?,?,?)"
+
+# Columns of the agents table update_agent_data may set
+UPDATABLE_AGENT_COLUMNS = ("team_members", "team_name", "active",
+                           "port_number")
+
+
+# The query builders below only ever interpolate column names from the
+# whitelists above, never values. Memoizing by shape hands sqlite the exact
+# same string for the same shape, so its statement cache skips the re-parse.
+
+@functools.lru_cache(maxsize=None)
+def select_agent_sql(match_column: str) -> str:
+    """SELECT of one agent, matched on `match_column` (id | container_id)"""
+    return f"SELECT * FROM agents WHERE {match_column}=?"
+
+
+@functools.lru_cache(maxsize=None)
+def list_agents_sql(filters: tuple[str, ...]) -> str:
+    """
+    Keyset paginated SELECT of agents after a given id.
+    `filters` are (column, operator) pairs, e.g. ("active", "=").
+    Parameters are the last seen id, each filter value in order, then the
+    page size.
+    """
+    where = " ".join(f"AND {column}{op}?" for (column, op) in filters)
+    return f"SELECT * FROM agents WHERE id>? {where} ORDER BY id LIMIT ?"
+
+
+@functools.lru_cache(maxsize=None)
+def update_agent_sql(columns: tuple[str, ...], match_column: str) -> str:
+    """
+    UPDATE setting `columns` on the agent matched on `match_column`.
+    Parameters are the column values in order, then the match value.
+    """
+    assignments = ", ".join(f"{column}=?" for column in columns)
+    return f"UPDATE agents SET {assignments} WHERE {match_column}=?"
 
 
 @dataclass
@@ -25,8 +191,8 @@ class Agent:
     active: bool = False
 
 
-# https://docs.python.org/3/library/sqlite3.html#sqlite3.threadsafety
-sqlite3.threadsafety = 3
+# Queued by DB_Controller.close to stop the write-behind writer thread
+_STOP_WRITER = object()
 
 
 class DB_new_agent_status(IntEnum):
@@ -54,6 +220,7 @@ class DB_query_status(IntEnum):
     SQLITE3_NOT_CONNECT = -1
     SUCCESS = 0
     NO_RESULT = 1
+    QUEUED = 2
 
 
 class DB_connect_status(IntEnum):
@@ -62,16 +229,71 @@ class DB_connect_status(IntEnum):
 
 
 class DB_Controller:
+    """
+    Storage engine for roker, backed by sqlite3.
+
+    Every thread gets its own connection, opened lazily the first time that
+    thread touches `_con`, so FastAPI's threadpool and the event loop never
+    share one. File databases run in WAL mode, so readers never wait on a
+    writer's commit. Statements are kept as constant, parameterized SQL so
+    each connection's statement cache can reuse them.
+
+    With `write_behind` on, agent updates are queued instead of committed
+    one by one. A single writer thread drains the queue, committing every
+    `write_behind_interval_ms` or every `write_behind_batch_size` writes,
+    whichever comes first. See `update_agent_data` for awaiting a write.
+    """
+
     def __init__(
         self,
         db_name: str = os.getenv("SQLITE_DB_NAME", DEFAULT_SQLITE3_DB_NAME),
         db_dir: str = os.getenv("SQLITE_DB_DIR", DEFAULT_SQLITE3_DB_DIR),
-        in_memory_db: bool = os.getenv("SQLITE3_IN_MEMORY") == 'True'
+        in_memory_db: bool = os.getenv("SQLITE3_IN_MEMORY") == 'True',
+        synchronous: str = os.getenv(
+            "SQLITE3_SYNCHRONOUS", DEFAULT_SQLITE3_SYNCHRONOUS),
+        busy_timeout_ms: int = int(os.getenv(
+            "SQLITE3_BUSY_TIMEOUT_MS", DEFAULT_SQLITE3_BUSY_TIMEOUT_MS)),
+        cached_statements: int = int(os.getenv(
+            "SQLITE3_CACHED_STATEMENTS", DEFAULT_SQLITE3_CACHED_STATEMENTS)),
+        write_behind: bool = os.getenv("SQLITE3_WRITE_BEHIND") == 'True',
+        write_behind_interval_ms: int = int(os.getenv(
+            "SQLITE3_WB_INTERVAL_MS", DEFAULT_SQLITE3_WB_INTERVAL_MS)),
+        write_behind_batch_size: int = int(os.getenv(
+            "SQLITE3_WB_BATCH_SIZE", DEFAULT_SQLITE3_WB_BATCH_SIZE))
     ):
         self._db_name: str = db_name
         self._db_dir: str = db_dir
-        self._con: sqlite3.Connection = None
         self._in_memory_db: bool = in_memory_db
+        self._synchronous: str = synchronous
+        self._busy_timeout_ms: int = busy_timeout_ms
+        self._cached_statements: int = cached_statements
+
+        # Where connections point. None until connect() succeeds.
+        self._database: str = None
+        self._local: threading.local = threading.local()
+        # thread ident -> that thread's connection
+        self._connections: dict[int, sqlite3.Connection] = {}
+        self._connections_lock: threading.Lock = threading.Lock()
+
+        self._write_behind: bool = write_behind
+        self._wb_interval: float = write_behind_interval_ms / 1000
+        self._wb_batch_size: int = max(1, write_behind_batch_size)
+        self._write_queue: queue.Queue = queue.Queue()
+        self._writer: threading.Thread = None
+
+    @property
+    def _con(self) -> sqlite3.Connection:
+        """
+        The calling thread's connection, or None if not connected.
+        """
+        if self._database is None:
+            return None
+
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._open_connection()
+            self._local.con = con
+        return con
 
     # PUBLIC
 
@@ -87,11 +309,10 @@ class DB_Controller:
         """
 
         if self._in_memory_db:
-            try:
-                self._con = sqlite3.connect(":memory:")
-            except Exception as e:
-                print(f"DB connection error: {e}")
-                return DB_connect_status.H_FAIL
+            # A named, shared cache memory db, so every thread's connection
+            # sees the same data. It lives as long as one connection is open.
+            self._database = f"file:roker-{uuid.uuid4().hex}" \
+                "?mode=memory&cache=shared"
             print("Starting db in memory")
         else:
             home_dir = os.path.expanduser("~")
@@ -99,14 +320,16 @@ class DB_Controller:
             Path(home_dir +
                  self._db_dir).mkdir(parents=True, exist_ok=True)
 
-            try:
-                self._con = sqlite3.connect(
-                    home_dir + self._db_dir + self._db_name)
-            except Exception as e:
-                print(f"DB connection error: {e}")
-                return DB_connect_status.H_FAIL
+            self._database = home_dir + self._db_dir + self._db_name
             print(f"Starting db in {home_dir}{self._db_dir}{self._db_name}")
 
+        try:
+            self._con
+        except Exception as e:
+            print(f"DB connection error: {e}")
+            self._database = None
+            return DB_connect_status.H_FAIL
+
         init: (DB_initialize_status, None | str) = self._initialize_db()
 
         # Match case, but we need to preserve the second indx of the tuple
@@ -130,6 +353,13 @@ class DB_Controller:
             return DB_connect_status.H_FAIL
 
         elif init[0] is DB_initialize_status.READY:
+            if self._write_behind:
+                self._writer = threading.Thread(
+                    target=self._writer_loop,
+                    name="roker-db-writer",
+                    daemon=True
+                )
+                self._writer.start()
             print("sqlite3 db is ready")
             return DB_connect_status.OK
 
@@ -174,79 +404,80 @@ class DB_Controller:
         if type(self._con) is not sqlite3.Connection:
             return (DB_new_agent_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
 
-        # Check that values are there
-        if new_agent.container_name is None:
-            return (DB_new_agent_status.MISSING_ATTRIBUTE,
-                    "missing container_name")
-        elif new_agent.container_id is None:
-            return (DB_new_agent_status.MISSING_ATTRIBUTE,
-                    "missing container_id")
-        elif new_agent.start_time is None:
-            return (DB_new_agent_status.MISSING_ATTRIBUTE,
-                    "missing start_time")
-        elif new_agent.port_number is None:
-            return (DB_new_agent_status.MISSING_ATTRIBUTE,
-                    "missing port_number")
+        invalid = self._validate_new_agent(new_agent)
+        if invalid is not None:
+            return invalid
 
-        # Check if values are appropriate type
-        if type(new_agent.container_name) is not str:
-            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
-                    "bad 'container_name' type, expected str but got: "
-                    f"{type(new_agent.container_name)}")
-        elif type(new_agent.container_id) is not str:
-            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
-                    "bad 'container_id' type, expected str but got: "
-                    f"{type(new_agent.container_id)}")
-        elif type(new_agent.start_time) is not datetime:
-            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
-                    "bad 'start_time' type, expected datetime but got: "
-                    f"{type(new_agent.start_time)}")
-        elif type(new_agent.port_number) is not int:
-            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
-                    "bad 'port_number' type, expected int but got: "
-                    f"{type(new_agent.port_number)}")
+        cur: sqlite3.Cursor = self._con.cursor()
 
-        # check if team name or team members is populated
-        if new_agent.team_members is not None:
-            print("team_members is populated when it shouldn't be."
-                  f"Got: {new_agent.team_members}")
-            new_agent.team_members = ""
+        try:
+            cur.execute(INSERT_AGENT_SQL, self._agent_insert_params(new_agent))
+        except Exception as e:
+            cur.close()
+            return (DB_new_agent_status.FAILED_EXECUTION, e)
 
-        if new_agent.team_name is not None:
-            print("team_name is populated when it shouldn't be."
-                  f"Got: {new_agent.team_name}")
-            new_agent.team_name = ""
+        self._con.commit()
+        id = cur.lastrowid
+        cur.close()
+        return (DB_new_agent_status.SUBMITTED, id)
 
-        if new_agent.active:
-            print("active is populated when it shouldn't be."
-                  f"Got: {new_agent.active}")
+    def add_new_agents(self, new_agents: list[Agent]) -> (
+            DB_new_agent_status, list[int] | str | None):
+        """
+        Adds many agents to the agent table in a single transaction.
+        Either every agent is added, or none are.
 
-        new_agent.active = int(False)
+        Each Agent is checked exactly like `add_new_agent`.
 
+        @return a tuple, where the first index is the enum DB_new_agent_status,
+        and the second index is either None, an error message, or the ids of
+        the agents in the same order they were given.
+
+        Potential return structures:
+        (DB_new_agent_status.SUBMITTED, [int]):
+            Sucessfuly submitted every agent.
+
+        (DB_new_agent_status.SQLITE3_NOT_CONNECT, None):
+            Connection object does not exist
+
+        (DB_new_agent_status.NOT_A_SQLITE_CONNECTION_OBJ, None):
+            Expected connection object, got something else
+
+        (DB_new_agent_status.MISSING_ATTRIBUTE, str):
+        (DB_new_agent_status.BAD_ATTRIBUTE_TYPE, str):
+            An agent failed validation. Nothing was added. The message is
+            prefixed with the index of the offending agent.
+
+        (DB_new_agent_status.FAILED_EXECUTION, str):
+            The transaction failed and was rolled back.
+        """
+        if self._con is None:
+            return (DB_new_agent_status.SQLITE3_NOT_CONNECT, None)
+
+        if type(self._con) is not sqlite3.Connection:
+            return (DB_new_agent_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
+
+        for i, new_agent in enumerate(new_agents):
+            invalid = self._validate_new_agent(new_agent)
+            if invalid is not None:
+                return (invalid[0], f"agent {i}: {invalid[1]}")
+
+        ids: list[int] = []
         cur: sqlite3.Cursor = self._con.cursor()
 
         try:
-            cur.execute("INSERT INTO agents(\
-                    container_name, container_id,\
-                    start_time, team_name, team_members,\
-                    port_number, active)\
-                    VALUES(?,?,?,?,?,?,?)", (
-                new_agent.container_name,
-                new_agent.container_id,
-                new_agent.start_time.isoformat(),
-                new_agent.team_name,
-                new_agent.team_members,
-                new_agent.port_number,
-                new_agent.active
-            ))
+            for new_agent in new_agents:
+                cur.execute(INSERT_AGENT_SQL,
+                            self._agent_insert_params(new_agent))
+                ids.append(cur.lastrowid)
         except Exception as e:
             cur.close()
+            self._con.rollback()
             return (DB_new_agent_status.FAILED_EXECUTION, e)
 
         self._con.commit()
-        id = cur.lastrowid
         cur.close()
-        return (DB_new_agent_status.SUBMITTED, id)
+        return (DB_new_agent_status.SUBMITTED, ids)
 
     def get_agent_data(self, agent_id: int) -> (
             DB_query_status, int | str | None):
@@ -314,18 +545,16 @@ class DB_Controller:
 
         match agent_id:
             case str():
-                query_str = f"SELECT * FROM agents WHERE container_id='{
-                    agent_id}';"
+                query_str = select_agent_sql("container_id")
             case int():
-                query_str = f"SELECT * FROM agents WHERE id={
-                    agent_id};"
+                query_str = select_agent_sql("id")
             case _:
                 return (DB_query_status.BAD_PARAM_TYPE,
                         "bad 'agent_id' type, expected (int | str) but got: "
                         f"{type(agent_id)}")
 
         try:
-            data = cur.execute(query_str).fetchall()
+            data = cur.execute(query_str, (agent_id,)).fetchall()
         except Exception as e:
             cur.close()
             return (DB_query_status.QUERY_FAILED, e)
@@ -374,6 +603,12 @@ class DB_Controller:
         `(DB_query_status.QUERY_FAILED, str)`:
             Query failed for some reason.
             It is returned wiht a str stating query error.
+
+        `(DB_query_status.QUEUED, Future)`:
+            Write-behind is on and the update was queued. The
+            concurrent.futures.Future resolves to one of the tuples above
+            once the update is committed. From async code, await it with
+            `asyncio.wrap_future`.
         """
         if self._con is None:
             return (DB_query_status.SQLITE3_NOT_CONNECT, None)
@@ -381,141 +616,1022 @@ class DB_Controller:
         if not isinstance(self._con, sqlite3.Connection):
             return (DB_query_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
 
-        if agent_id is None:
-            return (DB_query_status.MISSING_PARAM, "missing agent_id")
+        (status, statement) = self._agent_update_statement(agent_id, data)
+        if status != DB_query_status.SUCCESS:
+            return (status, statement)
 
-        if data is None or len(data) == 0:
-            return (DB_query_status.MISSING_PARAM, "missing data")
+        write = functools.partial(
+            self._execute_agent_update, agent_id=agent_id, statement=statement)
 
-        if not isinstance(data, dict):
-            return (DB_query_status.BAD_PARAM_TYPE,
-                    "bad 'data' type, expected dict but got:"
-                    f" {type(data)}")
+        if self._writer is not None:
+            return (DB_query_status.QUEUED, self._enqueue_write(write))
 
         cur: sqlite3.Cursor = self._con.cursor()
 
-        # The string to be executed. Built on top of.
-        query_str: str = "UPDATE agents SET "
+        try:
+            res = write(cur)
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
 
-        # Part of query_str; What the query is matching on (container_id | id)
-        match_str: str
+        cur.close()
+        if res[0] == DB_query_status.SUCCESS:
+            self._con.commit()
+        else:
+            self._con.rollback()
+        return res
 
-        # The amount of columns we are updating in a row
-        # Needed for comma formatting during SET
-        update_count: int = 0
+    def update_agents_data(self, updates: list[tuple[int | str, dict]]) -> (
+            DB_query_status, int | str | None):
+        """
+        Updates many agents in a single transaction.
 
-        match agent_id:
-            case str():
-                match_str = f"WHERE container_id='{agent_id}'"
-            case int():
-                match_str = f"WHERE id={agent_id}"
-            case _:
-                return (DB_query_status.BAD_PARAM_TYPE,
-                        "bad 'agent_id' type, expected (int | str) but got: "
-                        f"{type(agent_id)}")
+        `updates` is a list of (agent_id, data) pairs, each checked exactly
+        like `update_agent_data`. Updates of the same shape (same columns,
+        matched the same way) run as one prepared statement with
+        `executemany`, so flipping `active` for every agent after a health
+        sweep is one statement.
 
-        for k, v in data.items():
-            if update_count >= 1 and update_count != len(data):
-                query_str += ", "
-            match k:
-                case "team_members":
-                    query_str += f"team_members='{v}'"
-                case "team_name":
-                    query_str += f"team_name='{v}'"
-                case "active":
-                    query_str += f"active={v}"
-                case "port_number":
-                    query_str += f"port_number={v}"
-                case _:
-                    return (DB_query_status.BAD_PARAM_TYPE,
-                            f"Bad 'data', unexpected key. Got '{k} : {v}'")
-            update_count += 1
-
-        query_str += f" {match_str};"
+        Agents that do not exist are skipped rather than failing the batch.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being the number of rows updated, `None`,
+        or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, int)`:
+            Every update ran. Returned with the number of rows updated.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.NOT_A_SQLITE_CONNECTION_OBJ, None)`:
+            expected connection object, got something else
+
+        `(DB_query_stats.MISSING PARAM, str)`:
+        `(DB_query_status.BAD_PARAM_TYPE, str)`:
+            An update failed validation. Nothing was updated. The message
+            is prefixed with the index of the offending update.
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            The transaction failed and was rolled back.
+
+        `(DB_query_status.QUEUED, Future)`:
+            Write-behind is on; see `update_agent_data`.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        if not isinstance(self._con, sqlite3.Connection):
+            return (DB_query_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
+
+        # sql -> list of params, in the order the updates were given
+        batches: dict[str, list[tuple]] = {}
+
+        for i, (agent_id, data) in enumerate(updates):
+            (status, statement) = self._agent_update_statement(agent_id, data)
+            if status != DB_query_status.SUCCESS:
+                return (status, f"update {i}: {statement}")
+            batches.setdefault(statement[0], []).append(statement[1])
+
+        write = functools.partial(
+            self._execute_agents_update, batches=batches)
+
+        if self._writer is not None:
+            return (DB_query_status.QUEUED, self._enqueue_write(write))
+
+        cur: sqlite3.Cursor = self._con.cursor()
 
         try:
-            cur.execute(query_str)
+            res = write(cur)
         except Exception as e:
+            cur.close()
             self._con.rollback()
             return (DB_query_status.QUERY_FAILED, e)
 
+        self._con.commit()
         cur.close()
-        match cur.rowcount:
-            case 0:
-                self._con.rollback()
-                return (DB_query_status.QUERY_FAILED,
-                        "Failed to update. Most likely caused by the agent "
-                        f"'{agent_id}' not existing in the agents table.")
-            case 1:
-                self._con.commit()
-                return (DB_query_status.SUCCESS, None)
+        return res
 
-    def agent_to_json(self, agent: Agent) -> str:
-        pass
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Blocks until every write queued so far has been committed.
+        Returns immediately when write-behind is off.
 
-    def get_db_name(self) -> str:
-        return self._db_name
+        @return False if `timeout` seconds passed first
+        """
+        if self._writer is None:
+            return True
 
-    def get_db_dir(self) -> str:
-        return self._db_dir
+        barrier: Future = self._enqueue_write(None)
+        try:
+            barrier.result(timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def list_agents(
+            self,
+            active: bool | None = None,
+            team_name: str | None = None,
+            port_min: int | None = None,
+            port_max: int | None = None,
+            after_id: int = 0,
+            limit: int | None = None,
+            chunk_size: int = DEFAULT_LIST_AGENTS_CHUNK_SIZE) -> (
+            DB_query_status, object | str | None):
+        """
+        Lists agents in id order, optionally filtered.
 
-        # PRIVATE
+        Pagination is by keyset: pass the id of the last agent you saw as
+        `after_id` to get the next page. Rows are read `chunk_size` at a time
+        with a fresh keyset query per chunk, so memory use is bounded by the
+        chunk no matter how many agents match, and the generator can be
+        resumed from any thread.
 
-    def _initialize_db(self) -> (DB_initialize_status, int | str | None):
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being a generator of Agent dataclasses,
+        `None`, or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, generator)`:
+            Yields at most `limit` (or every matching) Agent.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.BAD_PARAM_TYPE, str)`:
+            A filter or paging param has an unexpected type or value.
         """
-        Initializes the database file and creates the 'agents' table
-        if it does not exist.
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
 
-        @reaturn a tuple containing the status of the intialization,
-        and any relevant error message
+        checks = (("after_id", after_id, int, False),
+                  ("port_min", port_min, int, True),
+                  ("port_max", port_max, int, True),
+                  ("limit", limit, int, True),
+                  ("chunk_size", chunk_size, int, False),
+                  ("team_name", team_name, str, True),
+                  ("active", active, bool, True))
+        for (name, value, expected, optional) in checks:
+            if value is None and optional:
+                continue
+            if type(value) is not expected:
+                return (DB_query_status.BAD_PARAM_TYPE,
+                        f"bad '{name}' type, expected {expected.__name__} "
+                        f"but got: {type(value)}")
+
+        if chunk_size <= 0 or (limit is not None and limit < 0):
+            return (DB_query_status.BAD_PARAM_TYPE,
+                    "'limit' and 'chunk_size' must be positive")
+
+        filters: list[tuple[str, str]] = []
+        values: list = []
+        for (column, op, value) in (("active", "=", active),
+                                    ("team_name", "=", team_name),
+                                    ("port_number", ">=", port_min),
+                                    ("port_number", "<=", port_max)):
+            if value is not None:
+                filters.append((column, op))
+                values.append(int(value) if column == "active" else value)
+
+        sql = list_agents_sql(tuple(filters))
+
+        def agents():
+            last_id = after_id
+            remaining = limit
+
+            while remaining is None or remaining > 0:
+                page = chunk_size if remaining is None \
+                    else min(chunk_size, remaining)
+
+                cur: sqlite3.Cursor = self._con.cursor()
+                try:
+                    cur.execute(sql, (last_id, *values, page))
+                    rows = cur.fetchmany(page)
+                finally:
+                    cur.close()
+
+                for row in rows:
+                    yield self._parse_agent_data(row)
+
+                if len(rows) < page:
+                    return
+                last_id = rows[-1][0]
+                if remaining is not None:
+                    remaining -= len(rows)
+
+        return (DB_query_status.SUCCESS, agents())
+
+    def add_port_lease(self, port: int, container_id: str | None = None) -> (
+            DB_query_status, None | str):
+        """
+        Records that `port` is leased, optionally to `container_id`.
+        Overwrites any existing lease on the port.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being `None`, or an error message.
 
         Potential return structures:
-        (DB_initialize_status.READY, int):
-            sqlite3 db and tables are ready
-            It is returned with the id of the agent
+        `(DB_query_status.SUCCESS, None)`:
+            Lease recorded.
 
-        (DB_initialize_status.SQLITE3_NOT_CONNECT, None):
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
             connection object does not exist
 
-        (DB_initialize_status.NOT_A_SQLITE_CONNECTION_OBJ, None):
-            expected connection object, got something else
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
 
-        (DB_initialize_status.FAILED_TABLE_INTIALIZATION, str):
-            Failed to intialize the table(s).
-            Is returned with a relevant error message.
+        try:
+            self._con.execute(
+                "INSERT OR REPLACE INTO port_leases(port, container_id,\
+                    leased_at) VALUES(?,?,?)",
+                (port, container_id, datetime.now().isoformat()))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def remove_port_lease(self, port: int) -> (DB_query_status, None | str):
+        """
+        Drops the lease on `port`, if there is one.
+
+        @return same structures as `add_port_lease`
         """
         if self._con is None:
-            return (DB_initialize_status.SQLITE3_NOT_CONNECT, None)
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
 
-        if type(self._con) is not sqlite3.Connection:
-            return (DB_initialize_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
+        try:
+            self._con.execute(
+                "DELETE FROM port_leases WHERE port=?", (port,))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
 
-        cur = self._con.cursor()
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def get_port_leases(self) -> (
+            DB_query_status, list[tuple[int, str | None]] | str | None):
+        """
+        Gets every port lease.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being a list of (port, container_id)
+        tuples, `None`, or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, [(int, str | None)])`:
+            Query suceeded. container_id is None for ports reserved by a
+            launch that never finished.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
 
         try:
-            cur.execute(
-                "CREATE TABLE IF NOT EXISTS agents\
-                    (\
-                        id              INTEGER PRIMARY KEY,\
-                        container_name  TEXT NOT NULL UNIQUE,\
-                        container_id    TEXT NOT NULL UNIQUE,\
-                        start_time      TEXT NOT NULL,\
-                        team_name       TEXT,\
-                        team_members    TEXT,\
-                        port_number     INT NOT NULL,\
-                        active          INT\
-                     )"
-            )
+            data = self._con.execute(
+                "SELECT port, container_id FROM port_leases").fetchall()
         except Exception as e:
-            cur.close(0)
-            return (DB_initialize_status.FAILED_TABLE_INTIALIZATION, e)
+            return (DB_query_status.QUERY_FAILED, e)
+
+        return (DB_query_status.SUCCESS, data)
+
+    def add_agent_stats(self, rows: list[tuple]) -> (
+            DB_query_status, int | str | None):
+        """
+        Writes rows of downsampled stats in one transaction. Each row is
+        ordered as the columns of the agent_stats table. A row for a bucket
+        that already exists replaces it.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being the number of rows written,
+        `None`, or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, int)`:
+            Rows written.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason. Nothing was written.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            self._con.executemany(INSERT_AGENT_STATS_SQL, rows)
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
 
-        # Do i need to commit?
         self._con.commit()
-        last_id = cur.lastrowid
+        return (DB_query_status.SUCCESS, len(rows))
 
-        cur.close()
-        return (DB_initialize_status.READY, last_id)
+    def prune_agent_stats(self, resolution: int, before: int) -> (
+            DB_query_status, int | str | None):
+        """
+        Drops stats of `resolution` for buckets starting before `before`.
+
+        @return same structures as `add_agent_stats`, with the number of
+        rows dropped
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            cur = self._con.execute(
+                "DELETE FROM agent_stats WHERE resolution=? AND bucket<?",
+                (resolution, before))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, cur.rowcount)
+
+    def get_agent_stats(
+            self,
+            container_id: str,
+            resolution: int,
+            since: int = 0) -> (DB_query_status, list[tuple] | str | None):
+        """
+        Gets a container's stats of `resolution` for buckets starting at or
+        after `since`, oldest first.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being a list of agent_stats rows,
+        `None`, or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, [tuple])`:
+            Query suceeded.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            data = self._con.execute(
+                "SELECT * FROM agent_stats WHERE container_id=? AND\
+                    resolution=? AND bucket>=? ORDER BY bucket",
+                (container_id, resolution, since)).fetchall()
+        except Exception as e:
+            return (DB_query_status.QUERY_FAILED, e)
+
+        return (DB_query_status.SUCCESS, data)
+
+    def get_gh_metadata(self, url: str) -> (
+            DB_query_status, tuple | str | None):
+        """
+        Gets the cached copy of a repo metadata file.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being a
+        (status_code, body, etag, last_modified, fetched_at) tuple, `None`,
+        or an error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, tuple)`:
+            Query suceeded.
+
+        `(DB_query_status.NO_RESULT, None)`:
+            Nothing cached for `url`.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            data = self._con.execute(
+                "SELECT status_code, body, etag, last_modified, fetched_at\
+                    FROM gh_metadata WHERE url=?", (url,)).fetchone()
+        except Exception as e:
+            return (DB_query_status.QUERY_FAILED, e)
+
+        if data is None:
+            return (DB_query_status.NO_RESULT, None)
+        return (DB_query_status.SUCCESS, data)
+
+    def put_gh_metadata(
+            self,
+            url: str,
+            status_code: int,
+            body: str,
+            etag: str | None,
+            last_modified: str | None,
+            fetched_at: float) -> (DB_query_status, None | str):
+        """
+        Caches a repo metadata file, replacing any older copy.
+
+        @return same structures as `add_port_lease`
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            self._con.execute(
+                "INSERT OR REPLACE INTO gh_metadata(url, status_code, body,\
+                    etag, last_modified, fetched_at) VALUES(?,?,?,?,?,?)",
+                (url, status_code, body, etag, last_modified, fetched_at))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def add_tournament(
+            self,
+            format: str,
+            table_size: int,
+            agent_ids: list[int]) -> (DB_query_status, int | str | None):
+        """
+        Records a new, running tournament.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being the tournament id, `None`, or an
+        error message.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, int)`:
+            Tournament recorded.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            cur = self._con.execute(
+                "INSERT INTO tournaments(format, table_size, agents, status,\
+                    created_at) VALUES(?,?,?,?,?)",
+                (format, table_size, json.dumps(agent_ids), "running",
+                 datetime.now().isoformat()))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, cur.lastrowid)
+
+    def finish_tournament(self, tournament_id: int, status: str) -> (
+            DB_query_status, None | str):
+        """
+        Records that a tournament ended with `status`.
+
+        @return same structures as `add_port_lease`
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            self._con.execute(
+                "UPDATE tournaments SET status=?, finished_at=? WHERE id=?",
+                (status, datetime.now().isoformat(), tournament_id))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def put_tournament_table(
+            self,
+            tournament_id: int,
+            number: int,
+            round: int,
+            seats: list[int],
+            scores: dict | None,
+            status: str,
+            started_at: float | None = None,
+            finished_at: float | None = None) -> (
+                DB_query_status, None | str):
+        """
+        Records a tournament table, replacing what was recorded of it.
+
+        @return same structures as `add_port_lease`
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            self._con.execute(
+                "INSERT OR REPLACE INTO tournament_tables(tournament_id,\
+                    number, round, seats, scores, status, started_at,\
+                    finished_at) VALUES(?,?,?,?,?,?,?,?)",
+                (tournament_id, number, round, json.dumps(seats),
+                 None if scores is None else json.dumps(scores), status,
+                 started_at, finished_at))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def get_tournament(self, tournament_id: int) -> (
+            DB_query_status, tuple | str | None):
+        """
+        Gets a tournament and its tables.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index either being a
+        (tournaments row, [tournament_tables rows]) tuple, `None`, or an
+        error message. Tables are in number order.
+
+        Potential return structures:
+        `(DB_query_status.SUCCESS, tuple)`:
+            Query suceeded.
+
+        `(DB_query_status.NO_RESULT, None)`:
+            No such tournament.
+
+        `(DB_query_status.SQLITE3_NOT_CONNECT, None)`:
+            connection object does not exist
+
+        `(DB_query_status.QUERY_FAILED, str)`:
+            Query failed for some reason.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            tournament = self._con.execute(
+                "SELECT * FROM tournaments WHERE id=?",
+                (tournament_id,)).fetchone()
+            tables = self._con.execute(
+                "SELECT * FROM tournament_tables WHERE tournament_id=?\
+                    ORDER BY number", (tournament_id,)).fetchall()
+        except Exception as e:
+            return (DB_query_status.QUERY_FAILED, e)
+
+        if tournament is None:
+            return (DB_query_status.NO_RESULT, None)
+        return (DB_query_status.SUCCESS, (tournament, tables))
+
+    def add_job(self, kind: str, params: dict, created_at: float) -> (
+            DB_query_status, int | str | None):
+        """
+        Records a new, queued job.
+
+        @return same structures as `add_tournament`, with the job id
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            cur = self._con.execute(
+                "INSERT INTO jobs(kind, params, status, stages, created_at)\
+                    VALUES(?,?,?,?,?)",
+                (kind, json.dumps(params), "queued",
+                 json.dumps([["queued", created_at]]), created_at))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, cur.lastrowid)
+
+    def update_job(
+            self,
+            job_id: int,
+            status: str,
+            stages: list,
+            result: dict | None = None,
+            error: str | None = None,
+            finished_at: float | None = None) -> (
+                DB_query_status, None | str):
+        """
+        Records a job's progress.
+
+        @return same structures as `add_port_lease`
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            self._con.execute(
+                "UPDATE jobs SET status=?, stages=?, result=?, error=?,\
+                    finished_at=? WHERE id=?",
+                (status, json.dumps(stages),
+                 None if result is None else json.dumps(result), error,
+                 finished_at, job_id))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, None)
+
+    def get_job(self, job_id: int) -> (DB_query_status, tuple | str | None):
+        """
+        Gets a jobs row.
+
+        @return same structures as `get_tournament`, with the jobs row
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            job = self._con.execute(
+                "SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        except Exception as e:
+            return (DB_query_status.QUERY_FAILED, e)
+
+        if job is None:
+            return (DB_query_status.NO_RESULT, None)
+        return (DB_query_status.SUCCESS, job)
+
+    def fail_unfinished_jobs(self, error: str, finished_at: float) -> (
+            DB_query_status, int | str | None):
+        """
+        Marks every job that is still queued or running as failed with
+        `error`, for jobs a previous run of roker never finished.
+
+        @return a tuple, with the first index always being `DB_query_status`,
+        and the second index the number of jobs failed, `None`, or an error
+        message.
+        """
+        if self._con is None:
+            return (DB_query_status.SQLITE3_NOT_CONNECT, None)
+
+        try:
+            cur = self._con.execute(
+                "UPDATE jobs SET status='failed', error=?, finished_at=?\
+                    WHERE status IN ('queued', 'running')",
+                (error, finished_at))
+        except Exception as e:
+            self._con.rollback()
+            return (DB_query_status.QUERY_FAILED, e)
+
+        self._con.commit()
+        return (DB_query_status.SUCCESS, cur.rowcount)
+
+    def close(self):
+        """
+        Commits anything still queued for write-behind, then closes every
+        thread's connection. The controller can be connected again with
+        `connect`.
+        """
+        if self._writer is not None:
+            self._write_queue.put(_STOP_WRITER)
+            self._writer.join()
+            self._writer = None
+
+        with self._connections_lock:
+            connections, self._connections = self._connections, {}
+        self._database = None
+        self._local = threading.local()
+
+        for con in connections.values():
+            con.close()
+
+    def agent_to_json(self, agent: Agent) -> str:
+        """Serializes an Agent. start_time is written as an iso string."""
+        data = dataclasses.asdict(agent)
+        if isinstance(agent.start_time, datetime):
+            data["start_time"] = agent.start_time.isoformat()
+        data["active"] = bool(agent.active)
+        return json.dumps(data)
+
+    def get_db_name(self) -> str:
+        return self._db_name
+
+    def get_db_dir(self) -> str:
+        return self._db_dir
+
+        # PRIVATE
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """
+        Opens and tunes a connection for the calling thread, and closes the
+        connections of threads that have since exited.
+
+        check_same_thread is off only so `close` and the pruning here can
+        close other threads' connections; each connection is still only
+        ever used by the thread that opened it.
+        """
+        con = sqlite3.connect(
+            self._database,
+            uri=self._in_memory_db,
+            timeout=self._busy_timeout_ms / 1000,
+            cached_statements=self._cached_statements,
+            check_same_thread=False
+        )
+        if self._in_memory_db:
+            # Shared cache takes table locks instead of using WAL; let
+            # readers skip them rather than fail while a write is open
+            con.execute("PRAGMA read_uncommitted=1")
+        else:
+            con.execute("PRAGMA journal_mode=WAL")
+        con.execute(f"PRAGMA synchronous={self._synchronous}")
+        con.execute(f"PRAGMA busy_timeout={self._busy_timeout_ms}")
+
+        alive = {t.ident for t in threading.enumerate()}
+        with self._connections_lock:
+            stale = [self._connections.pop(ident)
+                     for ident in list(self._connections.keys())
+                     if ident not in alive or ident == threading.get_ident()]
+            self._connections[threading.get_ident()] = con
+
+        for old in stale:
+            old.close()
+        return con
+
+    def _initialize_db(self) -> (DB_initialize_status, int | str | None):
+        """
+        Initializes the database file and creates the 'agents' table
+        if it does not exist.
+
+        @reaturn a tuple containing the status of the intialization,
+        and any relevant error message
+
+        Potential return structures:
+        (DB_initialize_status.READY, int):
+            sqlite3 db and tables are ready
+            It is returned with the id of the agent
+
+        (DB_initialize_status.SQLITE3_NOT_CONNECT, None):
+            connection object does not exist
+
+        (DB_initialize_status.NOT_A_SQLITE_CONNECTION_OBJ, None):
+            expected connection object, got something else
+
+        (DB_initialize_status.FAILED_TABLE_INTIALIZATION, str):
+            Failed to intialize the table(s).
+            Is returned with a relevant error message.
+        """
+        if self._con is None:
+            return (DB_initialize_status.SQLITE3_NOT_CONNECT, None)
+
+        if type(self._con) is not sqlite3.Connection:
+            return (DB_initialize_status.NOT_A_SQLITE_CONNECTION_OBJ, None)
+
+        cur = self._con.cursor()
+
+        try:
+            for statement in SCHEMA:
+                cur.execute(statement)
+        except Exception as e:
+            cur.close()
+            return (DB_initialize_status.FAILED_TABLE_INTIALIZATION, e)
+
+        # Do i need to commit?
+        self._con.commit()
+        last_id = cur.lastrowid
+
+        cur.close()
+        return (DB_initialize_status.READY, last_id)
+
+    def _execute_agent_update(
+            self,
+            cur: sqlite3.Cursor,
+            agent_id: int | str,
+            statement: tuple[str, tuple]) -> (DB_query_status, None | str):
+        """Runs one update built by `_agent_update_statement`. No commit."""
+        cur.execute(*statement)
+        if cur.rowcount == 0:
+            return (DB_query_status.QUERY_FAILED,
+                    "Failed to update. Most likely caused by the agent "
+                    f"'{agent_id}' not existing in the agents table.")
+        return (DB_query_status.SUCCESS, None)
+
+    def _execute_agents_update(
+            self,
+            cur: sqlite3.Cursor,
+            batches: dict[str, list[tuple]]) -> (DB_query_status, int):
+        """Runs one executemany per statement shape. No commit."""
+        updated: int = 0
+        for sql, params in batches.items():
+            cur.executemany(sql, params)
+            updated += cur.rowcount
+        return (DB_query_status.SUCCESS, updated)
+
+    def _enqueue_write(self, write) -> Future:
+        """
+        Queues `write(cur)` for the writer thread. A `write` of None is a
+        barrier that resolves once everything queued before it is committed.
+        """
+        future: Future = Future()
+        self._write_queue.put((write, future))
+        return future
+
+    def _writer_loop(self):
+        """
+        Drains the write queue on its own thread, committing a batch every
+        `_wb_interval` seconds or `_wb_batch_size` writes.
+        """
+        stopping = False
+
+        def ends_batch(item) -> bool:
+            # Flush barriers and close should not wait out the interval
+            return item is _STOP_WRITER or item[0] is None
+
+        while not stopping:
+            batch = [self._write_queue.get()]
+            deadline = monotonic() + self._wb_interval
+
+            while len(batch) < self._wb_batch_size \
+                    and not ends_batch(batch[-1]):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Pick up anything else already queued when asked to stop
+            if _STOP_WRITER in batch:
+                stopping = True
+                batch.remove(_STOP_WRITER)
+                while not self._write_queue.empty():
+                    item = self._write_queue.get_nowait()
+                    if item is not _STOP_WRITER:
+                        batch.append(item)
+
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: list[tuple]):
+        """
+        Runs a batch of queued writes in one transaction. Each write gets a
+        savepoint, so one failing write does not undo the others.
+        """
+        if len(batch) == 0:
+            return
+
+        results = []
+        cur: sqlite3.Cursor = self._con.cursor()
+
+        try:
+            cur.execute("BEGIN")
+            for (write, future) in batch:
+                if write is None:
+                    results.append((future, None))
+                    continue
+                cur.execute("SAVEPOINT roker_write")
+                try:
+                    res = write(cur)
+                    if res[0] != DB_query_status.SUCCESS:
+                        cur.execute("ROLLBACK TO roker_write")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO roker_write")
+                    res = (DB_query_status.QUERY_FAILED, e)
+                cur.execute("RELEASE roker_write")
+                results.append((future, res))
+            self._con.commit()
+        except Exception as e:
+            self._con.rollback()
+            results = [(future, None if write is None else
+                        (DB_query_status.QUERY_FAILED, e))
+                       for (write, future) in batch]
+        finally:
+            cur.close()
+
+        for (future, res) in results:
+            future.set_result(res)
+
+    def _agent_update_statement(self, agent_id: int | str, data: dict) -> (
+            DB_query_status, tuple[str, tuple] | str | None):
+        """
+        Checks an update for update_agent_data and builds its parameterized
+        statement.
+
+        @return (DB_query_status.SUCCESS, (sql, params)) or the failing
+        (DB_query_status, str | None) tuple described in `update_agent_data`.
+        """
+        if agent_id is None:
+            return (DB_query_status.MISSING_PARAM, "missing agent_id")
+
+        if data is None or len(data) == 0:
+            return (DB_query_status.MISSING_PARAM, "missing data")
+
+        if not isinstance(data, dict):
+            return (DB_query_status.BAD_PARAM_TYPE,
+                    "bad 'data' type, expected dict but got:"
+                    f" {type(data)}")
+
+        # What the query is matching on (container_id | id)
+        match_column: str
+
+        match agent_id:
+            case str():
+                match_column = "container_id"
+            case int():
+                match_column = "id"
+            case _:
+                return (DB_query_status.BAD_PARAM_TYPE,
+                        "bad 'agent_id' type, expected (int | str) but got: "
+                        f"{type(agent_id)}")
+
+        for k, v in data.items():
+            if k not in UPDATABLE_AGENT_COLUMNS:
+                return (DB_query_status.BAD_PARAM_TYPE,
+                        f"Bad 'data', unexpected key. Got '{k} : {v}'")
+
+        # Sorted, so the same set of columns is always the same statement
+        columns = tuple(sorted(data.keys()))
+        params = tuple(data[column] for column in columns) + (agent_id,)
+
+        return (DB_query_status.SUCCESS,
+                (update_agent_sql(columns, match_column), params))
+
+    def _validate_new_agent(self, new_agent: Agent) -> tuple | None:
+        """
+        Checks an Agent for the attributes and types required by the agents
+        table, and resets the attributes that should not be populated yet.
+
+        @return None if the agent can be inserted, otherwise the failing
+        (DB_new_agent_status, str) tuple described in `add_new_agent`.
+        """
+        # Check that values are there
+        if new_agent.container_name is None:
+            return (DB_new_agent_status.MISSING_ATTRIBUTE,
+                    "missing container_name")
+        elif new_agent.container_id is None:
+            return (DB_new_agent_status.MISSING_ATTRIBUTE,
+                    "missing container_id")
+        elif new_agent.start_time is None:
+            return (DB_new_agent_status.MISSING_ATTRIBUTE,
+                    "missing start_time")
+        elif new_agent.port_number is None:
+            return (DB_new_agent_status.MISSING_ATTRIBUTE,
+                    "missing port_number")
+
+        # Check if values are appropriate type
+        if type(new_agent.container_name) is not str:
+            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
+                    "bad 'container_name' type, expected str but got: "
+                    f"{type(new_agent.container_name)}")
+        elif type(new_agent.container_id) is not str:
+            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
+                    "bad 'container_id' type, expected str but got: "
+                    f"{type(new_agent.container_id)}")
+        elif type(new_agent.start_time) is not datetime:
+            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
+                    "bad 'start_time' type, expected datetime but got: "
+                    f"{type(new_agent.start_time)}")
+        elif type(new_agent.port_number) is not int:
+            return (DB_new_agent_status.BAD_ATTRIBUTE_TYPE,
+                    "bad 'port_number' type, expected int but got: "
+                    f"{type(new_agent.port_number)}")
+
+        # check if team name or team members is populated
+        if new_agent.team_members is not None:
+            print("team_members is populated when it shouldn't be."
+                  f"Got: {new_agent.team_members}")
+            new_agent.team_members = ""
+
+        if new_agent.team_name is not None:
+            print("team_name is populated when it shouldn't be."
+                  f"Got: {new_agent.team_name}")
+            new_agent.team_name = ""
+
+        if new_agent.active:
+            print("active is populated when it shouldn't be."
+                  f"Got: {new_agent.active}")
+
+        new_agent.active = int(False)
+        return None
+
+    def _agent_insert_params(self, agent: Agent) -> tuple:
+        """Orders a validated Agent's attributes for INSERT_AGENT_SQL"""
+        return (
+            agent.container_name,
+            agent.container_id,
+            agent.start_time.isoformat(),
+            agent.team_name,
+            agent.team_members,
+            agent.port_number,
+            agent.active
+        )
 
     def _parse_agent_data(self, data: tuple) -> Agent:
         """
@@ -1,13 +1,95 @@
+import asyncio
+import functools
+import io
+import os
+import shlex
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 from dataclasses import dataclass
-from time import sleep
 from datetime import datetime
+from dotenv import load_dotenv
 import docker
+import requests
 
-from roker.controllers.port_controller import PortController, PortAssignment
+from roker.controllers.admission_controller import (
+    AdmissionController, ADM_SC)
+from roker.controllers.cache_controller import (
+    ArtifactCache, Artifact, CACHE_SC, ARTIFACT_NAME,
+    recipe_hash, resolve_commit)
+from roker.controllers.engine_controller import (
+    EngineController, mem_limit_to_bytes)
+from roker.controllers.event_controller import (
+    ContainerState, EventController)
+from roker.controllers.log_controller import (
+    LogController, LogShipper, LogStore)
+from roker.controllers.pool_controller import PoolController, PooledContainer
+from roker.controllers.port_controller import (
+    PortController, PortAssignment, P_SC)
+from roker.controllers.stats_controller import StatsController
+
+load_dotenv()
+
+DEFAULT_MAX_BATCH_PARALLELISM = 8
+DEFAULT_MAX_TEARDOWN_PARALLELISM = 32
+DEFAULT_CONTAINER_IMAGE = "alpine"
+DEFAULT_CONTAINER_MEM_LIMIT = "128mb"
+DEFAULT_CONTAINER_CPUS = 0.25
+DEFAULT_AGENT_RUN_SCRIPT = \
+    "/home/ruby/development/ruby_poker/python_docker/test.sh"
+DEFAULT_ARTIFACT_BUILD_SCRIPT = \
+    "/home/ruby/development/ruby_poker/python_docker/build.sh"
+DEFAULT_BUILD_IMAGE = "maven:3-eclipse-temurin-21-alpine"
+DEFAULT_BUILD_TIMEOUT = 900.0
+DEFAULT_BUILD_PARALLELISM = 4
+DEFAULT_RESTART_STOP_TIMEOUT = 2
+
+CONTAINER_IMAGE = os.getenv("CONTAINER_IMAGE", DEFAULT_CONTAINER_IMAGE)
+CONTAINER_MEM_LIMIT = os.getenv(
+    "CONTAINER_MEM_LIMIT", DEFAULT_CONTAINER_MEM_LIMIT)
+# CPUs each agent container is counted as using against the admission
+# budget. Not enforced on the container.
+CONTAINER_CPUS = float(os.getenv("CONTAINER_CPUS", DEFAULT_CONTAINER_CPUS))
+AGENT_RUN_SCRIPT = os.getenv("AGENT_RUN_SCRIPT", DEFAULT_AGENT_RUN_SCRIPT)
+ARTIFACT_BUILD_SCRIPT = os.getenv(
+    "ARTIFACT_BUILD_SCRIPT", DEFAULT_ARTIFACT_BUILD_SCRIPT)
+BUILD_IMAGE = os.getenv("BUILD_IMAGE", DEFAULT_BUILD_IMAGE)
+BUILD_TIMEOUT = float(os.getenv("BUILD_TIMEOUT", DEFAULT_BUILD_TIMEOUT))
+# Artifact builds running at once. Each one holds a build thread, not one
+# of the EngineController's slots, while it waits on its container.
+BUILD_PARALLELISM = int(os.getenv(
+    "BUILD_PARALLELISM", DEFAULT_BUILD_PARALLELISM))
+MAX_TEARDOWN_PARALLELISM = int(os.getenv(
+    "MAX_TEARDOWN_PARALLELISM", DEFAULT_MAX_TEARDOWN_PARALLELISM))
+# Seconds an agent gets to exit on a restart before it is killed
+RESTART_STOP_TIMEOUT = int(os.getenv(
+    "RESTART_STOP_TIMEOUT", DEFAULT_RESTART_STOP_TIMEOUT))
+
+# Where a cached artifact shows up inside an agent container. The run
+# script skips clone/compile when ROKER_ARTIFACT points at a file.
+ARTIFACT_MOUNT_DIR = "/home/artifact"
+ARTIFACT_ENV = f"ROKER_ARTIFACT={ARTIFACT_MOUNT_DIR}/{ARTIFACT_NAME}"
+
+# Every container roker starts carries this label, set to the role the
+# container was started for ("agent", "pool" or "build"). The event
+# subscriber and bulk operations only ever touch labelled containers.
+ROKER_LABEL = "roker.managed"
+
+# Pooled containers boot into this loop and wait for a repo to be injected
+# as /home/.roker_env. The file survives a container restart, so a
+# restarted pooled agent comes straight back up with the same repo.
+POOL_ENV_FILE = ".roker_env"
+POOL_WAIT_COMMAND = [
+    "sh", "-c",
+    f"while [ ! -f {POOL_ENV_FILE} ]; do sleep 0.1; done; "
+    f". ./{POOL_ENV_FILE}; exec ./test.sh"
+]
 
 
 class DC_SC(IntEnum):
+    FORGOTTEN_DOCKER_C = -8
+    NO_CAPACITY = -7
+    FAILED_TO_RESTART_DOCKER_C = -6
     FAILED_TO_START_DOCKER_C = -5
     FAILED_TO_KILL_DOCKER_C = -4
     BAD_GH_TEAM_NAME = -3
@@ -16,32 +98,104 @@ class DC_SC(IntEnum):
     OK = 0
 
 
-@dataclass
-class ActiveContainer:
-    port_number: int
-    container: docker.api.container
-
-
 @dataclass
 class ContainerCreation:
     status: DC_SC
     port: int = -1
     container_id: str = ""
     container_name: str = ""
-    start_time: datetime
+    start_time: datetime = None
+    gh_url: str = ""
+
+
+@dataclass
+class ContainerTeardown:
+    """
+    Result of tearing down one container.
+
+    status:  DC_SC.OK, or DC_SC.FAILED_TO_KILL_DOCKER_C
+    port:    host port released, -1 if it had none
+    message: error from the daemon, if it failed
+    """
+    container_id: str
+    status: DC_SC
+    port: int = -1
+    message: str = ""
 
 
 class AgentController:
-    def __init__(self):
-        self.active_containers: {str: ActiveContainer} = {}
-        self.pc = PortController()
+    def __init__(self, db=None):
+        self.pc = PortController(db)
+        self.admission = AdmissionController()
         self.client = docker.from_env()
+        self.engine = EngineController()
+        self.events = EventController(self.client, ROKER_LABEL)
+        self.events.add_listener(self._on_state)
+        # Loop the event thread hands container states to, set by start
+        self._loop: asyncio.AbstractEventLoop = None
+        self.stats = StatsController(self.client, db)
+        self.events.add_listener(self.stats.on_state)
+        self.logs = LogController(self.client)
+        self.log_store = LogStore()
+        self.log_shipper = LogShipper(self.client, self.log_store)
+        self.events.add_listener(self.log_shipper.on_state)
+        self.pool = PoolController(
+            spawn=self._spawn_pooled_container,
+            remove=self._remove_pooled_container,
+            container_mem=mem_limit_to_bytes(CONTAINER_MEM_LIMIT),
+            alive=self._pooled_alive
+        )
+        self.cache = ArtifactCache(builder=self._build_artifact)
+        self._build_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max(1, BUILD_PARALLELISM),
+            thread_name_prefix="roker-build"
+        )
+        self._build_semaphore: asyncio.Semaphore = asyncio.Semaphore(
+            max(1, BUILD_PARALLELISM))
+        # Launches left running by a create_new_containers consumer that
+        # stopped early
+        self._launches: set[asyncio.Task] = set()
+        # container id -> key of the artifact it has mounted
+        self._artifact_keys: dict[str, str] = {}
 
     def __iter__(self):
         return self
 
-    async def create_new_container(self, gh_url: str) -> ContainerCreation:
-        """Creates a new container."""
+    async def start(self):
+        """
+        Releases the port leases of containers removed while roker was
+        down, then starts following docker events on the running loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        await self._reconcile_leases()
+        self.events.start()
+
+    async def create_new_container(
+            self,
+            gh_url: str,
+            priority: int = 0,
+            on_queued=None,
+            on_stage=None) -> ContainerCreation:
+        """
+        Creates a new container.
+
+        Cold starts wait for room in the host's memory and CPU budget,
+        highest `priority` first. `on_queued` is called with the queue
+        position while waiting, see `AdmissionController.acquire`.
+
+        A pooled container is handed out without waiting on a build: it
+        gets the artifact only if it is already cached, and otherwise
+        compiles the repo itself while the cache builds it for next time.
+        A cold start fetches the artifact while it waits for admission.
+
+        `on_stage` is called with the name of each step as it begins:
+        "assign" for a pooled container, or "build" (and "admission" once
+        queued), "port" and "create" for a cold start.
+        """
+        def stage(name: str):
+            if on_stage is not None:
+                on_stage(name)
+
         print("Attempting to build new agent.")
         # Get available TCP port
         # THEN
@@ -50,40 +204,123 @@ class AgentController:
         #   ^^ This will use the "volume" paramater
         # Return ContainerCreation
 
+        pooled = self.pool.acquire()
+        if pooled is not None:
+            stage("assign")
+            artifact = await self._get_artifact(gh_url, build=False)
+            res = await self._assign_pooled_container(
+                pooled, gh_url, artifact)
+            if res.status == DC_SC.OK:
+                self._track_artifact(res.container_id, artifact)
+                return res
+            print("Pooled container failed, falling back to a cold start")
+            self._track_artifact(None, artifact)
+
+        def queued(position: int):
+            stage("admission")
+            if on_queued is not None:
+                on_queued(position)
+
+        # Pooled containers were admitted when they were spawned
+        stage("build")
+        (artifact, (status, reservation)) = await asyncio.gather(
+            self._get_artifact(gh_url),
+            self.admission.acquire(
+                mem_limit_to_bytes(CONTAINER_MEM_LIMIT), CONTAINER_CPUS,
+                priority, queued))
+        if status != ADM_SC.OK:
+            print(f"[create_new_container] not admitted: {status.name}")
+            self._track_artifact(None, artifact)
+            return ContainerCreation(status=DC_SC.NO_CAPACITY)
+
+        stage("port")
         port_task = await self.pc.get_available_TCP_port()
 
+        stage("create")
         res = await self._run_container(
-            gh_url, port_task)
+            gh_url, port_task, artifact)
 
         if res is None:
             print("FAILED to build new agent")
+            self.admission.release(reservation)
+            self._track_artifact(None, artifact)
             return ContainerCreation(
                 status=DC_SC.FAILED_TO_START_DOCKER_C
             )
 
-        # # TODO: Change this to db
-        # self.active_containers[
-        #     team_name_task.result().response] = ActiveContainer(
-        #     port_number=port_task.result().port,
-        #     container=res
-        # )
-
+        self.admission.bind(reservation, res.id)
+        self._track_artifact(res.id, artifact)
         return ContainerCreation(
             status=DC_SC.OK,
             port=port_task.port,
             container_id=res.id,
-            start_time=datetime.now()
+            container_name=res.name,
+            start_time=datetime.now(),
+            gh_url=gh_url
         )
 
-    def get_active_containers(self) -> {ActiveContainer}:
+    async def create_new_containers(
+            self,
+            gh_urls: list[str],
+            parallelism: int = int(os.getenv(
+                "MAX_BATCH_PARALLELISM", DEFAULT_MAX_BATCH_PARALLELISM)),
+            priority: int = 0,
+            on_created=None):
         """
-        Returns a dictionary of all active containers
+        Creates a container for every gh_url, running at most `parallelism`
+        launches at once.
+
+        This is an async generator. Each ContainerCreation is yielded as soon
+        as its launch finishes, so results arrive in completion order rather
+        than in the order of `gh_urls`. `ContainerCreation.gh_url` ties a
+        result back to its request.
+
+        `on_created` is awaited with every container that started, before it
+        is yielded. If the consumer stops early, launches that have not
+        started are dropped, while those already running are left to finish
+        and still passed to `on_created`, so nothing they hold leaks.
         """
-        print(
-            "[DockerController.get_active_containers]"
-            " ActiveContainers is probably empty"
-        )
-        return self.active_containers
+        semaphore = asyncio.Semaphore(max(1, parallelism))
+        running: set[asyncio.Task] = set()
+
+        async def launch(gh_url: str) -> ContainerCreation:
+            async with semaphore:
+                running.add(asyncio.current_task())
+                res = await self.create_new_container(gh_url, priority)
+                res.gh_url = gh_url
+                if res.status == DC_SC.OK and on_created is not None:
+                    await on_created(res)
+            return res
+
+        tasks = [asyncio.create_task(launch(url)) for url in gh_urls]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                if task in running:
+                    # Referenced until done, so it is not collected
+                    self._launches.add(task)
+                    task.add_done_callback(self._launches.discard)
+                else:
+                    task.cancel()
+
+    async def resolve_container_id(self, container_id: str) -> str | None:
+        """
+        Full id of a container given by full id, name or id prefix.
+
+        @return None if the daemon knows no such container, or did not
+        answer
+        """
+        try:
+            container = await self.engine.call(
+                self.client.containers.get, container_id)
+        except docker.errors.NotFound:
+            return None
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print(f"[DockerController.resolve_container_id] {e}")
+            return None
+        return container.id
 
     # unsure if I want this private or not
     async def kill_conatiner(self, container_id: str) -> DC_SC:
@@ -91,37 +328,184 @@ class AgentController:
         print("[DockerController._kill_conatiner] UNIMPLEMENTED")
         try:
             print(f"Attempting to kill {container_id}")
-            self.client.containers.get(container_id).kill()
+            container = await self.engine.call(
+                self.client.containers.get, container_id)
+            await self.engine.call(container.kill)
         except docker.errors.APIError as e:
             print(e)
             return DC_SC.FAILED_TO_KILL_DOCKER_C
+        except asyncio.TimeoutError:
+            print(f"Timed out killing {container_id}")
+            return DC_SC.FAILED_TO_KILL_DOCKER_C
         print(f"Sucessfuly killed {container_id}")
+        self._forget_container(container.id)
         return DC_SC.OK
 
-    async def restart_conatiner(self, container_id: str) -> DC_SC:
-        """Restarts a given container"""
-        sleep(1)
-        print("[DockerController.restart_conatiner] UNIMPLEMENTED")
+    async def teardown_all(
+            self,
+            parallelism: int = MAX_TEARDOWN_PARALLELISM
+    ) -> list[ContainerTeardown]:
+        """
+        Removes every container roker started, and nothing else.
+
+        The warm pool is drained first so it does not refill mid teardown,
+        and started again afterwards. Containers are then force removed (a
+        kill and remove in one call), at most `parallelism` at a time, and
+        their ports and artifacts released.
+
+        @return one ContainerTeardown per container found
+        """
+        await self.pool.stop()
+
+        try:
+            containers = await self.engine.call(
+                self.client.containers.list,
+                all=True,
+                sparse=True,
+                filters={"label": ROKER_LABEL}
+            )
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print(f"[DockerController.teardown_all] can't list: {e}")
+            await self.pool.start()
+            return []
+
+        semaphore = asyncio.Semaphore(max(1, parallelism))
+
+        async def teardown(container) -> ContainerTeardown:
+            async with semaphore:
+                try:
+                    await self.engine.call(container.remove, force=True)
+                except docker.errors.NotFound:
+                    # Already gone; still release what it held
+                    pass
+                except (docker.errors.APIError, asyncio.TimeoutError) as e:
+                    return ContainerTeardown(
+                        container_id=container.id,
+                        status=DC_SC.FAILED_TO_KILL_DOCKER_C,
+                        message=str(e) or type(e).__name__
+                    )
+            port = self.pc.get_port(container.id)
+            self._forget_container(container.id)
+            return ContainerTeardown(
+                container_id=container.id,
+                status=DC_SC.OK,
+                port=-1 if port is None else port
+            )
+
+        results = await asyncio.gather(
+            *[teardown(container) for container in containers])
+
+        await self.pool.start()
+        return list(results)
+
+    async def restart_conatiner(
+            self,
+            container_id: str,
+            timeout: int = RESTART_STOP_TIMEOUT) -> DC_SC:
+        """
+        Restarts a given container in place.
+
+        The container keeps its id, published port and mounts (a pooled
+        agent keeps its injected repo and artifact too), so its port lease
+        and artifact pin are left as they are and nothing is cloned or
+        compiled again. Its admission reservation is released when it dies
+        and taken again once it runs, see `_sync_state`.
+
+        Containers roker has killed or torn down are refused with
+        DC_SC.FORGOTTEN_DOCKER_C: their port may already be leased to
+        another agent.
+
+        `timeout`: seconds the agent gets to stop before it is killed
+        """
+        if self.pc.get_port(container_id) is None:
+            print(f"[DockerController.restart_conatiner] {container_id} "
+                  "holds no port lease")
+            return DC_SC.FORGOTTEN_DOCKER_C
+        try:
+            container = await self.engine.call(
+                self.client.containers.get, container_id)
+            # engine.call takes `timeout` for itself
+            await self.engine.call(
+                lambda: container.restart(timeout=timeout))
+        except docker.errors.APIError as e:
+            print(e)
+            return DC_SC.FAILED_TO_RESTART_DOCKER_C
+        except asyncio.TimeoutError:
+            print(f"Timed out restarting {container_id}")
+            return DC_SC.FAILED_TO_RESTART_DOCKER_C
         return DC_SC.OK
 
     async def _run_container(
             self,
             gh_url: str,
-            pa: PortAssignment) -> docker.api.container:
+            pa: PortAssignment,
+            artifact: Artifact | None = None) -> docker.api.container:
         """Starts the docker container for agent poker api"""
         print("[DockerController._run_container] INCOMPLETE")
 
-        # Free socket.. should check for failure tbh
-        pa.socket.close()
+        environment = [f"GH_REPO_URL={gh_url}"]
+        volumes = {}
+        if artifact is not None:
+            environment.append(ARTIFACT_ENV)
+            volumes[artifact.path] = {
+                'bind': ARTIFACT_MOUNT_DIR,
+                'mode': 'ro'
+            }
 
+        return await self._start_container(
+            pa,
+            command=['./test.sh'],
+            environment=environment,
+            volumes=volumes,
+            role="agent"
+        )
+
+    async def _start_container(
+            self,
+            pa: PortAssignment,
+            command: list[str],
+            environment: list[str],
+            volumes: dict | None = None,
+            role: str = "agent") -> docker.api.container:
+        """
+        Starts an agent container publishing `pa.port`, labelled with
+        `role`.
+
+        The port lease is bound to the new container, or released if the
+        container failed to start.
+
+        @return the container, or None on failure
+        """
+        if pa.status != P_SC.OK:
+            print("[_start_container] no free port to publish")
+            return None
+
+        container = await self._create_container(
+            pa, command, environment, volumes, role)
+
+        if container is None:
+            self.pc.release(pa.port)
+        else:
+            self.pc.bind(pa.port, container.id)
+        return container
+
+    async def _create_container(
+            self,
+            pa: PortAssignment,
+            command: list[str],
+            environment: list[str],
+            volumes: dict | None = None,
+            role: str = "agent") -> docker.api.container:
         try:
-            return self.client.containers.run(
-                'alpine',
+            return await self.engine.call(
+                self.client.containers.run,
+                CONTAINER_IMAGE,
                 auto_remove=False,
-                command=['./test.sh'],
+                command=command,
                 detach=True,
-                environment=[f"GH_REPO_URL={gh_url}"],
-                mem_limit="128mb",  # TODO: make this a .env
+                environment=environment,
+                labels={ROKER_LABEL: role},
+                mem_limit=CONTAINER_MEM_LIMIT,
                 network_mode="bridge",
                 ports={
                     '8080/tcp':
@@ -132,19 +516,274 @@ class AgentController:
                     "MaximumRetryCount": 1
                 },
                 volumes={
-                    '/home/ruby/development/ruby_poker/python_docker/test.sh': {
+                    AGENT_RUN_SCRIPT: {
                         'bind': '/home/test.sh',
                         'mode': 'ro'
-                    }
+                    },
+                    **(volumes or {})
                 },
                 working_dir="/home/",
             )
         except docker.errors.ContainerError as e:
-            print(f"[_run_container] Container Error: {e}")
+            print(f"[_create_container] Container Error: {e}")
             return None
         except docker.errors.ImageNotFound as e:
-            print(f"[_run_container] image not found: {e}")
+            print(f"[_create_container] image not found: {e}")
             return None
         except docker.errors.APIError as e:
-            print(f"[_run_container] APIError: {e}")
+            print(f"[_create_container] APIError: {e}")
+            return None
+        except asyncio.TimeoutError:
+            print("[_create_container] Timed out waiting on the docker daemon")
             return None
+
+    async def _spawn_pooled_container(self) -> PooledContainer | None:
+        """
+        Boots an idle container for the warm pool, if the admission budget
+        has room for it without holding up anyone waiting.
+        """
+        reservation = self.admission.try_acquire(
+            mem_limit_to_bytes(CONTAINER_MEM_LIMIT), CONTAINER_CPUS)
+        if reservation is None:
+            return None
+
+        pa = await self.pc.get_available_TCP_port()
+        res = await self._start_container(
+            pa, command=POOL_WAIT_COMMAND, environment=[], role="pool")
+
+        if res is None:
+            self.admission.release(reservation)
+            return None
+        self.admission.bind(reservation, res.id)
+        return PooledContainer(container=res, port=pa.port)
+
+    def _pooled_alive(self, pooled: PooledContainer) -> bool:
+        """
+        Whether a pooled container is still running, as far as the events
+        stream has told. Containers it has not reported on yet are taken to
+        be; a failing `put_archive` still falls back to a cold start.
+        """
+        state = self.events.get_state(pooled.container.id)
+        return state is None or state.status == "running"
+
+    async def _remove_pooled_container(self, pooled: PooledContainer):
+        """Tears down a pooled container that was never handed out"""
+        try:
+            await self.engine.call(pooled.container.remove, force=True)
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print("[DockerController._remove_pooled_container] failed to "
+                  f"remove {pooled.container.id}: {e}")
+        self.pc.release(pooled.port)
+        self.admission.release_container(pooled.container.id)
+
+    async def _assign_pooled_container(
+            self,
+            pooled: PooledContainer,
+            gh_url: str,
+            artifact: Artifact | None = None) -> ContainerCreation:
+        """
+        Hands a pooled container to an agent by injecting its repo.
+        The container's wait loop picks up the env file and starts the agent.
+
+        Pooled containers were booted before the artifact was known, so it
+        can not be bind mounted; it is copied in next to the env file.
+        """
+        env = f"export GH_REPO_URL={shlex.quote(gh_url)}\n"
+        if artifact is not None:
+            env += f"export {ARTIFACT_ENV}\n"
+        env = env.encode("utf-8")
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            if artifact is not None:
+                tar.add(os.path.join(artifact.path, ARTIFACT_NAME),
+                        arcname=f"artifact/{ARTIFACT_NAME}")
+            # Added last, so the agent never starts before the artifact exists
+            info = tarfile.TarInfo(POOL_ENV_FILE)
+            info.size = len(env)
+            tar.addfile(info, io.BytesIO(env))
+
+        try:
+            await self.engine.call(
+                pooled.container.put_archive, "/home/", archive.getvalue())
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print(f"[DockerController._assign_pooled_container] {e}")
+            await self._remove_pooled_container(pooled)
+            return ContainerCreation(status=DC_SC.FAILED_TO_START_DOCKER_C)
+
+        return ContainerCreation(
+            status=DC_SC.OK,
+            port=pooled.port,
+            container_id=pooled.container.id,
+            container_name=pooled.container.name,
+            start_time=datetime.now(),
+            gh_url=gh_url
+        )
+
+    async def _get_artifact(
+            self,
+            gh_url: str,
+            build: bool = True) -> Artifact | None:
+        """
+        Fetches the compiled artifact for the current commit of `gh_url`
+        from the artifact cache, building it once if needed. Without
+        `build`, only a cached artifact is returned, and a missing one is
+        built in the background.
+
+        @return the pinned Artifact, or None if it is unavailable. Without an
+        artifact the container falls back to cloning and compiling itself.
+        """
+        recipe = recipe_hash(ARTIFACT_BUILD_SCRIPT)
+        if recipe is None:
+            return None
+
+        commit = await resolve_commit(gh_url)
+        if commit is None:
+            print(f"[DockerController._get_artifact] can't resolve {gh_url}")
+            return None
+
+        if not build:
+            artifact = self.cache.lookup(gh_url, commit, recipe)
+            if artifact is None:
+                self.cache.prefetch(gh_url, commit, recipe)
+            return artifact
+
+        artifact = await self.cache.get(gh_url, commit, recipe)
+        if artifact.status not in (CACHE_SC.HIT, CACHE_SC.BUILT):
+            print("[DockerController._get_artifact] build failed "
+                  f"({artifact.status.name}) for {gh_url}@{commit}")
+            return None
+        return artifact
+
+    async def _reconcile_leases(self):
+        try:
+            containers = await self.engine.call(
+                self.client.containers.list,
+                all=True,
+                sparse=True,
+                filters={"label": ROKER_LABEL}
+            )
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print(f"[DockerController._reconcile_leases] can't list: {e}")
+            return
+        released = self.pc.reconcile({c.id for c in containers})
+        if len(released) > 0:
+            print(f"[DockerController._reconcile_leases] released {released}")
+
+    def _on_state(self, state: ContainerState):
+        """EventController listener, handing states to the event loop"""
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._sync_state, state)
+        except RuntimeError:
+            # Loop closed
+            pass
+
+    def _sync_state(self, state: ContainerState):
+        """
+        Keeps the warm pool and the admission budget in step with the
+        containers docker actually runs. Containers that exit, crash, are
+        OOM killed or are removed outside roker leave the pool if they were
+        idle in it, and release their reservation. Containers found
+        running without one, like those left from before roker started
+        (seeded from `containers.list`) or restarted ones, get one again.
+        Only containers holding a port lease count: builds are not
+        admitted.
+        """
+        if state.status in ("exited", "dead", "removed"):
+            self.pool.evict(state.container_id)
+            self.admission.release_container(state.container_id)
+        elif (state.status == "running"
+              and self.pc.get_port(state.container_id) is not None):
+            self.admission.adopt(
+                state.container_id,
+                mem_limit_to_bytes(CONTAINER_MEM_LIMIT), CONTAINER_CPUS)
+
+    def _forget_container(self, container_id: str):
+        """
+        Releases the port, artifact and admission reservation a dead
+        container held
+        """
+        self.pc.release_container(container_id)
+        self.admission.release_container(container_id)
+        if container_id in self._artifact_keys:
+            self.cache.unpin(self._artifact_keys.pop(container_id))
+
+    def _track_artifact(self, container_id: str | None,
+                        artifact: Artifact | None):
+        """
+        Records which artifact a container mounted, or unpins it right away
+        when the container failed to start (`container_id` is None).
+        """
+        if artifact is None:
+            return
+        if container_id is None:
+            self.cache.unpin(artifact.key)
+            return
+        self._artifact_keys[container_id] = artifact.key
+
+    async def _build_artifact(
+            self,
+            gh_url: str,
+            commit: str,
+            out_dir: str) -> bool:
+        """
+        ArtifactCache builder. Runs the build recipe in a one shot container
+        that clones `gh_url` at `commit` and writes ARTIFACT_NAME to /out.
+
+        At most BUILD_PARALLELISM builds run at once. The container is
+        started detached and waited on from a build thread, so a long build
+        only holds the EngineController for the calls that start and remove
+        it. A build that fails, runs past BUILD_TIMEOUT or is cancelled has
+        its container killed and removed.
+        """
+        async with self._build_semaphore:
+            try:
+                container = await self.engine.call(
+                    self.client.containers.run,
+                    BUILD_IMAGE,
+                    command=["sh", "/build.sh"],
+                    detach=True,
+                    environment=[f"GH_REPO_URL={gh_url}",
+                                 f"GH_COMMIT={commit}"],
+                    labels={ROKER_LABEL: "build"},
+                    volumes={
+                        ARTIFACT_BUILD_SCRIPT: {
+                            'bind': '/build.sh',
+                            'mode': 'ro'
+                        },
+                        out_dir: {'bind': '/out', 'mode': 'rw'}
+                    }
+                )
+            except (docker.errors.APIError, asyncio.TimeoutError) as e:
+                print(f"[DockerController._build_artifact] {e}")
+                return False
+
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._build_executor,
+                    functools.partial(container.wait, timeout=BUILD_TIMEOUT))
+            except (docker.errors.APIError,
+                    requests.exceptions.RequestException) as e:
+                print("[DockerController._build_artifact] gave up on "
+                      f"{gh_url}@{commit}: {e}")
+                return False
+            finally:
+                # Kills the build if it is still running
+                await asyncio.shield(self._remove_build(container))
+
+        if result.get("StatusCode") != 0:
+            print("[DockerController._build_artifact] build of "
+                  f"{gh_url}@{commit} exited with {result.get('StatusCode')}")
+            return False
+        return True
+
+    async def _remove_build(self, container):
+        try:
+            await self.engine.call(container.remove, force=True)
+        except docker.errors.NotFound:
+            pass
+        except (docker.errors.APIError, asyncio.TimeoutError) as e:
+            print("[DockerController._remove_build] failed to remove "
+                  f"{container.id}: {e}")
@@ -0,0 +1,131 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_DOCKER_MAX_WORKERS = 16
+DEFAULT_DOCKER_MAX_CONCURRENCY = 16
+DEFAULT_DOCKER_CALL_TIMEOUT = 60.0
+
+
+class EngineController:
+    """
+    Runs blocking docker-py calls off of the event loop.
+
+    docker-py only offers a synchronous client. Every call made through
+    `EngineController.call` is handed to a bounded thread pool, so a slow
+    `containers.run` never stalls the FastAPI event loop.
+
+    One EngineController should exist per docker daemon. `max_concurrency`
+    caps how many calls may be in flight against that daemon at once;
+    additional callers wait their turn without holding a worker thread.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = int(os.getenv(
+            "DOCKER_MAX_WORKERS", DEFAULT_DOCKER_MAX_WORKERS)),
+        max_concurrency: int = int(os.getenv(
+            "DOCKER_MAX_CONCURRENCY", DEFAULT_DOCKER_MAX_CONCURRENCY)),
+        default_timeout: float = float(os.getenv(
+            "DOCKER_CALL_TIMEOUT", DEFAULT_DOCKER_CALL_TIMEOUT))
+    ):
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="roker-docker"
+        )
+        self._max_concurrency: int = max_concurrency
+        self._default_timeout: float = default_timeout
+        # Created lazily so the semaphore binds to the running loop
+        self._semaphore: asyncio.Semaphore = None
+        self._in_flight: int = 0
+
+    # PUBLIC
+
+    async def call(self, fn, *args, timeout: float | None = -1, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on the docker worker pool.
+
+        `timeout` is in seconds. Leaving it unset uses the controller default,
+        and passing `None` waits forever.
+
+        Exceptions raised by `fn` (docker.errors.APIError and friends) are
+        re-raised to the caller unchanged.
+
+        @raises asyncio.TimeoutError if the call did not finish in time.
+        The worker thread is not interrupted and its result is discarded,
+        but the concurrency slot is only handed back once the thread is
+        done, so abandoned calls still count against `max_concurrency`.
+
+        Cancelling the awaiting task behaves the same way. A call that had
+        not started running yet is dropped.
+        """
+        if timeout == -1:
+            timeout = self._default_timeout
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        loop = asyncio.get_running_loop()
+
+        await self._semaphore.acquire()
+        self._in_flight += 1
+        try:
+            future = self._executor.submit(
+                functools.partial(fn, *args, **kwargs))
+        except RuntimeError:
+            # Executor shut down
+            self._release()
+            raise
+        future.add_done_callback(
+            lambda _: self._release_threadsafe(loop))
+
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def get_in_flight(self) -> int:
+        """Returns the number of docker calls currently running"""
+        return self._in_flight
+
+    def shutdown(self):
+        """
+        Stops accepting new work. Calls that are already running are left
+        to finish in the background.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # PRIVATE
+
+    def _release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        """Hands the slot back on the loop, from the worker thread"""
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # Loop already closed; nobody is waiting on the slot
+            pass
+
+
+def mem_limit_to_bytes(mem_limit: str | int) -> int:
+    """
+    Converts a docker style memory limit ("128mb", "1g", "512k", 1024)
+    into a number of bytes.
+
+    @raises ValueError on a malformed limit.
+    """
+    if isinstance(mem_limit, int):
+        return mem_limit
+
+    units = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    limit = mem_limit.strip().lower().removesuffix("b")
+    if limit == "":
+        raise ValueError(f"bad memory limit: '{mem_limit}'")
+
+    if limit[-1] in units:
+        return int(float(limit[:-1]) * units[limit[-1]])
+    return int(limit)
@@ -0,0 +1,233 @@
+import dataclasses
+import os
+import threading
+import time
+from dataclasses import dataclass
+from dotenv import load_dotenv
+import docker
+
+load_dotenv()
+
+DEFAULT_EVENT_RECONNECT_DELAY = 1.0
+
+# docker event action -> container status it leaves the container in.
+# "die", "start" and "restart" are special cased in `_handle`, since they
+# also set or clear the exit code.
+_ACTION_STATUS = {
+    "create": "created",
+    "unpause": "running",
+    "pause": "paused",
+    "destroy": "removed",
+}
+
+
+@dataclass
+class ContainerState:
+    """
+    container_id: full container id
+    status:       created, running, paused, exited or removed. Docker sends
+                  no event for a container entering restarting or dead, so
+                  those only show up as seeded from `containers.list`.
+    exit_code:    exit code of the last run, None until it has exited
+    oom_killed:   True if the last run was killed for running out of memory
+    updated:      unix time of the event that last changed this state
+    """
+    container_id: str
+    status: str
+    exit_code: int | None = None
+    oom_killed: bool = False
+    updated: float = 0.0
+
+
+class EventController:
+    """
+    Keeps an in-memory table of container states current from the docker
+    events stream, so status lookups never round trip to the daemon.
+
+    Only containers carrying the `label` label are tracked. A background
+    thread seeds the table with one `containers.list` and then follows the
+    events stream, reconnecting (and replaying from the last event seen)
+    whenever the stream drops.
+
+    Listeners added with `add_listener` are called with the new
+    ContainerState every time a container's status changes. They run on
+    the event thread and should return quickly.
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        label: str,
+        reconnect_delay: float = float(os.getenv(
+            "EVENT_RECONNECT_DELAY", DEFAULT_EVENT_RECONNECT_DELAY))
+    ):
+        self._client: docker.DockerClient = client
+        self._label: str = label
+        self._reconnect_delay: float = reconnect_delay
+
+        self._lock: threading.Lock = threading.Lock()
+        self._states: dict[str, ContainerState] = {}
+        self._listeners: list = []
+
+        self._thread: threading.Thread = None
+        self._stream = None
+        self._stopping: threading.Event = threading.Event()
+        # Unix time (seconds) of the last event seen, to resume from
+        self._since: int = 0
+        self._events: int = 0
+
+    # PUBLIC
+
+    def start(self):
+        """Starts following the events stream in the background"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="roker-events", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stops the background thread"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        stream = self._stream
+        if stream is not None:
+            # Unblocks the thread waiting on the next event
+            stream.close()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def add_listener(self, listener):
+        """Calls `listener(state)` whenever a container's status changes"""
+        self._listeners.append(listener)
+
+    def get_state(self, container_id: str) -> ContainerState | None:
+        """
+        Returns the state of a container, looked up by full id or by a
+        unique id prefix.
+        """
+        with self._lock:
+            state = self._states.get(container_id)
+            if state is None:
+                matches = [s for (id, s) in self._states.items()
+                           if id.startswith(container_id)]
+                state = matches[0] if len(matches) == 1 else None
+            return dataclasses.replace(state) if state else None
+
+    def get_states(self) -> dict[str, ContainerState]:
+        """Returns every tracked container's state, keyed by container id"""
+        with self._lock:
+            return {id: dataclasses.replace(state)
+                    for (id, state) in self._states.items()}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "events": self._events,
+                "containers": len(self._states),
+                "following": self._stream is not None,
+            }
+
+    # PRIVATE
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                since = self._since or int(time.time())
+                if self._since == 0:
+                    self._seed()
+                self._follow(since)
+            except (docker.errors.APIError,
+                    docker.errors.DockerException, OSError) as e:
+                if self._stopping.is_set():
+                    return
+                print(f"[EventController._run] events stream dropped: {e}")
+            self._stopping.wait(self._reconnect_delay)
+
+    def _seed(self):
+        """Fills the table with the containers that exist right now"""
+        containers = self._client.containers.list(
+            all=True, filters={"label": self._label})
+
+        now = time.time()
+        for container in containers:
+            state = container.attrs.get("State", {})
+            exited = container.status in ("exited", "dead")
+            self._apply(ContainerState(
+                container_id=container.id,
+                status=container.status,
+                exit_code=state.get("ExitCode") if exited else None,
+                oom_killed=bool(state.get("OOMKilled", False)),
+                updated=now
+            ))
+
+    def _follow(self, since: int):
+        self._stream = self._client.events(
+            since=since,
+            decode=True,
+            filters={"type": "container", "label": self._label}
+        )
+        try:
+            for event in self._stream:
+                self._handle(event)
+                if self._stopping.is_set():
+                    return
+        finally:
+            stream, self._stream = self._stream, None
+            stream.close()
+
+    def _handle(self, event: dict):
+        """Applies one decoded docker event to the state table"""
+        action = event.get("Action", event.get("status", ""))
+        actor = event.get("Actor", {})
+        container_id = actor.get("ID", event.get("id"))
+        if container_id is None:
+            return
+
+        ts = event.get("timeNano", event.get("time", 0) * 1e9) / 1e9
+        self._since = max(self._since, int(ts))
+        self._events += 1
+
+        with self._lock:
+            old = self._states.get(container_id)
+        state = (dataclasses.replace(old) if old
+                 else ContainerState(container_id=container_id, status=""))
+        state.updated = ts
+
+        match action:
+            case "oom":
+                # Followed by a die event carrying the exit code
+                state.oom_killed = True
+            case "die":
+                state.status = "exited"
+                exit_code = actor.get("Attributes", {}).get("exitCode")
+                state.exit_code = int(exit_code) if exit_code else None
+            case "start" | "restart":
+                state.status = "running"
+                state.exit_code = None
+                state.oom_killed = False
+            case _ if action in _ACTION_STATUS:
+                state.status = _ACTION_STATUS[action]
+            case _:
+                # exec_*, health_status, attach, ... leave the status alone
+                return
+
+        self._apply(state)
+
+    def _apply(self, state: ContainerState):
+        with self._lock:
+            old = self._states.get(state.container_id)
+            if state.status == "removed":
+                self._states.pop(state.container_id, None)
+            else:
+                self._states[state.container_id] = state
+
+        if old is not None and old.status == state.status:
+            return
+        for listener in self._listeners:
+            try:
+                listener(dataclasses.replace(state))
+            except Exception as e:
+                print(f"[EventController._apply] listener failed: {e}")
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from enum import IntEnum
+from time import monotonic
+import httpx
+from dotenv import load_dotenv
+
+from roker.controllers.db_controller import DB_query_status
+from roker.controllers.health_controller import LatencyHistogram
+from roker.controllers.registry_controller import AgentRegistry
+
+load_dotenv()
+
+DEFAULT_FANOUT_HOST = "127.0.0.1"
+DEFAULT_FANOUT_PATH = "/respond"
+DEFAULT_FANOUT_DEADLINE = 2.0
+DEFAULT_FANOUT_MAX_CONNECTIONS = 1024
+DEFAULT_FANOUT_KEEPALIVE_EXPIRY = 60.0
+
+
+class FANOUT_SC(IntEnum):
+    NOT_FOUND = -4
+    BAD_RESPONSE = -3
+    REQ_FAIL = -2
+    TIMEOUT = -1
+    OK = 0
+
+
+@dataclass
+class FanoutResult:
+    """
+    responses: agent id -> decoded json body, for agents that answered
+               with a 2xx in time
+    failures:  agent id -> why there is no response
+    latency:   agent id -> seconds until it answered or failed
+    """
+    responses: dict[int, object] = field(default_factory=dict)
+    failures: dict[int, FANOUT_SC] = field(default_factory=dict)
+    latency: dict[int, float] = field(default_factory=dict)
+
+
+class FanoutController:
+    """
+    Sends one payload to many agents at once and collects their answers.
+
+    Ports are resolved through the agent registry. Every request goes
+    through one shared async HTTP client, so each agent's connection is
+    kept alive from one fan-out to the next. Each agent gets `deadline`
+    seconds to answer; a slow or dead agent is reported as a failure and
+    never holds up the others. Decision latency is recorded per agent.
+    """
+
+    def __init__(
+        self,
+        registry: AgentRegistry,
+        host: str = os.getenv("FANOUT_HOST", DEFAULT_FANOUT_HOST),
+        path: str = os.getenv("FANOUT_PATH", DEFAULT_FANOUT_PATH),
+        deadline: float = float(os.getenv(
+            "FANOUT_DEADLINE", DEFAULT_FANOUT_DEADLINE)),
+        max_connections: int = int(os.getenv(
+            "FANOUT_MAX_CONNECTIONS", DEFAULT_FANOUT_MAX_CONNECTIONS)),
+        keepalive_expiry: float = float(os.getenv(
+            "FANOUT_KEEPALIVE_EXPIRY", DEFAULT_FANOUT_KEEPALIVE_EXPIRY))
+    ):
+        self._registry: AgentRegistry = registry
+        self._host: str = host
+        self._path: str = path
+        self._deadline: float = deadline
+        # Deadlines are enforced per agent, around the whole request
+        self._client: httpx.AsyncClient = httpx.AsyncClient(
+            timeout=None,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            )
+        )
+        self._latency: dict[int, LatencyHistogram] = {}
+
+        self._fanouts: int = 0
+        self._sent: int = 0
+        self._timeouts: int = 0
+        self._failures: int = 0
+
+    # PUBLIC
+
+    async def send(
+            self,
+            agent_ids: list[int | str],
+            payload,
+            path: str | None = None,
+            deadline: float | None = None) -> FanoutResult:
+        """
+        POSTs `payload` as json to `path` on every agent in `agent_ids`
+        (row ids or container ids) concurrently, and waits for all of them
+        to answer or run out of their deadline.
+        """
+        path = self._path if path is None else path
+        deadline = self._deadline if deadline is None else deadline
+        body = json.dumps(payload).encode("utf-8")
+
+        result = FanoutResult()
+        targets = {}
+        for agent_id in dict.fromkeys(agent_ids):
+            (status, agent) = self._registry.get_agent_data(agent_id)
+            if status != DB_query_status.SUCCESS:
+                result.failures[agent_id] = FANOUT_SC.NOT_FOUND
+                continue
+            targets[agent.id] = agent.port_number
+
+        self._fanouts += 1
+        answers = await asyncio.gather(*[
+            self._send_one(port, path, body, deadline)
+            for port in targets.values()])
+
+        for (agent_id, (status, response, latency)) in zip(targets, answers):
+            result.latency[agent_id] = latency
+            if status == FANOUT_SC.OK:
+                result.responses[agent_id] = response
+                self._latency.setdefault(
+                    agent_id, LatencyHistogram()).observe(latency)
+            else:
+                result.failures[agent_id] = status
+        return result
+
+    def get_latency(self, agent_id: int) -> dict | None:
+        """Histogram of how long an agent took to answer"""
+        histogram = self._latency.get(agent_id)
+        return None if histogram is None else histogram.to_dict()
+
+    def forget(self, agent_id: int):
+        """Drops an agent's latency history, e.g. once it has been killed"""
+        self._latency.pop(agent_id, None)
+
+    def get_stats(self) -> dict:
+        return {
+            "fanouts": self._fanouts,
+            "sent": self._sent,
+            "timeouts": self._timeouts,
+            "failures": self._failures,
+            "agents": len(self._latency),
+        }
+
+    async def aclose(self):
+        """Closes every kept alive connection"""
+        await self._client.aclose()
+
+    # PRIVATE
+
+    async def _send_one(
+            self,
+            port: int,
+            path: str,
+            body: bytes,
+            deadline: float) -> (FANOUT_SC, object, float):
+        self._sent += 1
+        start = monotonic()
+        try:
+            response = await asyncio.wait_for(self._client.post(
+                f"http://{self._host}:{port}{path}",
+                content=body,
+                headers={"Content-Type": "application/json"}
+            ), deadline)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            return (FANOUT_SC.TIMEOUT, None, monotonic() - start)
+        except httpx.HTTPError as e:
+            print(f"[FanoutController._send_one] port {port}: {e!r}")
+            self._failures += 1
+            return (FANOUT_SC.REQ_FAIL, None, monotonic() - start)
+        latency = monotonic() - start
+
+        if response.status_code // 100 != 2:
+            self._failures += 1
+            return (FANOUT_SC.BAD_RESPONSE, None, latency)
+        try:
+            return (FANOUT_SC.OK, response.json(), latency)
+        except ValueError:
+            self._failures += 1
+            return (FANOUT_SC.BAD_RESPONSE, None, latency)
@@ -1,13 +1,31 @@
+import asyncio
 from dataclasses import dataclass
 from enum import IntEnum
-import requests
+import httpx
 import os
+import time
 from dotenv import load_dotenv
+from roker.controllers.db_controller import DB_Controller, DB_query_status
 
 load_dotenv()
 
 GH_MIN_REQUIRED_PARSE_LENGTH = 4
 
+DEFAULT_GH_RAW_BASE_URL = "https://raw.githubusercontent.com"
+DEFAULT_GH_CONNECT_TIMEOUT = 5.0
+DEFAULT_GH_READ_TIMEOUT = 10.0
+DEFAULT_GH_MAX_CONNECTIONS = 20
+DEFAULT_GH_CACHE_TTL = 300.0
+DEFAULT_GH_CACHE_STALE = 86400.0
+DEFAULT_MAX_TEAM_NAME_LEN = 32
+DEFAULT_MAX_TEAM_MEMBER_LEN = 128
+
+GH_RAW_BASE_URL = os.getenv("GH_RAW_BASE_URL", DEFAULT_GH_RAW_BASE_URL)
+MAX_TEAM_NAME_LEN = int(os.getenv(
+    "MAX_TEAM_NAME_LEN", DEFAULT_MAX_TEAM_NAME_LEN))
+MAX_TEAM_MEMBER_LEN = int(os.getenv(
+    "MAX_TEAM_MEMBER_LEN", DEFAULT_MAX_TEAM_MEMBER_LEN))
+
 
 class GH_SC(IntEnum):
     TEAM_NAME_TOO_LONG = -6
@@ -25,83 +43,266 @@ class GHResponse:
     response: str = ""
 
 
-def parse_gh_url(gh_url: str) -> str:
+@dataclass
+class GHMetadata:
+    """Both metadata files of a repo, each with its own status"""
+    team_name: GHResponse
+    team_members: GHResponse
+
+
+@dataclass
+class _CachedFile:
+    """
+    A fetched metadata file, kept with the validators to revalidate it.
+
+    fetched_at: unix time of the last fetch or successful revalidation
+    """
+    status_code: int
+    body: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+
+def parse_gh_url(gh_url: str, base_url: str = GH_RAW_BASE_URL) -> str:
     parse = gh_url.split('/')
-    if len(parse) < GH_MIN_REQUIRED_PARSE_LENGTH:
+    if len(parse) < GH_MIN_REQUIRED_PARSE_LENGTH + 1:
         return ""
-    return (f"https://raw.githubusercontent.com/{parse[3]}/{parse[4]}"
+    return (f"{base_url.rstrip('/')}/{parse[3]}/{parse[4]}"
             "/refs/heads/main/")
 
 
-# TODO: These two methods are damn near the same.
 class GHController:
+    """
+    Fetches team metadata files from the main branch of agent repos.
+
+    Every request goes through one shared async HTTP client, so connections
+    to the raw content host are pooled and kept alive between agents.
+    `base_url` points the controller at the raw content host, which tests
+    replace with a local server. Call `aclose` once done with it.
+
+    Fetched files are cached by url, and persisted to `db` when given.
+    A file younger than `cache_ttl` seconds is served without a request.
+    For `cache_stale` seconds after that it is still served, while a
+    conditional GET revalidates it in the background; past that, callers
+    wait on the revalidation. Either way an unchanged file costs a 304,
+    and concurrent lookups of one file share a single request.
+    """
+
+    def __init__(
+        self,
+        base_url: str = GH_RAW_BASE_URL,
+        connect_timeout: float = float(os.getenv(
+            "GH_CONNECT_TIMEOUT", DEFAULT_GH_CONNECT_TIMEOUT)),
+        read_timeout: float = float(os.getenv(
+            "GH_READ_TIMEOUT", DEFAULT_GH_READ_TIMEOUT)),
+        max_connections: int = int(os.getenv(
+            "GH_MAX_CONNECTIONS", DEFAULT_GH_MAX_CONNECTIONS)),
+        db: DB_Controller | None = None,
+        cache_ttl: float = float(os.getenv(
+            "GH_CACHE_TTL", DEFAULT_GH_CACHE_TTL)),
+        cache_stale: float = float(os.getenv(
+            "GH_CACHE_STALE", DEFAULT_GH_CACHE_STALE))
+    ):
+        self._base_url: str = base_url
+        self._db: DB_Controller | None = db
+        self._cache_ttl: float = cache_ttl
+        self._cache_stale: float = cache_stale
+        self._cache: dict[str, _CachedFile] = {}
+        # url -> the request currently fetching or revalidating it
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        self._hits: int = 0
+        self._stale_hits: int = 0
+        self._fetched: int = 0
+        self._not_modified: int = 0
+        self._errors: int = 0
+
+        self._client: httpx.AsyncClient = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+
+    # PUBLIC
+
     async def get_gh_team_name(self, gh_url: str) -> GHResponse:
         """Gets the teamname from the github repo"""
-        parsed_url = parse_gh_url(gh_url)
+        return await self._get_file(
+            gh_url, "teamname", MAX_TEAM_NAME_LEN, GH_SC.TEAM_NAME_TOO_LONG)
+
+    async def get_gh_team_member_names(self, gh_url: str) -> GHResponse:
+        """Gets the team members from the github repo"""
+        return await self._get_file(
+            gh_url, "teammembers", MAX_TEAM_MEMBER_LEN,
+            GH_SC.TEAM_MEMBER_TOO_LONG)
+
+    async def get_gh_metadata(self, gh_url: str) -> GHMetadata:
+        """Gets the teamname and teammembers files concurrently"""
+        (team_name, team_members) = await asyncio.gather(
+            self.get_gh_team_name(gh_url),
+            self.get_gh_team_member_names(gh_url)
+        )
+        return GHMetadata(team_name=team_name, team_members=team_members)
+
+    def get_stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "hits": self._hits,
+            "stale_hits": self._stale_hits,
+            "fetched": self._fetched,
+            "not_modified": self._not_modified,
+            "errors": self._errors,
+            "inflight": len(self._inflight),
+        }
+
+    async def aclose(self):
+        """Cancels background revalidations and closes every connection"""
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+        await self._client.aclose()
+
+    # PRIVATE
+
+    async def _get_file(
+            self,
+            gh_url: str,
+            name: str,
+            max_len: int,
+            too_long: GH_SC) -> GHResponse:
+        parsed_url = parse_gh_url(gh_url, self._base_url)
 
         # catches some bad urls, but not all
         if parsed_url == "":
-            return GHResponse(
-                status=GH_SC.BAD_URL
-            )
+            return GHResponse(status=GH_SC.BAD_URL)
 
-        url = parse_gh_url(gh_url) + "teamname"
+        (status, cached) = await self._lookup(parsed_url + name)
+        if status != GH_SC.OK:
+            return GHResponse(status=status)
 
-        try:
-            response = requests.get(url)
-        except requests.exceptions.Timeout:
-            return GHResponse(status=GH_SC.TIMEOUT)
-        except requests.exceptions.HTTPError:
-            print(
-                "ERROR: Failed to request team name. Probably a private repo"
-            )
+        if cached.status_code != 200:
+            print(f"ERROR: Failed to request {name}. Probably a private repo")
             return GHResponse(status=GH_SC.HTTP_ERROR)
-        except requests.exceptions.RequestException as e:
-            print(e)
-            return GHResponse(status=GH_SC.REQ_FAIL_H)
 
-        # If team name too long, return
-        if len(response.text) > int(os.getenv("MAX_TEAM_NAME_LEN")):
-            return GHResponse(status=GH_SC.TEAM_NAME_TOO_LONG)
+        if len(cached.body) > max_len:
+            return GHResponse(status=too_long)
 
         return GHResponse(
-            response=response.text,
+            response=cached.body,
             status=GH_SC.OK
         )
 
-    async def get_gh_team_member_names(self, gh_url: str) -> GHResponse:
-        """Gets the team members from the github repo"""
-        parsed_url = parse_gh_url(gh_url)
+    async def _lookup(self, url: str) -> (GH_SC, _CachedFile | None):
+        cached = self._cached(url)
+        if cached is not None:
+            age = time.time() - cached.fetched_at
+            if age < self._cache_ttl:
+                self._hits += 1
+                return (GH_SC.OK, cached)
+            if age < self._cache_ttl + self._cache_stale:
+                self._stale_hits += 1
+                self._revalidate(url)
+                return (GH_SC.OK, cached)
 
-        # catches some bad urls, but not all
-        if parsed_url == "":
-            return GHResponse(
-                status=GH_SC.BAD_URL
-            )
+        return await asyncio.shield(self._revalidate(url))
+
+    def _revalidate(self, url: str) -> asyncio.Task:
+        """Starts revalidating `url`, unless that is already under way"""
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.create_task(self._fetch(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return task
+
+    async def _fetch(self, url: str) -> (GH_SC, _CachedFile | None):
+        """
+        Fetches `url`, conditionally if a copy is cached.
 
-        url = parse_gh_url(gh_url) + "teammembers"
+        When the request fails, a cached copy, however old, is still
+        served rather than failing the lookup.
+        """
+        cached = self._cached(url)
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
 
         try:
-            response = requests.get(url)
-        except requests.exceptions.Timeout:
-            return GHResponse(status=GH_SC.TIMEOUT)
-        except requests.exceptions.HTTPError:
-            print(
-                "ERROR: Failed to request team name. Probably a private repo"
+            response = await self._client.get(url, headers=headers)
+        except httpx.TimeoutException:
+            return self._failed(url, cached, GH_SC.TIMEOUT)
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol):
+            return (GH_SC.BAD_URL, None)
+        except httpx.HTTPError as e:
+            print(f"[GHController._fetch] {url}: {e}")
+            return self._failed(url, cached, GH_SC.REQ_FAIL_H)
+
+        # Server side trouble says nothing about the file; do not cache it
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f"[GHController._fetch] {url}: {response.status_code}")
+            return self._failed(url, cached, GH_SC.HTTP_ERROR)
+
+        if response.status_code == 304 and cached is not None:
+            self._not_modified += 1
+            cached = _CachedFile(
+                status_code=cached.status_code,
+                body=cached.body,
+                etag=response.headers.get("ETag", cached.etag),
+                last_modified=response.headers.get(
+                    "Last-Modified", cached.last_modified),
+                fetched_at=time.time()
+            )
+        else:
+            self._fetched += 1
+            cached = _CachedFile(
+                status_code=response.status_code,
+                body=response.text,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                fetched_at=time.time()
             )
-            return GHResponse(status=GH_SC.HTTP_ERROR)
-        except requests.exceptions.RequestException as e:
-            print(e)
-            return GHResponse(status=GH_SC.REQ_FAIL_H)
 
-        if response.status_code != 200:
-            return GHResponse(status=GH_SC.HTTP_ERROR)
+        self._store(url, cached)
+        return (GH_SC.OK, cached)
 
-        # If team name too long, return
-        if len(response.text) > int(os.getenv("MAX_TEAM_MEMBER_LEN")):
-            return GHResponse(status=GH_SC.TEAM_MEMBER_TOO_LONG)
+    def _failed(
+            self,
+            url: str,
+            cached: _CachedFile | None,
+            status: GH_SC) -> (GH_SC, _CachedFile | None):
+        self._errors += 1
+        if cached is not None:
+            print(f"[GHController._fetch] serving stale copy of {url}")
+            return (GH_SC.OK, cached)
+        return (status, None)
 
-        return GHResponse(
-            response=response.text,
-            status=GH_SC.OK
-        )
+    def _cached(self, url: str) -> _CachedFile | None:
+        cached = self._cache.get(url)
+        if cached is not None or self._db is None:
+            return cached
+
+        (status, row) = self._db.get_gh_metadata(url)
+        if status == DB_query_status.QUERY_FAILED:
+            print(f"[GHController._cached] {row}")
+        if status != DB_query_status.SUCCESS:
+            return None
+
+        cached = _CachedFile(*row)
+        self._cache[url] = cached
+        return cached
+
+    def _store(self, url: str, cached: _CachedFile):
+        self._cache[url] = cached
+        if self._db is None:
+            return
+
+        (status, e) = self._db.put_gh_metadata(
+            url, cached.status_code, cached.body, cached.etag,
+            cached.last_modified, cached.fetched_at)
+        if status != DB_query_status.SUCCESS:
+            print(f"[GHController._store] failed to persist {url}: {e}")
@@ -0,0 +1,442 @@
+import asyncio
+import bisect
+import heapq
+import itertools
+import os
+import random
+import threading
+from dataclasses import dataclass, field
+from time import monotonic
+from dotenv import load_dotenv
+
+from roker.controllers.db_controller import DB_query_status
+from roker.controllers.event_controller import ContainerState
+from roker.controllers.registry_controller import AgentRegistry
+
+load_dotenv()
+
+DEFAULT_HEALTH_HOST = "127.0.0.1"
+DEFAULT_HEALTH_PATH = "/health"
+DEFAULT_HEALTH_INTERVAL = 5.0
+DEFAULT_HEALTH_JITTER = 0.2
+DEFAULT_HEALTH_TIMEOUT = 1.0
+DEFAULT_HEALTH_MAX_PROBES = 256
+DEFAULT_HEALTH_FALL = 3
+DEFAULT_HEALTH_FLUSH_INTERVAL = 1.0
+
+# Upper bounds (seconds) of the latency histogram buckets. Anything slower
+# lands in one last overflow bucket.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+# Seconds a TCP probe's connection must stay open to pass
+_TCP_HOLD = 0.1
+
+# Longest the scheduler sleeps, so targets watched from other threads are
+# picked up promptly
+_MAX_SLEEP = 0.25
+
+
+class LatencyHistogram:
+    """Counts of observed latencies in the fixed LATENCY_BUCKETS buckets"""
+
+    def __init__(self):
+        self.counts: list[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Upper bound of the bucket holding the `q` quantile, None when
+        nothing was observed or it fell in the overflow bucket
+        """
+        if self.total == 0:
+            return None
+        rank = q * self.total
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) \
+                    else None
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(LATENCY_BUCKETS),
+            "counts": list(self.counts),
+            "total": self.total,
+            "mean": self.sum / self.total if self.total else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+@dataclass
+class _Target:
+    """
+    healthy:  None until the first probe has finished
+    failures: consecutive failed probes
+    version:  new on every watch, so stale heap entries are skipped
+    """
+    agent_id: int
+    container_id: str
+    port: int
+    version: int = 0
+    healthy: bool | None = None
+    failures: int = 0
+    probes: int = 0
+    last_latency: float | None = None
+    last_probe: float = 0.0
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class HealthController:
+    """
+    Probes every watched agent on its published port.
+
+    A single asyncio task keeps a heap of when each agent is next due and
+    starts its probe, so thousands of agents cost no threads. At most
+    `max_probes` probes are in flight; past that the scheduler waits for
+    one to finish. Each agent is probed every `interval` seconds, give or
+    take `jitter` (a fraction of the interval), so probes spread out.
+
+    A probe is an HTTP GET of `path` that must answer 2xx within `timeout`
+    seconds. With `path` set to "" it is a TCP connect instead, passing if
+    the agent sends a byte or holds the connection open for a moment.
+    That is a weak check: docker's port proxy accepts connects on a
+    published port whether the agent listens or not, and only closes them
+    once it fails to reach it. An agent turns healthy on
+    its first passing probe and unhealthy after `fall` failing ones in a
+    row. Changes are written to `agents.active` in one batch every
+    `flush_interval` seconds.
+
+    While an agent is held (see `hold`) whoever holds it owns its watch,
+    and `on_state` leaves it alone.
+
+    `watch`, `unwatch`, `hold`, `release` and `on_state` may be called
+    from any thread.
+    """
+
+    def __init__(
+        self,
+        registry: AgentRegistry,
+        host: str = os.getenv("HEALTH_HOST", DEFAULT_HEALTH_HOST),
+        path: str = os.getenv("HEALTH_PATH", DEFAULT_HEALTH_PATH),
+        interval: float = float(os.getenv(
+            "HEALTH_INTERVAL", DEFAULT_HEALTH_INTERVAL)),
+        jitter: float = float(os.getenv(
+            "HEALTH_JITTER", DEFAULT_HEALTH_JITTER)),
+        timeout: float = float(os.getenv(
+            "HEALTH_TIMEOUT", DEFAULT_HEALTH_TIMEOUT)),
+        max_probes: int = int(os.getenv(
+            "HEALTH_MAX_PROBES", DEFAULT_HEALTH_MAX_PROBES)),
+        fall: int = int(os.getenv("HEALTH_FALL", DEFAULT_HEALTH_FALL)),
+        flush_interval: float = float(os.getenv(
+            "HEALTH_FLUSH_INTERVAL", DEFAULT_HEALTH_FLUSH_INTERVAL))
+    ):
+        self._registry: AgentRegistry = registry
+        self._host: str = host
+        self._path: str = path
+        self._interval: float = interval
+        self._jitter: float = jitter
+        self._timeout: float = timeout
+        self._max_probes: int = max_probes
+        self._fall: int = max(1, fall)
+        self._flush_interval: float = flush_interval
+
+        self._lock: threading.Lock = threading.Lock()
+        self._targets: dict[int, _Target] = {}
+        self._by_container: dict[str, int] = {}
+        # (due, agent id, target version)
+        self._due: list[tuple[float, int, int]] = []
+        self._versions = itertools.count()
+        # agent id -> healthy, waiting for the next flush
+        self._pending: dict[int, bool] = {}
+        # agent id -> how many callers hold it
+        self._held: dict[int, int] = {}
+        # agent id -> futures of wait_healthy callers
+        self._waiters: dict[int, list[asyncio.Future]] = {}
+
+        self._semaphore: asyncio.Semaphore = None
+        self._tasks: list[asyncio.Task] = []
+        self._probing: set[asyncio.Task] = set()
+
+        self._probes: int = 0
+        self._failures: int = 0
+        self._flips: int = 0
+        self._flushes: int = 0
+
+    # PUBLIC
+
+    def start(self):
+        """Starts the scheduler and flusher on the running event loop"""
+        if len(self._tasks) > 0:
+            return
+        self._semaphore = asyncio.Semaphore(self._max_probes)
+        self._tasks = [asyncio.create_task(self._schedule()),
+                       asyncio.create_task(self._flush_loop())]
+
+    async def stop(self):
+        """Stops probing and writes out any pending changes"""
+        for task in [*self._tasks, *self._probing]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._probing,
+                             return_exceptions=True)
+        self._tasks = []
+        self._flush()
+
+    def watch(self, agent_id: int, container_id: str, port: int,
+              delay: float = 0.0):
+        """Starts probing an agent, first after `delay` seconds"""
+        with self._lock:
+            old = self._targets.get(agent_id)
+            target = _Target(agent_id, container_id, port,
+                             version=next(self._versions))
+            if old is not None:
+                target.healthy = old.healthy
+                target.histogram = old.histogram
+                if old.container_id != container_id:
+                    self._by_container.pop(old.container_id, None)
+            self._targets[agent_id] = target
+            self._by_container[container_id] = agent_id
+            heapq.heappush(self._due, (monotonic() + delay, agent_id,
+                                       target.version))
+
+    def unwatch(self, agent_id: int):
+        """Stops probing an agent. Its `active` column is left alone."""
+        with self._lock:
+            target = self._targets.pop(agent_id, None)
+            if target is not None:
+                self._by_container.pop(target.container_id, None)
+            self._pending.pop(agent_id, None)
+
+    def hold(self, agent_id: int):
+        """
+        Keeps `on_state` from watching or unwatching an agent until it is
+        released, e.g. while a restart watches it and waits for it to turn
+        healthy. The die and start events of that restart would otherwise
+        unwatch it after the fact, or put its first probe off by up to an
+        `interval`.
+        """
+        with self._lock:
+            self._held[agent_id] = self._held.get(agent_id, 0) + 1
+
+    def release(self, agent_id: int):
+        """Undoes one `hold`"""
+        with self._lock:
+            held = self._held.get(agent_id, 0) - 1
+            if held > 0:
+                self._held[agent_id] = held
+            else:
+                self._held.pop(agent_id, None)
+
+    def on_state(self, state: ContainerState):
+        """
+        EventController listener. Agents are probed while their container
+        runs; containers that are not agents (yet), and held agents, are
+        ignored.
+        """
+        if state.status != "running":
+            with self._lock:
+                agent_id = self._by_container.get(state.container_id)
+                if agent_id in self._held:
+                    return
+            if agent_id is not None:
+                self.unwatch(agent_id)
+            return
+
+        (status, agent) = self._registry.get_agent_data(state.container_id)
+        if status != DB_query_status.SUCCESS:
+            return
+        with self._lock:
+            if agent.id in self._held:
+                return
+        # Spread out the probes of containers found all at once
+        self.watch(agent.id, agent.container_id, agent.port_number,
+                   delay=random.uniform(0, self._interval))
+
+    async def wait_healthy(self, agent_id: int,
+                           timeout: float | None = None) -> bool:
+        """
+        Waits for a watched agent's next passing probe, or returns at once
+        if it is already healthy. False if `timeout` ran out first.
+        """
+        with self._lock:
+            target = self._targets.get(agent_id)
+            if target is not None and target.healthy:
+                return True
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(agent_id, []).append(future)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(agent_id, [])
+                if future in waiters:
+                    waiters.remove(future)
+                if len(waiters) == 0:
+                    self._waiters.pop(agent_id, None)
+
+    def get_health(self, agent_id: int) -> dict | None:
+        """Health and probe latency of one watched agent"""
+        with self._lock:
+            target = self._targets.get(agent_id)
+            if target is None:
+                return None
+            return {
+                "agent_id": target.agent_id,
+                "container_id": target.container_id,
+                "port": target.port,
+                "healthy": target.healthy,
+                "failures": target.failures,
+                "probes": target.probes,
+                "last_latency": target.last_latency,
+                "latency": target.histogram.to_dict(),
+            }
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            targets = list(self._targets.values())
+            pending = len(self._pending)
+        return {
+            "targets": len(targets),
+            "healthy": sum(1 for t in targets if t.healthy),
+            "unhealthy": sum(1 for t in targets if t.healthy is False),
+            "in_flight": len(self._probing),
+            "probes": self._probes,
+            "failures": self._failures,
+            "flips": self._flips,
+            "pending": pending,
+            "flushes": self._flushes,
+        }
+
+    # PRIVATE
+
+    async def _schedule(self):
+        while True:
+            now = monotonic()
+            due = None
+            with self._lock:
+                while len(self._due) > 0:
+                    (at, agent_id, version) = self._due[0]
+                    target = self._targets.get(agent_id)
+                    if target is None or target.version != version:
+                        heapq.heappop(self._due)
+                        continue
+                    if at <= now:
+                        heapq.heappop(self._due)
+                        due = target
+                    break
+                wait = self._due[0][0] - now if len(self._due) > 0 \
+                    else _MAX_SLEEP
+
+            if due is None:
+                await asyncio.sleep(min(max(wait, 0), _MAX_SLEEP))
+                continue
+
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._probe_target(due))
+            self._probing.add(task)
+            task.add_done_callback(self._probing.discard)
+
+    async def _probe_target(self, target: _Target):
+        try:
+            start = monotonic()
+            ok = await self._probe(target.port)
+            latency = monotonic() - start
+        finally:
+            self._semaphore.release()
+        self._record(target, ok, latency)
+
+    async def _probe(self, port: int) -> bool:
+        try:
+            return await asyncio.wait_for(self._check(port), self._timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def _check(self, port: int) -> bool:
+        (reader, writer) = await asyncio.open_connection(self._host, port)
+        try:
+            if self._path == "":
+                try:
+                    # A connection closed at once was docker's proxy
+                    # failing to reach the agent
+                    return await asyncio.wait_for(
+                        reader.read(1), min(_TCP_HOLD, self._timeout / 2)
+                    ) != b""
+                except asyncio.TimeoutError:
+                    return True
+            writer.write((f"GET {self._path} HTTP/1.1\r\n"
+                          f"Host: {self._host}:{port}\r\n"
+                          "Connection: close\r\n\r\n").encode("ascii"))
+            await writer.drain()
+            parts = (await reader.readline()).split()
+            return len(parts) >= 2 and parts[1].startswith(b"2")
+        finally:
+            writer.close()
+
+    def _record(self, target: _Target, ok: bool, latency: float):
+        self._probes += 1
+        with self._lock:
+            # Unwatched (or watched again) while the probe ran
+            if self._targets.get(target.agent_id) is not target:
+                return
+
+            target.probes += 1
+            target.last_probe = monotonic()
+            if ok:
+                target.failures = 0
+                target.last_latency = latency
+                target.histogram.observe(latency)
+                healthy = True
+            else:
+                self._failures += 1
+                target.failures += 1
+                healthy = (False if target.failures >= self._fall
+                           else target.healthy)
+
+            if healthy is not None and healthy != target.healthy:
+                target.healthy = healthy
+                self._pending[target.agent_id] = healthy
+                self._flips += 1
+
+            spread = self._interval * self._jitter
+            heapq.heappush(self._due, (
+                target.last_probe + self._interval
+                + random.uniform(-spread, spread),
+                target.agent_id, target.version))
+
+            waiters = self._waiters.pop(target.agent_id, []) if ok else []
+
+        for future in waiters:
+            if not future.done():
+                future.set_result(True)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+            pending = self._pending
+            self._pending = {}
+
+        (status, e) = self._registry.update_agents_data([
+            (agent_id, {"active": healthy})
+            for (agent_id, healthy) in pending.items()])
+        self._flushes += 1
+        if status not in (DB_query_status.SUCCESS, DB_query_status.QUEUED):
+            print(f"[HealthController._flush] failed to update agents: {e}")
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from dotenv import load_dotenv
+
+from roker.controllers.db_controller import DB_Controller, DB_query_status
+
+load_dotenv()
+
+DEFAULT_JOB_WORKERS = 8
+DEFAULT_JOB_QUEUE_LIMIT = 1024
+# Longest a long poll or event stream goes without an answer
+DEFAULT_JOB_POLL_TIMEOUT = 30.0
+
+FINISHED = ("done", "failed")
+
+
+class JOB_SC(IntEnum):
+    DB_FAILED = -3
+    QUEUE_FULL = -2
+    BAD_KIND = -1
+    OK = 0
+
+
+@dataclass
+class _Job:
+    """
+    A job that is queued or running.
+
+    stages:   [stage, unix time] of every stage the job entered
+    progress: details of the current stage, like its queue position
+    version:  bumped every time the job changes
+    """
+    id: int
+    kind: str
+    params: dict
+    priority: int
+    created_at: float
+    status: str = "queued"
+    stages: list = field(default_factory=list)
+    progress: dict = field(default_factory=dict)
+    result: dict | None = None
+    error: str | None = None
+    finished_at: float | None = None
+    version: int = 0
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class JobController:
+    """
+    Runs long operations in the background, so requests return a job id
+    at once instead of holding the connection open.
+
+    `runners` maps a job kind to an async callable taking the job's
+    params and a `progress(stage, **details)` callback, and returning
+    (True, result dict) or (False, error message). Queued jobs are run by
+    `workers` workers, highest `priority` first and first come first
+    served within a priority.
+
+    Jobs are recorded in sqlite every time they enter a stage; details
+    reported within a stage only live in memory. Clients follow a job with
+    `wait` (long poll) or `follow` (a stream of changes), neither of which
+    takes up a worker.
+    """
+
+    def __init__(
+        self,
+        db: DB_Controller,
+        runners: dict,
+        workers: int = int(os.getenv("JOB_WORKERS", DEFAULT_JOB_WORKERS)),
+        queue_limit: int = int(os.getenv(
+            "JOB_QUEUE_LIMIT", DEFAULT_JOB_QUEUE_LIMIT)),
+        poll_timeout: float = float(os.getenv(
+            "JOB_POLL_TIMEOUT", DEFAULT_JOB_POLL_TIMEOUT))
+    ):
+        self._db: DB_Controller = db
+        self._runners: dict = runners
+        self._workers: int = max(1, workers)
+        self._queue_limit: int = queue_limit
+        self.poll_timeout: float = poll_timeout
+
+        self._jobs: dict[int, _Job] = {}
+        # (-priority, job id)
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._tasks: list[asyncio.Task] = []
+
+        self._submitted: int = 0
+        self._done: int = 0
+        self._failed: int = 0
+        self._rejected: int = 0
+
+    # PUBLIC
+
+    def start(self):
+        """
+        Starts the workers. Jobs a previous run left unfinished are marked
+        failed, as nothing will pick them up again.
+        """
+        (status, count) = self._db.fail_unfinished_jobs(
+            "interrupted by a restart of roker", time.time())
+        if status != DB_query_status.SUCCESS:
+            print(f"[JobController.start] can't fail old jobs: {count}")
+        elif count:
+            print(f"[JobController.start] {count} unfinished jobs failed")
+
+        for _ in range(self._workers - len(self._tasks)):
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def stop(self):
+        """Stops the workers, failing the jobs that were not finished"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for job in list(self._jobs.values()):
+            self._finish(job, "failed", error="roker shut down")
+
+    def submit(
+            self,
+            kind: str,
+            params: dict,
+            priority: int = 0) -> (JOB_SC, int | str | None):
+        """Queues a job and returns its id without waiting for it to run"""
+        if kind not in self._runners:
+            return (JOB_SC.BAD_KIND, None)
+        if self._queue.qsize() >= self._queue_limit:
+            self._rejected += 1
+            return (JOB_SC.QUEUE_FULL, None)
+
+        now = time.time()
+        (status, job_id) = self._db.add_job(kind, params, now)
+        if status != DB_query_status.SUCCESS:
+            return (JOB_SC.DB_FAILED, str(job_id))
+
+        self._jobs[job_id] = _Job(
+            id=job_id, kind=kind, params=params, priority=priority,
+            created_at=now, stages=[["queued", now]])
+        self._queue.put_nowait((-priority, job_id))
+        self._submitted += 1
+        return (JOB_SC.OK, job_id)
+
+    def get_job(self, job_id: int) -> dict | None:
+        """A job, from memory while it is live and from sqlite after"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return self._to_dict(job)
+
+        (status, row) = self._db.get_job(job_id)
+        if status != DB_query_status.SUCCESS:
+            return None
+        (_, kind, params, status, stages, result, error, created_at,
+         finished_at) = row
+        stages = json.loads(stages)
+        return {
+            "id": job_id,
+            "kind": kind,
+            "params": json.loads(params),
+            "status": status,
+            "stage": stages[-1][0],
+            "stages": stages,
+            "progress": {},
+            "result": None if result is None else json.loads(result),
+            "error": error,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "version": len(stages),
+        }
+
+    async def wait(
+            self,
+            job_id: int,
+            version: int | None = None,
+            timeout: float | None = None) -> dict | None:
+        """
+        Long poll: returns the job once its version is no longer `version`,
+        or as it is after `timeout` seconds (`poll_timeout` at most).
+        Finished jobs are returned at once.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and job.version == version:
+            timeout = self.poll_timeout if timeout is None else min(
+                timeout, self.poll_timeout)
+            try:
+                await asyncio.wait_for(job.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get_job(job_id)
+
+    async def follow(self, job_id: int):
+        """
+        Yields the job every time it changes, until it is finished. Yields
+        None when `poll_timeout` passed without a change, so the caller
+        can keep its connection alive.
+        """
+        version = None
+        while True:
+            job = await self.wait(job_id, version)
+            if job is None:
+                return
+            if job["version"] == version and job["status"] not in FINISHED:
+                yield None
+                continue
+            version = job["version"]
+            yield job
+            if job["status"] in FINISHED:
+                return
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self._workers,
+            "queued": self._queue.qsize(),
+            "running": sum(1 for job in self._jobs.values()
+                           if job.status == "running"),
+            "submitted": self._submitted,
+            "done": self._done,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+
+    # PRIVATE
+
+    async def _work(self):
+        while True:
+            (_, job_id) = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+
+            job.status = "running"
+            self._progress(job, "running", {})
+
+            def progress(stage: str, **details):
+                self._progress(job, stage, details)
+
+            try:
+                (ok, result) = await self._runners[job.kind](
+                    job.params, progress)
+            except asyncio.CancelledError:
+                self._finish(job, "failed", error="roker shut down")
+                raise
+            except Exception as e:
+                print(f"[JobController._work] job {job.id} raised: {e}")
+                (ok, result) = (False, str(e) or type(e).__name__)
+
+            if ok:
+                self._finish(job, "done", result=result)
+            else:
+                self._finish(job, "failed", error=result)
+
+    def _progress(self, job: _Job, stage: str, details: dict):
+        if job.id not in self._jobs:
+            return
+        if stage != job.stages[-1][0]:
+            job.stages.append([stage, time.time()])
+            job.progress = {}
+            self._save(job)
+        job.progress.update(details)
+        self._changed(job)
+
+    def _finish(self, job: _Job, status: str, result: dict | None = None,
+                error: str | None = None):
+        if self._jobs.pop(job.id, None) is None:
+            return
+        job.finished_at = time.time()
+        job.status = status
+        job.result = result
+        job.error = error
+        job.stages.append([status, job.finished_at])
+        if status == "done":
+            self._done += 1
+        else:
+            self._failed += 1
+        self._save(job)
+        self._changed(job)
+
+    def _save(self, job: _Job):
+        (status, e) = self._db.update_job(
+            job.id, job.status, job.stages, job.result, job.error,
+            job.finished_at)
+        if status != DB_query_status.SUCCESS:
+            print(f"[JobController._save] job {job.id}: {status.name} {e}")
+
+    def _changed(self, job: _Job):
+        """Wakes up everyone waiting on the job"""
+        job.version += 1
+        (changed, job.changed) = (job.changed, asyncio.Event())
+        changed.set()
+
+    def _to_dict(self, job: _Job) -> dict:
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "params": job.params,
+            "status": job.status,
+            "stage": job.stages[-1][0],
+            "stages": job.stages,
+            "progress": job.progress,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "version": job.version,
+        }
@@ -0,0 +1,753 @@
+import asyncio
+import calendar
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from dotenv import load_dotenv
+import docker
+
+from roker.controllers.engine_controller import mem_limit_to_bytes
+from roker.controllers.event_controller import ContainerState
+
+load_dotenv()
+
+DEFAULT_LOG_MAX_STREAMS = 32
+DEFAULT_LOG_STORE_DIR = "/.roker/logs/"
+DEFAULT_LOG_SEGMENT_BYTES = "8mb"
+DEFAULT_LOG_FRAME_BYTES = "64kb"
+DEFAULT_LOG_RETENTION_BYTES = "64mb"
+DEFAULT_LOG_RETENTION_AGE = 604800.0
+DEFAULT_LOG_FLUSH_INTERVAL = 1.0
+DEFAULT_LOG_SHIP_MAX_STREAMS = 1024
+
+# Seconds between sweeping every agent's segments for retention
+_RETENTION_SWEEP_INTERVAL = 60
+# Output without a newline is stored in pieces of at most this many bytes
+_MAX_LINE_BYTES = 64 * 1024
+
+
+class LOG_SC(IntEnum):
+    TOO_MANY_STREAMS = -3
+    NOT_FOUND = -2
+    FAILED = -1
+    OK = 0
+
+
+def _next_chunk(stream) -> bytes | None:
+    """Blocks for the next chunk of a docker log stream, None at its end"""
+    try:
+        return next(stream, None)
+    except (docker.errors.APIError, OSError, ValueError):
+        # The stream was closed under us, or the daemon dropped it
+        return None
+
+
+class LogStream:
+    """
+    Async iterator over the raw chunks of one container's log.
+
+    Chunks are pulled from the daemon one at a time, and only once the
+    previous chunk has been consumed. A client reading slowly therefore
+    slows down the read from the daemon instead of making roker buffer
+    the log. Always `close` the stream, even when iteration is cut short.
+    """
+
+    def __init__(self, stream, executor: ThreadPoolExecutor, on_close):
+        self._stream = stream
+        self._executor: ThreadPoolExecutor = executor
+        self._on_close = on_close
+        self._closed: bool = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._closed:
+            raise StopAsyncIteration
+
+        chunk = await asyncio.get_running_loop().run_in_executor(
+            self._executor, _next_chunk, self._stream)
+        if chunk is None:
+            self.close()
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        """
+        Stops reading from the daemon. A read still blocked in a worker
+        thread is unblocked by closing its socket.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+        self._on_close()
+
+
+class LogController:
+    """
+    Streams container logs from the docker daemon without ever holding a
+    whole log in memory.
+
+    Every open stream occupies one worker of a dedicated thread pool for
+    as long as it is open (follow mode streams can stay open
+    indefinitely), so at most `max_streams` streams may be open at once.
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        max_streams: int = int(os.getenv(
+            "LOG_MAX_STREAMS", DEFAULT_LOG_MAX_STREAMS))
+    ):
+        self._client: docker.DockerClient = client
+        self._max_streams: int = max_streams
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_streams,
+            thread_name_prefix="roker-logs"
+        )
+        self._lock: threading.Lock = threading.Lock()
+        self._open: int = 0
+
+    # PUBLIC
+
+    async def open(
+            self,
+            container_id: str,
+            tail: int | None = None,
+            since: int | None = None,
+            until: int | None = None,
+            follow: bool = False,
+            timestamps: bool = False) -> (LOG_SC, LogStream | str | None):
+        """
+        Opens a stream over a container's stdout and stderr.
+
+        `tail` limits the output to the last lines of the log, `since` and
+        `until` (unix seconds) to a time window. With `follow` the stream
+        keeps going as the container writes more.
+
+        @return a tuple, with the first index always being `LOG_SC`
+        `(LOG_SC.OK, LogStream)`:            stream opened
+        `(LOG_SC.NOT_FOUND, str)`:           no such container
+        `(LOG_SC.TOO_MANY_STREAMS, None)`:   `max_streams` already open
+        `(LOG_SC.FAILED, str)`:              the daemon refused
+        """
+        with self._lock:
+            if self._open >= self._max_streams:
+                return (LOG_SC.TOO_MANY_STREAMS, None)
+            self._open += 1
+
+        try:
+            stream = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                lambda: self._client.api.logs(
+                    container_id,
+                    stdout=True,
+                    stderr=True,
+                    stream=True,
+                    follow=follow,
+                    tail="all" if tail is None else tail,
+                    since=since,
+                    until=until,
+                    timestamps=timestamps
+                )
+            )
+        except docker.errors.NotFound as e:
+            self._release()
+            return (LOG_SC.NOT_FOUND, str(e))
+        except (docker.errors.APIError, OSError) as e:
+            self._release()
+            print(f"[LogController.open] {container_id}: {e}")
+            return (LOG_SC.FAILED, str(e))
+        except BaseException:
+            self._release()
+            raise
+
+        return (LOG_SC.OK, LogStream(stream, self._executor, self._release))
+
+    def get_open(self) -> int:
+        """Returns the number of log streams currently open"""
+        with self._lock:
+            return self._open
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # PRIVATE
+
+    def _release(self):
+        with self._lock:
+            self._open -= 1
+
+
+# Segment files are a sequence of frames, each a FRAME_HEADER followed by
+# a zlib compressed run of records. Every record is a RECORD_HEADER
+# (timestamp in ns, length) followed by the line.
+FRAME_HEADER = struct.Struct(">QQI")
+RECORD_HEADER = struct.Struct(">QI")
+# Index files hold one (first timestamp, frame offset) entry per frame
+INDEX_ENTRY = struct.Struct(">QQ")
+
+_SEGMENT_SUFFIX = ".seg"
+_INDEX_SUFFIX = ".idx"
+
+
+def parse_docker_timestamp(ts: bytes) -> int | None:
+    """
+    Parses the RFC 3339 timestamp docker prefixes log lines with
+    (`2024-05-01T14:02:03.123456789Z`) into unix nanoseconds.
+    """
+    try:
+        seconds = calendar.timegm(time.strptime(
+            ts[:19].decode("ascii"), "%Y-%m-%dT%H:%M:%S"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    fraction = ts[19:].rstrip(b"Z")
+    nanos = 0
+    if fraction.startswith(b"."):
+        digits = fraction[1:10]
+        if not digits.isdigit():
+            return None
+        nanos = int(digits.ljust(9, b"0"))
+    return seconds * 1_000_000_000 + nanos
+
+
+class _SegmentWriter:
+    """Appends records to one agent's active segment, a frame at a time"""
+
+    def __init__(self, agent_dir: str):
+        self.agent_dir: str = agent_dir
+        self.segment: str = None
+        self.segment_bytes: int = 0
+        self.last_ts: int = 0
+        self.buffer: bytearray = bytearray()
+        self.buffer_first_ts: int = 0
+        self.buffer_last_ts: int = 0
+        self.buffered_at: float = 0.0
+        self.lock: threading.Lock = threading.Lock()
+
+    def append(self, ts: int, line: bytes):
+        if len(self.buffer) == 0:
+            self.buffer_first_ts = ts
+            self.buffered_at = time.monotonic()
+        self.buffer += RECORD_HEADER.pack(ts, len(line))
+        self.buffer += line
+        self.buffer_last_ts = ts
+        self.last_ts = max(self.last_ts, ts)
+
+    def flush(self) -> int:
+        """Writes the buffered records as one frame. Returns bytes written"""
+        if len(self.buffer) == 0:
+            return 0
+        if self.segment is None:
+            self.segment = os.path.join(
+                self.agent_dir, f"{self.buffer_first_ts:020d}")
+            self.segment_bytes = 0
+
+        payload = zlib.compress(bytes(self.buffer))
+        frame = FRAME_HEADER.pack(
+            self.buffer_first_ts, self.buffer_last_ts, len(payload)) + payload
+
+        with open(self.segment + _SEGMENT_SUFFIX, "ab") as f:
+            offset = f.tell()
+            f.write(frame)
+        with open(self.segment + _INDEX_SUFFIX, "ab") as f:
+            f.write(INDEX_ENTRY.pack(self.buffer_first_ts, offset))
+
+        self.segment_bytes = offset + len(frame)
+        self.buffer = bytearray()
+        return len(frame)
+
+    def rotate(self):
+        """The next frame starts a new segment"""
+        self.segment = None
+        self.segment_bytes = 0
+
+
+class LogStore:
+    """
+    Append-only, compressed store of agent logs that outlives containers.
+
+    Each container gets a directory of segment files. Lines are buffered
+    per container and written as zlib compressed frames of about
+    `frame_bytes` (or every `flush_interval` seconds, for quiet agents).
+    Every frame gets an entry in the segment's sparse index, mapping the
+    timestamp of its first line to its offset, so reading a time window
+    is a binary search plus a read of only the frames in the window.
+
+    Segments are rotated at `segment_bytes`. Per container, the oldest
+    segments are deleted once the total passes `retention_bytes`, and any
+    segment whose newest line is older than `retention_age` seconds is
+    deleted.
+    """
+
+    def __init__(
+        self,
+        root_dir: str = os.path.expanduser("~") + os.getenv(
+            "LOG_STORE_DIR", DEFAULT_LOG_STORE_DIR),
+        segment_bytes: int = mem_limit_to_bytes(os.getenv(
+            "LOG_SEGMENT_BYTES", DEFAULT_LOG_SEGMENT_BYTES)),
+        frame_bytes: int = mem_limit_to_bytes(os.getenv(
+            "LOG_FRAME_BYTES", DEFAULT_LOG_FRAME_BYTES)),
+        retention_bytes: int = mem_limit_to_bytes(os.getenv(
+            "LOG_RETENTION_BYTES", DEFAULT_LOG_RETENTION_BYTES)),
+        retention_age: float = float(os.getenv(
+            "LOG_RETENTION_AGE", DEFAULT_LOG_RETENTION_AGE)),
+        flush_interval: float = float(os.getenv(
+            "LOG_FLUSH_INTERVAL", DEFAULT_LOG_FLUSH_INTERVAL))
+    ):
+        self._root_dir: str = root_dir
+        self._segment_bytes: int = segment_bytes
+        self._frame_bytes: int = frame_bytes
+        self._retention_bytes: int = retention_bytes
+        self._retention_age: float = retention_age
+        self._flush_interval: float = flush_interval
+
+        self._lock: threading.Lock = threading.Lock()
+        # container id -> writer of its active segment
+        self._writers: dict[str, _SegmentWriter] = {}
+
+        self._flusher: threading.Thread = None
+        self._stopping: threading.Event = threading.Event()
+        self._lines: int = 0
+        self._bytes_written: int = 0
+        self._segments_deleted: int = 0
+
+        os.makedirs(self._root_dir, exist_ok=True)
+
+    # PUBLIC
+
+    def start(self):
+        """Starts flushing quiet agents and enforcing retention"""
+        if self._flusher is not None:
+            return
+        self._stopping.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="roker-log-store", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stops the background thread and flushes every agent"""
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        for container_id in list(self._writers.keys()):
+            self.close(container_id)
+
+    def append(self, container_id: str, ts: int, line: bytes):
+        """Appends one line, logged at `ts` unix nanoseconds"""
+        writer = self._writer(container_id)
+        with writer.lock:
+            writer.append(ts, line)
+            self._lines += 1
+            if len(writer.buffer) >= self._frame_bytes:
+                self._flush_writer(container_id, writer)
+
+    def flush(self, container_id: str):
+        """Writes out whatever `container_id` has buffered"""
+        with self._lock:
+            writer = self._writers.get(container_id)
+        if writer is not None:
+            with writer.lock:
+                self._flush_writer(container_id, writer)
+
+    def close(self, container_id: str):
+        """Flushes and forgets an agent's writer, e.g. once it has exited"""
+        self.flush(container_id)
+        with self._lock:
+            self._writers.pop(container_id, None)
+
+    def last_timestamp(self, container_id: str) -> int:
+        """Timestamp of the newest line stored for `container_id`, or 0"""
+        with self._lock:
+            writer = self._writers.get(container_id)
+        if writer is not None and writer.last_ts > 0:
+            return writer.last_ts
+
+        last = 0
+        for (start, _) in self._segments(container_id)[-1:]:
+            for (_, last_ts, _) in self._frames(container_id, start, 0):
+                last = max(last, last_ts)
+        return last
+
+    def read(
+            self,
+            container_id: str,
+            since: int = 0,
+            until: int | None = None):
+        """
+        Yields (timestamp, line) for every stored line of `container_id`
+        logged between `since` and `until` unix nanoseconds, inclusive.
+        """
+        self.flush(container_id)
+        segments = self._segments(container_id)
+
+        for (i, (start, _)) in enumerate(segments):
+            if until is not None and start > until:
+                return
+            # Lines never go back in time, so a segment ends where the
+            # next one starts
+            if i + 1 < len(segments) and segments[i + 1][0] < since:
+                continue
+
+            offset = self._seek(container_id, start, since)
+            for (first_ts, last_ts, payload) in self._frames(
+                    container_id, start, offset, with_payload=True):
+                if until is not None and first_ts > until:
+                    return
+                if last_ts < since:
+                    continue
+                for (ts, line) in self._records(payload):
+                    if ts >= since and (until is None or ts <= until):
+                        yield (ts, line)
+
+    def enforce_retention(self, container_id: str):
+        """Deletes the segments past the size and age limits"""
+        with self._lock:
+            writer = self._writers.get(container_id)
+        active = writer.segment if writer is not None else None
+
+        segments = self._segments(container_id)
+        total = sum(size for (_, size) in segments)
+        cutoff = (time.time() - self._retention_age) * 1_000_000_000
+
+        for (i, (start, size)) in enumerate(segments):
+            path = self._segment_path(container_id, start)
+            if path == active:
+                break
+            # The newest line of a segment is no newer than the next
+            # segment's start, or the last write for the final segment
+            try:
+                newest = (segments[i + 1][0] if i + 1 < len(segments) else
+                          os.path.getmtime(path + _SEGMENT_SUFFIX) * 1e9)
+            except OSError:
+                continue
+            too_old = newest < cutoff
+            if total <= self._retention_bytes and not too_old:
+                break
+            for suffix in (_SEGMENT_SUFFIX, _INDEX_SUFFIX):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            total -= size
+            self._segments_deleted += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            writers = len(self._writers)
+        return {
+            "writers": writers,
+            "lines": self._lines,
+            "bytes_written": self._bytes_written,
+            "segments_deleted": self._segments_deleted,
+        }
+
+    # PRIVATE
+
+    def _agent_dir(self, container_id: str) -> str:
+        return os.path.join(self._root_dir, container_id)
+
+    def _segment_path(self, container_id: str, start: int) -> str:
+        return os.path.join(self._agent_dir(container_id), f"{start:020d}")
+
+    def _writer(self, container_id: str) -> _SegmentWriter:
+        with self._lock:
+            writer = self._writers.get(container_id)
+            if writer is None:
+                os.makedirs(self._agent_dir(container_id), exist_ok=True)
+                # A restarted roker never appends to an old segment, so a
+                # torn final frame can not end up mid-segment
+                writer = _SegmentWriter(self._agent_dir(container_id))
+                self._writers[container_id] = writer
+            return writer
+
+    def _flush_writer(self, container_id: str, writer: _SegmentWriter):
+        """Writes a frame, rotating the segment if full. Holds writer.lock"""
+        written = writer.flush()
+        self._bytes_written += written
+        if written and writer.segment_bytes >= self._segment_bytes:
+            writer.rotate()
+            self.enforce_retention(container_id)
+
+    def _flush_loop(self):
+        last_sweep = 0.0
+        while not self._stopping.wait(self._flush_interval):
+            with self._lock:
+                writers = list(self._writers.items())
+            now = time.monotonic()
+            for (container_id, writer) in writers:
+                with writer.lock:
+                    if (len(writer.buffer) > 0 and
+                            now - writer.buffered_at >= self._flush_interval):
+                        self._flush_writer(container_id, writer)
+
+            if now - last_sweep >= _RETENTION_SWEEP_INTERVAL:
+                for container_id in os.listdir(self._root_dir):
+                    self.enforce_retention(container_id)
+                last_sweep = now
+
+    def _segments(self, container_id: str) -> list[tuple[int, int]]:
+        """(start timestamp, size in bytes) of every segment, oldest first"""
+        try:
+            names = os.listdir(self._agent_dir(container_id))
+        except OSError:
+            return []
+
+        segments = []
+        for name in names:
+            if not name.endswith(_SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self._agent_dir(container_id), name)
+            try:
+                segments.append((int(name[:-len(_SEGMENT_SUFFIX)]),
+                                 os.path.getsize(path)))
+            except (ValueError, OSError):
+                continue
+        return sorted(segments)
+
+    def _seek(self, container_id: str, start: int, since: int) -> int:
+        """Offset of the last frame starting at or before `since`"""
+        try:
+            with open(self._segment_path(container_id, start)
+                      + _INDEX_SUFFIX, "rb") as f:
+                index = f.read()
+        except OSError:
+            return 0
+
+        # A torn final entry is ignored
+        entries = len(index) // INDEX_ENTRY.size
+        (lo, hi) = (0, entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (ts, _) = INDEX_ENTRY.unpack_from(index, mid * INDEX_ENTRY.size)
+            if ts <= since:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+        return INDEX_ENTRY.unpack_from(index, (lo - 1) * INDEX_ENTRY.size)[1]
+
+    def _frames(
+            self,
+            container_id: str,
+            start: int,
+            offset: int,
+            with_payload: bool = False):
+        """
+        Yields (first timestamp, last timestamp, payload) for each frame of
+        a segment from `offset` on. A torn final frame ends the segment.
+        """
+        try:
+            f = open(self._segment_path(container_id, start)
+                     + _SEGMENT_SUFFIX, "rb")
+        except OSError:
+            return
+
+        with f:
+            f.seek(offset)
+            while True:
+                header = f.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return
+                (first_ts, last_ts, size) = FRAME_HEADER.unpack(header)
+                if not with_payload:
+                    f.seek(size, os.SEEK_CUR)
+                    yield (first_ts, last_ts, None)
+                    continue
+                payload = f.read(size)
+                if len(payload) < size:
+                    return
+                try:
+                    yield (first_ts, last_ts, zlib.decompress(payload))
+                except zlib.error:
+                    return
+
+    def _records(self, payload: bytes):
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(payload):
+            (ts, size) = RECORD_HEADER.unpack_from(payload, offset)
+            offset += RECORD_HEADER.size
+            yield (ts, payload[offset:offset + size])
+            offset += size
+
+
+class LogShipper:
+    """
+    Copies the output of every running roker container into a LogStore.
+
+    Each container's log is followed (with timestamps) on a thread of its
+    own until the container stops, resuming after the newest line already
+    stored so a restarted roker neither loses nor duplicates lines.
+    Containers are picked up by `on_state`, meant to be an EventController
+    listener. At most `max_streams` logs are followed at once; containers
+    past that are refused, logged and counted in `get_stats`, and shipped
+    once another log's stream ends.
+
+    stdout and stderr are stored interleaved, in the order docker
+    returns them.
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        store: LogStore,
+        max_streams: int = int(os.getenv(
+            "LOG_SHIP_MAX_STREAMS", DEFAULT_LOG_SHIP_MAX_STREAMS))
+    ):
+        self._client: docker.DockerClient = client
+        self._store: LogStore = store
+        self._max_streams: int = max(1, max_streams)
+        self._lock: threading.Lock = threading.Lock()
+        # container id -> its open docker log stream, None until opened
+        self._shipping: dict[str, object] = {}
+        # Shipping containers that have since stopped; their stream ends
+        # once docker has sent the rest of their output
+        self._stopped: set[str] = set()
+        # Containers to ship once a stream is free, or once their stopped
+        # run is shipped if they were restarted, oldest first
+        self._pending: dict[str, None] = {}
+        self._refusals: int = 0
+
+    # PUBLIC
+
+    def on_state(self, state: ContainerState):
+        """EventController listener shipping running containers"""
+        if state.status == "running":
+            self.ship(state.container_id)
+            return
+        with self._lock:
+            if state.container_id in self._shipping:
+                self._stopped.add(state.container_id)
+
+    def ship(self, container_id: str) -> bool:
+        """
+        Starts following `container_id`'s log into the store.
+
+        @return False if `max_streams` logs are being followed already. The
+        container is then shipped as soon as one of them ends.
+        """
+        with self._lock:
+            if container_id in self._shipping:
+                if container_id in self._stopped:
+                    # Restarted before its last run was all shipped
+                    self._pending[container_id] = None
+                return True
+            if len(self._shipping) >= self._max_streams:
+                if container_id not in self._pending:
+                    self._pending[container_id] = None
+                    self._refusals += 1
+                    print("[LogShipper.ship] all "
+                          f"{self._max_streams} streams busy, not shipping "
+                          f"{container_id} for now")
+                return False
+            self._pending.pop(container_id, None)
+            self._shipping[container_id] = None
+
+        threading.Thread(
+            target=self._ship,
+            args=(container_id,),
+            name=f"roker-log-ship-{container_id[:12]}",
+            daemon=True
+        ).start()
+        return True
+
+    def stop(self):
+        """Closes every open log stream"""
+        with self._lock:
+            streams = [s for s in self._shipping.values() if s is not None]
+            self._shipping = {}
+            self._stopped = set()
+            self._pending = {}
+        for stream in streams:
+            stream.close()
+
+    def get_shipping(self) -> int:
+        with self._lock:
+            return len(self._shipping)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "shipping": len(self._shipping),
+                "max_streams": self._max_streams,
+                "pending": len(self._pending),
+                "refusals": self._refusals,
+            }
+
+    # PRIVATE
+
+    def _ship(self, container_id: str):
+        last_ts = self._store.last_timestamp(container_id)
+        partial = b""
+        try:
+            stream = self._client.api.logs(
+                container_id,
+                stdout=True,
+                stderr=True,
+                stream=True,
+                follow=True,
+                timestamps=True,
+                # docker's since is inclusive and in seconds; lines already
+                # stored are skipped below
+                since=last_ts // 1_000_000_000 if last_ts else None
+            )
+            with self._lock:
+                if container_id not in self._shipping:
+                    # stop() ran while the stream was opening
+                    stream.close()
+                    return
+                self._shipping[container_id] = stream
+
+            for chunk in stream:
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                if len(partial) > _MAX_LINE_BYTES:
+                    (partial, lines) = (b"", lines + [partial])
+                for line in lines:
+                    last_ts = self._store_line(container_id, line, last_ts)
+            if partial:
+                self._store_line(container_id, partial, last_ts)
+        except (docker.errors.APIError, OSError, ValueError) as e:
+            print(f"[LogShipper._ship] {container_id}: {e}")
+        finally:
+            self._store.close(container_id)
+            with self._lock:
+                self._shipping.pop(container_id, None)
+                self._stopped.discard(container_id)
+            self._ship_pending()
+
+    def _ship_pending(self):
+        """Hands free streams to pending containers, oldest first"""
+        while True:
+            with self._lock:
+                if len(self._shipping) >= self._max_streams:
+                    return
+                container_id = next(
+                    (id for id in self._pending if id not in self._shipping),
+                    None)
+                if container_id is None:
+                    return
+            if not self.ship(container_id):
+                return
+
+    def _store_line(self, container_id: str, line: bytes, last_ts: int) -> int:
+        """Stores one timestamped line unless it is already stored"""
+        (stamp, _, text) = line.partition(b" ")
+        ts = parse_docker_timestamp(stamp)
+        if ts is None:
+            # Not timestamped after all; keep it, stamped as received
+            (ts, text) = (max(time.time_ns(), last_ts), line)
+        elif ts <= last_ts:
+            return last_ts
+        self._store.append(container_id, ts, text)
+        return ts
@@ -0,0 +1,220 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+from time import monotonic
+from dotenv import load_dotenv
+
+from roker.controllers.engine_controller import mem_limit_to_bytes
+
+load_dotenv()
+
+DEFAULT_POOL_TARGET_SIZE = 0
+DEFAULT_POOL_IDLE_MEM_BUDGET = "512mb"
+DEFAULT_POOL_REFILL_PARALLELISM = 4
+DEFAULT_POOL_REFILL_INTERVAL = 5.0
+
+
+@dataclass
+class PooledContainer:
+    """
+    container: docker container, booted and waiting for a repo
+    port:      host port already published for the container
+    created:   monotonic time the container was booted
+    """
+    container: object
+    port: int
+    created: float = field(default_factory=monotonic)
+
+
+class PoolController:
+    """
+    Keeps a pool of idle, already booted containers so an agent can be
+    handed a container immediately instead of cold starting one.
+
+    The pool does not know how to create or remove containers itself.
+    `spawn` is an async callable returning a PooledContainer (or None on
+    failure) and `remove` is an async callable that tears one down.
+    `alive`, if given, is called with a PooledContainer before it is handed
+    out; containers it says are no longer running are removed and
+    replaced instead.
+
+    The pool is never grown past what `idle_mem_budget` allows for
+    containers of `container_mem` bytes each, regardless of `target_size`.
+    """
+
+    def __init__(
+        self,
+        spawn,
+        remove,
+        container_mem: int,
+        alive=None,
+        target_size: int = int(os.getenv(
+            "POOL_TARGET_SIZE", DEFAULT_POOL_TARGET_SIZE)),
+        idle_mem_budget: int = mem_limit_to_bytes(os.getenv(
+            "POOL_IDLE_MEM_BUDGET", DEFAULT_POOL_IDLE_MEM_BUDGET)),
+        refill_parallelism: int = int(os.getenv(
+            "POOL_REFILL_PARALLELISM", DEFAULT_POOL_REFILL_PARALLELISM)),
+        refill_interval: float = float(os.getenv(
+            "POOL_REFILL_INTERVAL", DEFAULT_POOL_REFILL_INTERVAL))
+    ):
+        self._spawn = spawn
+        self._remove = remove
+        self._alive = alive
+        self._container_mem: int = max(1, container_mem)
+        self._target_size: int = target_size
+        self._idle_mem_budget: int = idle_mem_budget
+        self._refill_parallelism: int = max(1, refill_parallelism)
+        self._refill_interval: float = refill_interval
+
+        self._idle: list[PooledContainer] = []
+        self._spawning: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._spawn_failures: int = 0
+        self._dead: int = 0
+
+        self._refill_needed: asyncio.Event = None
+        self._refill_task: asyncio.Task = None
+        # Spawns in flight. They are never cancelled: a spawn cancelled
+        # mid docker call would still create its container, unowned.
+        self._spawns: set[asyncio.Task] = set()
+        # Removals of dead idle containers in flight
+        self._removals: set[asyncio.Task] = set()
+
+    # PUBLIC
+
+    async def start(self):
+        """Fills the pool and keeps it topped up in the background"""
+        if self._refill_task is not None or self.get_max_size() == 0:
+            return
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        """
+        Stops refilling and removes every idle container, including the
+        ones still being spawned once they are up.
+        """
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+        await asyncio.gather(*self._spawns, *self._removals,
+                             return_exceptions=True)
+
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*[self._remove(pc) for pc in idle],
+                             return_exceptions=True)
+
+    def acquire(self) -> PooledContainer | None:
+        """
+        Takes an idle container out of the pool.
+
+        @return the PooledContainer, or None when the pool is empty. The
+        caller owns the container from here on.
+        """
+        while len(self._idle) > 0:
+            # Oldest first, so nothing sits idle forever
+            pooled = self._idle.pop(0)
+            if self._alive is not None and not self._alive(pooled):
+                self._discard(pooled)
+                continue
+            self._hits += 1
+            self._request_refill()
+            return pooled
+
+        self._misses += 1
+        self._request_refill()
+        return None
+
+    def evict(self, container_id: str):
+        """
+        Drops an idle container that exited or was removed, and spawns a
+        replacement for it
+        """
+        for pooled in [pc for pc in self._idle
+                       if pc.container.id == container_id]:
+            self._idle.remove(pooled)
+            self._discard(pooled)
+        self._request_refill()
+
+    def get_max_size(self) -> int:
+        """Target size, clamped to what the idle memory budget allows"""
+        return max(0, min(self._target_size,
+                          self._idle_mem_budget // self._container_mem))
+
+    def get_stats(self) -> dict:
+        """Counters used to size the pool"""
+        lookups = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else 0.0,
+            "idle": len(self._idle),
+            "spawning": self._spawning,
+            "spawn_failures": self._spawn_failures,
+            "dead": self._dead,
+            "target_size": self._target_size,
+            "max_size": self.get_max_size(),
+            "idle_mem_bytes": len(self._idle) * self._container_mem,
+            "idle_mem_budget": self._idle_mem_budget,
+        }
+
+    # PRIVATE
+
+    def _discard(self, pooled: PooledContainer):
+        """Removes a dead idle container in the background"""
+        self._dead += 1
+        task = asyncio.create_task(self._remove(pooled))
+        self._removals.add(task)
+        task.add_done_callback(self._removals.discard)
+
+    def _request_refill(self):
+        if self._refill_needed is not None:
+            self._refill_needed.set()
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._refill_needed.wait(),
+                                       self._refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+            await self._refill()
+
+    async def _refill(self):
+        """Spawns containers until the pool reaches its max size"""
+        missing = self.get_max_size() - len(self._idle) - self._spawning
+        if missing <= 0:
+            return
+
+        semaphore = asyncio.Semaphore(self._refill_parallelism)
+
+        async def spawn_one():
+            async with semaphore:
+                try:
+                    pooled = await self._spawn()
+                except Exception as e:
+                    print(f"[PoolController._refill] spawn failed: {e}")
+                    pooled = None
+                finally:
+                    self._spawning -= 1
+
+            if pooled is None:
+                self._spawn_failures += 1
+                return
+            self._idle.append(pooled)
+
+        self._spawning += missing
+        spawns = [asyncio.create_task(spawn_one()) for _ in range(missing)]
+        self._spawns.update(spawns)
+        for spawn in spawns:
+            spawn.add_done_callback(self._spawns.discard)
+        # Stopping the refill loop leaves the spawns for `stop` to drain
+        await asyncio.shield(asyncio.gather(*spawns))
@@ -1,9 +1,23 @@
+import asyncio
 from enum import IntEnum
 from dataclasses import dataclass
+from collections import deque
+from dotenv import load_dotenv
+import os
 import socket
+import threading
+
+from roker.controllers.db_controller import DB_query_status
+
+load_dotenv()
+
+DEFAULT_PORT_RANGE_START = 20000
+DEFAULT_PORT_RANGE_END = 29999
 
 
 class P_SC(IntEnum):
+    NOT_LEASED = -3
+    PORT_OUT_OF_RANGE = -2
     FAILED_TO_FIND_PORT = -1
     OK = 1
 
@@ -12,27 +26,204 @@ class P_SC(IntEnum):
 class PortAssignment:
     """
     status: status code
-    port:   port number
-    socket: socket object
+    port:   port number, -1 if no port was reserved
 
-    WARNING Close socket before assigning to docker container
+    The port stays reserved until it is handed back with
+    `PortController.release` or `PortController.release_container`.
     """
     status: P_SC
-    port: int
-    socket: socket.socket
+    port: int = -1
 
 
 class PortController:
-    def __init__(self):
-        pass
+    """
+    Hands out host ports from [range_start, range_end].
+
+    Free ports are kept in a FIFO free-list and leased ports in a bitmap,
+    so reserving and releasing are O(1). Released ports go to the back of
+    the free-list, which keeps recently used ports (possibly still in
+    TIME_WAIT) from being handed straight back out.
+
+    When given a connected DB_Controller, leases are persisted to the
+    `port_leases` table so a restarted API knows which ports are in use.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        range_start: int = int(os.getenv(
+            "PORT_RANGE_START", DEFAULT_PORT_RANGE_START)),
+        range_end: int = int(os.getenv(
+            "PORT_RANGE_END", DEFAULT_PORT_RANGE_END))
+    ):
+        self._db = db
+        self._range_start: int = range_start
+        self._range_end: int = range_end
+
+        self._lock: threading.Lock = threading.Lock()
+        self._free: deque[int] = deque(range(range_start, range_end + 1))
+        # 1 if leased, indexed by port - range_start
+        self._leased: bytearray = bytearray(range_end - range_start + 1)
+        # port -> container id, only once the container exists
+        self._owners: dict[int, str] = {}
+        # container id -> port, the reverse of _owners
+        self._ports: dict[str, int] = {}
+
+        self._load_leases()
+
+    # PUBLIC
 
     async def get_available_TCP_port(self) -> PortAssignment:
-        """Reserves a socket"""
-        s = socket.socket()
-        s.bind(('', 0))
-        s.listen(1)
-        return PortAssignment(
-            status=P_SC.OK,
-            port=s.getsockname()[1],
-            socket=s
-        )
+        """
+        Reserves a port. `reserve` probes ports and writes the lease to
+        sqlite, so it is run off the event loop.
+        """
+        return await asyncio.to_thread(self.reserve)
+
+    def reserve(self) -> PortAssignment:
+        """
+        Reserves the next free port in the range.
+
+        Ports that something outside of roker is already listening on are
+        skipped and put back at the end of the free-list. Candidates are
+        probed outside the lock, so a busy range never holds up `release`,
+        `bind` or `get_port`.
+
+        @return PortAssignment with status
+            P_SC.OK:                  reserved `port`
+            P_SC.FAILED_TO_FIND_PORT: every port in the range is taken
+        """
+        with self._lock:
+            candidates = len(self._free)
+
+        port = None
+        for _ in range(candidates):
+            with self._lock:
+                if len(self._free) == 0:
+                    break
+                # Off the free-list while probed, so no one else gets it
+                candidate = self._free.popleft()
+
+            bindable = self._is_bindable(candidate)
+            with self._lock:
+                if bindable:
+                    self._leased[candidate - self._range_start] = 1
+                    port = candidate
+                    break
+                self._free.append(candidate)
+
+        if port is None:
+            return PortAssignment(status=P_SC.FAILED_TO_FIND_PORT)
+
+        if self._db is not None:
+            self._db.add_port_lease(port)
+
+        return PortAssignment(status=P_SC.OK, port=port)
+
+    def bind(self, port: int, container_id: str) -> P_SC:
+        """Records which container a reserved port was published for"""
+        with self._lock:
+            if not self._in_range(port):
+                return P_SC.PORT_OUT_OF_RANGE
+            if not self._leased[port - self._range_start]:
+                return P_SC.NOT_LEASED
+            self._owners[port] = container_id
+            self._ports[container_id] = port
+
+        if self._db is not None:
+            self._db.add_port_lease(port, container_id)
+        return P_SC.OK
+
+    def release(self, port: int) -> P_SC:
+        """Hands a reserved port back to the free-list"""
+        with self._lock:
+            if not self._in_range(port):
+                return P_SC.PORT_OUT_OF_RANGE
+            if not self._leased[port - self._range_start]:
+                return P_SC.NOT_LEASED
+            self._leased[port - self._range_start] = 0
+            container_id = self._owners.pop(port, None)
+            if self._ports.get(container_id) == port:
+                del self._ports[container_id]
+            self._free.append(port)
+
+        if self._db is not None:
+            self._db.remove_port_lease(port)
+        return P_SC.OK
+
+    def release_container(self, container_id: str) -> P_SC:
+        """Releases the port bound to `container_id`"""
+        port = self.get_port(container_id)
+        if port is None:
+            return P_SC.NOT_LEASED
+        return self.release(port)
+
+    def get_port(self, container_id: str) -> int | None:
+        """Returns the port bound to `container_id`, if any"""
+        with self._lock:
+            return self._ports.get(container_id)
+
+    def reconcile(self, container_ids: set[str]) -> list[int]:
+        """
+        Releases the ports bound to containers that are not in
+        `container_ids`, e.g. containers removed while roker was down.
+
+        @return the ports released
+        """
+        with self._lock:
+            gone = [port for (port, container_id) in self._owners.items()
+                    if container_id not in container_ids]
+        for port in gone:
+            self.release(port)
+        return gone
+
+    def get_leases(self) -> dict[int, str | None]:
+        """Returns every leased port and the container it is bound to"""
+        with self._lock:
+            return {
+                self._range_start + i: self._owners.get(
+                    self._range_start + i)
+                for (i, leased) in enumerate(self._leased) if leased
+            }
+
+    # PRIVATE
+
+    def _in_range(self, port: int) -> bool:
+        return self._range_start <= port <= self._range_end
+
+    def _is_bindable(self, port: int) -> bool:
+        """Checks nothing outside of roker is listening on `port`"""
+        with socket.socket() as s:
+            try:
+                s.bind(('', port))
+            except OSError:
+                return False
+        return True
+
+    def _load_leases(self):
+        """
+        Restores leases persisted by a previous run.
+
+        Leases without a container belong to launches that never finished,
+        so those ports are reclaimed.
+        """
+        if self._db is None:
+            return
+
+        (status, leases) = self._db.get_port_leases()
+        if status != DB_query_status.SUCCESS:
+            print(f"[PortController._load_leases] failed: {leases}")
+            return
+
+        restored: set[int] = set()
+        for (port, container_id) in leases:
+            if container_id is None or not self._in_range(port):
+                self._db.remove_port_lease(port)
+                continue
+            self._leased[port - self._range_start] = 1
+            self._owners[port] = container_id
+            self._ports[container_id] = port
+            restored.add(port)
+
+        if len(restored) > 0:
+            self._free = deque(p for p in self._free if p not in restored)
@@ -0,0 +1,235 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import IntEnum
+from time import monotonic
+import httpx
+from dotenv import load_dotenv
+
+from roker.controllers.db_controller import DB_query_status
+from roker.controllers.health_controller import LatencyHistogram
+from roker.controllers.registry_controller import AgentRegistry
+
+load_dotenv()
+
+DEFAULT_PROXY_HOST = "127.0.0.1"
+DEFAULT_PROXY_CONNECT_TIMEOUT = 2.0
+DEFAULT_PROXY_READ_TIMEOUT = 30.0
+DEFAULT_PROXY_CONNECTIONS_PER_AGENT = 8
+DEFAULT_PROXY_MAX_AGENTS = 1024
+DEFAULT_PROXY_KEEPALIVE_EXPIRY = 60.0
+
+# Headers that only concern one hop and are never forwarded
+HOP_BY_HOP_HEADERS = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+    "content-length",
+))
+
+
+class PROXY_SC(IntEnum):
+    NOT_FOUND = -3
+    TIMEOUT = -2
+    REQ_FAIL = -1
+    OK = 0
+
+
+@dataclass
+class _Upstream:
+    port: int
+    client: httpx.AsyncClient
+    in_flight: int = 0
+
+
+def forward_headers(headers) -> dict:
+    """`headers` without the hop-by-hop ones"""
+    return {key: value for (key, value) in headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS}
+
+
+class ProxyController:
+    """
+    Forwards requests to agents over kept alive connections.
+
+    Every agent gets its own pooled HTTP client, created on its first
+    request, so a connection to an agent is reused for as long as it stays
+    alive instead of paying a handshake per call. At most `max_agents`
+    clients are kept; the least recently used idle one is closed past
+    that. Bodies are streamed in both directions.
+
+    Upstream latency (until the response headers arrive) is recorded per
+    agent.
+    """
+
+    def __init__(
+        self,
+        registry: AgentRegistry,
+        host: str = os.getenv("PROXY_HOST", DEFAULT_PROXY_HOST),
+        connect_timeout: float = float(os.getenv(
+            "PROXY_CONNECT_TIMEOUT", DEFAULT_PROXY_CONNECT_TIMEOUT)),
+        read_timeout: float = float(os.getenv(
+            "PROXY_READ_TIMEOUT", DEFAULT_PROXY_READ_TIMEOUT)),
+        connections_per_agent: int = int(os.getenv(
+            "PROXY_CONNECTIONS_PER_AGENT",
+            DEFAULT_PROXY_CONNECTIONS_PER_AGENT)),
+        max_agents: int = int(os.getenv(
+            "PROXY_MAX_AGENTS", DEFAULT_PROXY_MAX_AGENTS)),
+        keepalive_expiry: float = float(os.getenv(
+            "PROXY_KEEPALIVE_EXPIRY", DEFAULT_PROXY_KEEPALIVE_EXPIRY))
+    ):
+        self._registry: AgentRegistry = registry
+        self._host: str = host
+        self._timeout: httpx.Timeout = httpx.Timeout(
+            read_timeout, connect=connect_timeout)
+        self._limits: httpx.Limits = httpx.Limits(
+            max_connections=connections_per_agent,
+            max_keepalive_connections=connections_per_agent,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._max_agents: int = max_agents
+
+        # agent id -> its client, least recently used first
+        self._upstreams: OrderedDict[int, _Upstream] = OrderedDict()
+        self._latency: dict[int, LatencyHistogram] = {}
+        self._closing: set[asyncio.Task] = set()
+
+        self._requests: int = 0
+        self._timeouts: int = 0
+        self._failures: int = 0
+        self._evicted: int = 0
+
+    # PUBLIC
+
+    async def open(
+            self,
+            agent_id: int | str,
+            method: str,
+            path: str,
+            query: str = "",
+            headers: dict | None = None,
+            body=None) -> (PROXY_SC, httpx.Response | None):
+        """
+        Sends a request to an agent and returns its response as soon as
+        the headers arrive, with the body left to stream. `body` may be
+        bytes or an async iterator of bytes.
+
+        The response must be closed with `close` once read.
+        """
+        (status, agent) = self._registry.get_agent_data(agent_id)
+        if status != DB_query_status.SUCCESS:
+            return (PROXY_SC.NOT_FOUND, None)
+
+        headers = headers or {}
+        forwarded = forward_headers(headers)
+        # A streamed body of known length need not be sent chunked
+        length = headers.get("content-length")
+        if body is not None and length is not None:
+            forwarded["Content-Length"] = length
+
+        url = httpx.URL(path="/" + path.lstrip("/"))
+        if query:
+            url = url.copy_with(query=query.encode("ascii"))
+
+        upstream = self._upstream(agent.id, agent.port_number)
+        request = upstream.client.build_request(
+            method,
+            url,
+            headers=forwarded,
+            content=body
+        )
+
+        self._requests += 1
+        upstream.in_flight += 1
+        start = monotonic()
+        try:
+            response = await upstream.client.send(request, stream=True)
+        except httpx.TimeoutException:
+            upstream.in_flight -= 1
+            self._timeouts += 1
+            return (PROXY_SC.TIMEOUT, None)
+        except httpx.HTTPError as e:
+            upstream.in_flight -= 1
+            self._failures += 1
+            print(f"[ProxyController.open] agent {agent.id}: {e!r}")
+            return (PROXY_SC.REQ_FAIL, None)
+
+        self._latency.setdefault(agent.id, LatencyHistogram()).observe(
+            monotonic() - start)
+        response.extensions["roker_upstream"] = upstream
+        return (PROXY_SC.OK, response)
+
+    async def close(self, response: httpx.Response):
+        """Closes a response from `open`, handing its connection back"""
+        await response.aclose()
+        upstream = response.extensions.pop("roker_upstream", None)
+        if upstream is not None:
+            upstream.in_flight -= 1
+
+    async def forget(self, agent_id: int):
+        """Closes an agent's connections, e.g. once it has been killed"""
+        upstream = self._upstreams.pop(agent_id, None)
+        self._latency.pop(agent_id, None)
+        if upstream is not None:
+            await upstream.client.aclose()
+
+    def get_latency(self, agent_id: int) -> dict | None:
+        """Histogram of an agent's upstream latency"""
+        histogram = self._latency.get(agent_id)
+        return None if histogram is None else histogram.to_dict()
+
+    def get_stats(self) -> dict:
+        return {
+            "agents": len(self._upstreams),
+            "in_flight": sum(upstream.in_flight
+                             for upstream in self._upstreams.values()),
+            "requests": self._requests,
+            "timeouts": self._timeouts,
+            "failures": self._failures,
+            "evicted": self._evicted,
+        }
+
+    async def aclose(self):
+        """Closes every agent's connections"""
+        upstreams = list(self._upstreams.values())
+        self._upstreams.clear()
+        await asyncio.gather(
+            *[upstream.client.aclose() for upstream in upstreams],
+            *self._closing, return_exceptions=True)
+
+    # PRIVATE
+
+    def _upstream(self, agent_id: int, port: int) -> _Upstream:
+        upstream = self._upstreams.get(agent_id)
+        if upstream is not None and upstream.port == port:
+            self._upstreams.move_to_end(agent_id)
+            return upstream
+        if upstream is not None:
+            # The agent moved; its old connections lead nowhere
+            self._close_later(self._upstreams.pop(agent_id))
+
+        upstream = _Upstream(port=port, client=httpx.AsyncClient(
+            base_url=f"http://{self._host}:{port}",
+            timeout=self._timeout,
+            limits=self._limits
+        ))
+        self._upstreams[agent_id] = upstream
+        self._evict()
+        return upstream
+
+    def _evict(self):
+        """Closes least recently used idle clients past `max_agents`"""
+        excess = len(self._upstreams) - self._max_agents
+        for agent_id in list(self._upstreams.keys()):
+            if excess <= 0:
+                return
+            if self._upstreams[agent_id].in_flight > 0:
+                continue
+            self._close_later(self._upstreams.pop(agent_id))
+            self._evicted += 1
+            excess -= 1
+
+    def _close_later(self, upstream: _Upstream):
+        task = asyncio.create_task(upstream.client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
@@ -0,0 +1,223 @@
+import dataclasses
+import threading
+
+from roker.controllers.db_controller import (
+    DB_Controller, DB_new_agent_status, DB_query_status, Agent)
+
+
+def parse_agent_id(agent_id: str) -> int | str:
+    """
+    Agent ids arrive as strings from paths and query params. All digits is
+    a row id, anything else a container id.
+    """
+    return int(agent_id) if agent_id.isdigit() else agent_id
+
+
+class AgentRegistry:
+    """
+    In-process cache of agents, keyed by row id, container id and port.
+
+    The registry sits in front of DB_Controller and mirrors its agent
+    methods and return structures. Writes go to the database first and are
+    applied to the cache once they succeed (or are queued, with
+    write-behind), so the cache never holds data the database rejected.
+    Reads are served from the cache and only fall through to the database
+    on a miss.
+
+    Agents handed out are copies; mutating them does not touch the cache.
+    """
+
+    def __init__(self, db: DB_Controller):
+        self._db: DB_Controller = db
+        self._lock: threading.RLock = threading.RLock()
+
+        self._by_id: dict[int, Agent] = {}
+        self._by_container: dict[str, Agent] = {}
+        self._by_port: dict[int, Agent] = {}
+
+        self._hits: int = 0
+        self._misses: int = 0
+
+    # PUBLIC
+
+    def load(self) -> DB_query_status:
+        """Warms the cache with every agent in the database"""
+        (status, agents) = self._db.list_agents()
+        if status != DB_query_status.SUCCESS:
+            return status
+
+        with self._lock:
+            for agent in agents:
+                self._put(agent)
+        return status
+
+    def add_new_agent(self, new_agent: Agent) -> (
+            DB_new_agent_status, str | int | None):
+        """
+        Write-through `DB_Controller.add_new_agent`.
+
+        The database always inserts agents inactive. An agent added with
+        `active` set is marked active right after its insert.
+        """
+        row = dataclasses.replace(new_agent, active=False)
+        res = self._db.add_new_agent(row)
+
+        if res[0] == DB_new_agent_status.SUBMITTED:
+            with self._lock:
+                self._put(dataclasses.replace(row, id=res[1]))
+            if new_agent.active:
+                self.update_agent_data(res[1], {"active": True})
+        return res
+
+    def add_new_agents(self, new_agents: list[Agent]) -> (
+            DB_new_agent_status, list[int] | str | None):
+        """
+        Write-through `DB_Controller.add_new_agents`. Agents added with
+        `active` set are marked active in one transaction after the insert.
+        """
+        rows = [dataclasses.replace(agent, active=False)
+                for agent in new_agents]
+        res = self._db.add_new_agents(rows)
+
+        if res[0] == DB_new_agent_status.SUBMITTED:
+            with self._lock:
+                for (row, id) in zip(rows, res[1]):
+                    self._put(dataclasses.replace(row, id=id))
+            active = [(id, {"active": True})
+                      for (agent, id) in zip(new_agents, res[1])
+                      if agent.active]
+            if len(active) > 0:
+                self.update_agents_data(active)
+        return res
+
+    def get_agent_data(self, agent_id: int | str) -> (
+            DB_query_status, Agent | str | None):
+        """
+        `DB_Controller.get_agent_data`, served from the cache when possible.
+        """
+        agent = self._lookup(agent_id)
+        if agent is not None:
+            return (DB_query_status.SUCCESS, agent)
+
+        res = self._db.get_agent_data(agent_id)
+        if res[0] == DB_query_status.SUCCESS:
+            with self._lock:
+                self._put(res[1])
+            return (res[0], dataclasses.replace(res[1]))
+        return res
+
+    def get_by_port(self, port: int) -> Agent | None:
+        """Returns the agent published on `port`, if any"""
+        with self._lock:
+            agent = self._by_port.get(port)
+            if agent is not None:
+                self._hits += 1
+                return dataclasses.replace(agent)
+            self._misses += 1
+
+        (status, agents) = self._db.list_agents(
+            port_min=port, port_max=port, limit=1)
+        if status != DB_query_status.SUCCESS:
+            return None
+
+        for agent in agents:
+            with self._lock:
+                self._put(agent)
+            return dataclasses.replace(agent)
+        return None
+
+    def update_agent_data(self, agent_id: int | str, data: dict) -> (
+            DB_query_status, None | str):
+        """Write-through `DB_Controller.update_agent_data`"""
+        res = self._db.update_agent_data(agent_id, data)
+        self._apply_update(res, [(agent_id, data)])
+        return res
+
+    def update_agents_data(self, updates: list[tuple[int | str, dict]]) -> (
+            DB_query_status, int | str | None):
+        """Write-through `DB_Controller.update_agents_data`"""
+        res = self._db.update_agents_data(updates)
+        self._apply_update(res, updates)
+        return res
+
+    def invalidate(self, agent_id: int | str):
+        """Drops an agent from the cache, e.g. once it has been killed"""
+        with self._lock:
+            agent = self._find(agent_id)
+            if agent is None:
+                return
+            self._by_id.pop(agent.id, None)
+            self._by_container.pop(agent.container_id, None)
+            if self._by_port.get(agent.port_number) is agent:
+                del self._by_port[agent.port_number]
+
+    def all(self) -> list[Agent]:
+        """Every cached agent, in id order"""
+        with self._lock:
+            return [dataclasses.replace(self._by_id[id])
+                    for id in sorted(self._by_id.keys())]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "agents": len(self._by_id),
+            }
+
+    # PRIVATE
+
+    def _find(self, agent_id: int | str) -> Agent | None:
+        """Cache lookup without touching the hit/miss counters"""
+        match agent_id:
+            case str():
+                return self._by_container.get(agent_id)
+            case int():
+                return self._by_id.get(agent_id)
+        return None
+
+    def _lookup(self, agent_id: int | str) -> Agent | None:
+        with self._lock:
+            agent = self._find(agent_id)
+            if agent is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return dataclasses.replace(agent)
+
+    def _put(self, agent: Agent):
+        """Caches `agent`, replacing any stale entry. Caller holds the lock"""
+        old = self._by_id.get(agent.id)
+        if old is not None:
+            self._by_container.pop(old.container_id, None)
+            if self._by_port.get(old.port_number) is old:
+                del self._by_port[old.port_number]
+
+        self._by_id[agent.id] = agent
+        self._by_container[agent.container_id] = agent
+        self._by_port[agent.port_number] = agent
+
+    def _apply_update(self, res: tuple, updates: list[tuple[int | str, dict]]):
+        """
+        Applies updates the database accepted to the cached agents. Queued
+        (write-behind) updates are applied right away, and the agents are
+        dropped from the cache again if the write later fails.
+        """
+        if res[0] not in (DB_query_status.SUCCESS, DB_query_status.QUEUED):
+            return
+
+        with self._lock:
+            for (agent_id, data) in updates:
+                agent = self._find(agent_id)
+                if agent is None:
+                    continue
+                self._put(dataclasses.replace(agent, **data))
+
+        if res[0] == DB_query_status.QUEUED:
+            def on_written(future):
+                if future.result()[0] != DB_query_status.SUCCESS:
+                    for (agent_id, _) in updates:
+                        self.invalidate(agent_id)
+            res[1].add_done_callback(on_written)
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_SNAPSHOT_TTL = 1.0
+DEFAULT_SNAPSHOT_HISTORY = 64
+
+
+@dataclass
+class Snapshot:
+    """
+    version: increases by one every time the data changes
+    etag:    strong ETag of this version
+    data:    key -> entry. Treat as read only, it is shared between callers
+    """
+    version: int
+    etag: str
+    data: dict
+
+
+@dataclass
+class SnapshotDelta:
+    """
+    Changes between a client's version and `version`.
+
+    complete: False when the client's version was too old (or unknown) to
+              diff against. `changed` then holds every entry and the client
+              should replace its copy instead of patching it.
+    """
+    version: int
+    etag: str
+    complete: bool
+    changed: dict
+    removed: list
+
+
+class SnapshotController:
+    """
+    Caches a snapshot of some fleet wide view for polling clients.
+
+    `source` is an async callable returning the current view as a dict.
+    A snapshot is served from cache for `ttl` seconds. After that, the
+    first caller refreshes it, and every caller arriving during the
+    refresh waits on that same refresh instead of starting another.
+
+    Versions only advance when the data actually changes, so an ETag
+    stays valid for as long as the fleet does. The changed keys of the
+    last `history` versions are kept so clients can fetch a delta.
+    """
+
+    def __init__(
+        self,
+        source,
+        ttl: float = float(os.getenv("SNAPSHOT_TTL", DEFAULT_SNAPSHOT_TTL)),
+        history: int = int(os.getenv(
+            "SNAPSHOT_HISTORY", DEFAULT_SNAPSHOT_HISTORY))
+    ):
+        self._source = source
+        self._ttl: float = ttl
+
+        # Versions restart with roker; keep old ETags from ever matching
+        self._epoch: str = uuid.uuid4().hex[:8]
+        self._snapshot: Snapshot = None
+        self._taken: float = 0.0
+        self._refresh: asyncio.Future = None
+        # (version, keys changed, keys removed) for recent versions
+        self._history: deque[tuple[int, set, set]] = deque(maxlen=history)
+
+        self._hits: int = 0
+        self._refreshes: int = 0
+        self._coalesced: int = 0
+
+    # PUBLIC
+
+    async def get(self) -> Snapshot:
+        """Returns the current snapshot, refreshing it if it is stale"""
+        if (self._snapshot is not None
+                and monotonic() - self._taken < self._ttl):
+            self._hits += 1
+            return self._snapshot
+
+        if self._refresh is not None:
+            self._coalesced += 1
+            return await asyncio.shield(self._refresh)
+
+        self._refresh = asyncio.get_running_loop().create_future()
+        refresh = self._refresh
+        try:
+            snapshot = await self._take()
+        except BaseException as e:
+            refresh.set_exception(e)
+            # Nobody else may be waiting; keep asyncio from complaining
+            refresh.exception()
+            raise
+        finally:
+            self._refresh = None
+
+        refresh.set_result(snapshot)
+        return snapshot
+
+    async def delta(self, since: int) -> SnapshotDelta:
+        """Returns what changed after version `since`"""
+        snapshot = await self.get()
+
+        oldest = self._history[0][0] if len(self._history) else None
+        if since == snapshot.version:
+            return SnapshotDelta(snapshot.version, snapshot.etag, True, {}, [])
+        if oldest is None or since < oldest - 1 or since > snapshot.version:
+            return SnapshotDelta(snapshot.version, snapshot.etag, False,
+                                 dict(snapshot.data), [])
+
+        changed: set = set()
+        removed: set = set()
+        for (version, c, r) in self._history:
+            if version > since:
+                changed |= c
+                removed |= r
+        # A key removed and added back since is a change, and vice versa
+        removed -= snapshot.data.keys()
+        changed &= snapshot.data.keys()
+
+        return SnapshotDelta(
+            version=snapshot.version,
+            etag=snapshot.etag,
+            complete=True,
+            changed={key: snapshot.data[key] for key in changed},
+            removed=sorted(removed)
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            "version": self._snapshot.version if self._snapshot else 0,
+            "hits": self._hits,
+            "refreshes": self._refreshes,
+            "coalesced": self._coalesced,
+        }
+
+    # PRIVATE
+
+    async def _take(self) -> Snapshot:
+        data = await self._source()
+        self._refreshes += 1
+        self._taken = monotonic()
+
+        old = self._snapshot
+        if old is not None and old.data == data:
+            return old
+
+        version = 1 if old is None else old.version + 1
+        if old is not None:
+            changed = {key for (key, entry) in data.items()
+                       if old.data.get(key) != entry}
+            removed = old.data.keys() - data.keys()
+            self._history.append((version, changed, removed))
+
+        self._snapshot = Snapshot(
+            version=version,
+            etag=f'"{self._epoch}-{version}"',
+            data=data
+        )
+        return self._snapshot
@@ -0,0 +1,417 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from operator import attrgetter
+from dotenv import load_dotenv
+import docker
+
+from roker.controllers.db_controller import DB_query_status
+from roker.controllers.event_controller import ContainerState
+
+load_dotenv()
+
+DEFAULT_STATS_RING_SIZE = 300
+DEFAULT_STATS_MAX_STREAMS = 1024
+DEFAULT_STATS_FLUSH_INTERVAL = 1.0
+DEFAULT_STATS_RETENTION_1S = 3600
+DEFAULT_STATS_RETENTION_1M = 86400
+DEFAULT_STATS_RETENTION_1H = 2592000
+
+# Seconds between deleting buckets past their retention
+_PRUNE_INTERVAL = 60
+
+# Rollup bucket widths in seconds
+RESOLUTIONS = (1, 60, 3600)
+
+
+@dataclass
+class StatSample:
+    """
+    One reading of a container's docker stats stream.
+
+    ts:          unix time the sample was taken
+    cpu_percent: share of one CPU used since the previous sample, times the
+                 number of online CPUs (as `docker stats` reports it)
+    mem_bytes:   memory in use, excluding the page cache
+    mem_limit:   memory limit of the container
+    net_*:       cumulative bytes over every network interface
+    blk_*:       cumulative bytes of block I/O
+    """
+    ts: float
+    cpu_percent: float
+    mem_bytes: int
+    mem_limit: int
+    net_rx: int
+    net_tx: int
+    blk_read: int
+    blk_write: int
+
+
+def compute_sample(raw: dict, ts: float) -> StatSample | None:
+    """
+    Reduces one decoded docker stats document to a StatSample, computing
+    CPU% the same way the docker CLI does.
+
+    @return the sample, or None for a container that is not running
+    """
+    cpu = raw.get("cpu_stats") or {}
+    precpu = raw.get("precpu_stats") or {}
+    mem = raw.get("memory_stats") or {}
+    if "system_cpu_usage" not in cpu:
+        return None
+
+    cpu_delta = (cpu.get("cpu_usage", {}).get("total_usage", 0)
+                 - precpu.get("cpu_usage", {}).get("total_usage", 0))
+    system_delta = (cpu.get("system_cpu_usage", 0)
+                    - precpu.get("system_cpu_usage", 0))
+    online_cpus = cpu.get("online_cpus") or len(
+        cpu.get("cpu_usage", {}).get("percpu_usage") or [None])
+
+    cpu_percent = 0.0
+    if cpu_delta > 0 and system_delta > 0:
+        cpu_percent = cpu_delta / system_delta * online_cpus * 100.0
+
+    # cgroup v1 reports the page cache as "cache", v2 as "inactive_file"
+    details = mem.get("stats") or {}
+    cache = details.get("cache", details.get("inactive_file", 0))
+    mem_bytes = max(0, mem.get("usage", 0) - cache)
+
+    net_rx = net_tx = 0
+    for network in (raw.get("networks") or {}).values():
+        net_rx += network.get("rx_bytes", 0)
+        net_tx += network.get("tx_bytes", 0)
+
+    blk_read = blk_write = 0
+    blkio = raw.get("blkio_stats") or {}
+    for entry in blkio.get("io_service_bytes_recursive") or []:
+        match entry.get("op", "").lower():
+            case "read":
+                blk_read += entry.get("value", 0)
+            case "write":
+                blk_write += entry.get("value", 0)
+
+    return StatSample(
+        ts=ts,
+        cpu_percent=cpu_percent,
+        mem_bytes=mem_bytes,
+        mem_limit=mem.get("limit", 0),
+        net_rx=net_rx,
+        net_tx=net_tx,
+        blk_read=blk_read,
+        blk_write=blk_write
+    )
+
+
+class _Rollup:
+    """Running aggregate of the samples falling in one bucket"""
+
+    def __init__(self, resolution: int, bucket: int):
+        self.resolution: int = resolution
+        self.bucket: int = bucket
+        self.samples: int = 0
+        self.cpu_sum: float = 0.0
+        self.cpu_max: float = 0.0
+        self.mem_sum: int = 0
+        self.mem_max: int = 0
+        self.last: StatSample = None
+
+    def add(self, sample: StatSample):
+        self.samples += 1
+        self.cpu_sum += sample.cpu_percent
+        self.cpu_max = max(self.cpu_max, sample.cpu_percent)
+        self.mem_sum += sample.mem_bytes
+        self.mem_max = max(self.mem_max, sample.mem_bytes)
+        self.last = sample
+
+    def row(self, container_id: str) -> tuple:
+        """The rollup as an agent_stats row"""
+        return (
+            container_id, self.resolution, self.bucket, self.samples,
+            self.cpu_sum / self.samples, self.cpu_max,
+            self.mem_sum // self.samples, self.mem_max,
+            self.last.net_rx, self.last.net_tx,
+            self.last.blk_read, self.last.blk_write
+        )
+
+
+class StatsController:
+    """
+    Collects resource usage of every running roker container.
+
+    Each container's docker stats stream is read on a thread of its own
+    for as long as the container runs, at most `max_streams` at once.
+    Containers started past that are refused: they are logged, counted in
+    `get_stats` and sampled once another container's stream ends. The
+    last `ring_size` samples per container are kept in memory
+    for live queries, and samples are rolled up into 1 second, 1 minute
+    and 1 hour buckets that a flusher thread writes to the agent_stats
+    table every `flush_interval` seconds, pruning buckets older than
+    their retention.
+
+    Memory is bounded: one ring buffer and one open bucket per resolution
+    per running container, plus whatever closed buckets are waiting for
+    the next flush.
+
+    Containers are watched and unwatched by `on_state`, meant to be an
+    EventController listener.
+    """
+
+    def __init__(
+        self,
+        client: docker.DockerClient,
+        db=None,
+        ring_size: int = int(os.getenv(
+            "STATS_RING_SIZE", DEFAULT_STATS_RING_SIZE)),
+        max_streams: int = int(os.getenv(
+            "STATS_MAX_STREAMS", DEFAULT_STATS_MAX_STREAMS)),
+        flush_interval: float = float(os.getenv(
+            "STATS_FLUSH_INTERVAL", DEFAULT_STATS_FLUSH_INTERVAL)),
+        retention: dict[int, int] = {
+            1: int(os.getenv(
+                "STATS_RETENTION_1S", DEFAULT_STATS_RETENTION_1S)),
+            60: int(os.getenv(
+                "STATS_RETENTION_1M", DEFAULT_STATS_RETENTION_1M)),
+            3600: int(os.getenv(
+                "STATS_RETENTION_1H", DEFAULT_STATS_RETENTION_1H)),
+        }
+    ):
+        self._client: docker.DockerClient = client
+        self._db = db
+        self._ring_size: int = ring_size
+        self._flush_interval: float = flush_interval
+        self._retention: dict[int, int] = retention
+
+        self._max_streams: int = max(1, max_streams)
+        self._lock: threading.Lock = threading.Lock()
+        # container id -> most recent samples, oldest first
+        self._rings: dict[str, deque[StatSample]] = {}
+        # container id -> open bucket per resolution
+        self._rollups: dict[str, dict[int, _Rollup]] = {}
+        # container id -> token of the reader whose stream should keep
+        # being read. A restart's die and start can overlap the old
+        # reader's exit; the token keeps it from stopping the new one.
+        self._watching: dict[str, int] = {}
+        self._tokens = itertools.count(1)
+        # Containers refused a stream, in the order they were refused
+        self._refused: dict[str, None] = {}
+        self._refusals: int = 0
+        # Closed buckets waiting to be written
+        self._pending: list[tuple] = []
+
+        self._flusher: threading.Thread = None
+        self._stopping: threading.Event = threading.Event()
+        self._samples: int = 0
+        self._dropped_rows: int = 0
+
+    # PUBLIC
+
+    def start(self):
+        """Starts writing rollups to the database in the background"""
+        if self._flusher is not None or self._db is None:
+            return
+        self._stopping.clear()
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="roker-stats-flush", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """
+        Stops reading every stats stream and writes out the open buckets.
+        Streams notice within one sample.
+        """
+        with self._lock:
+            self._watching.clear()
+            self._refused.clear()
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+        with self._lock:
+            for (container_id, rollups) in self._rollups.items():
+                for rollup in rollups.values():
+                    self._pending.append(rollup.row(container_id))
+            self._rollups = {}
+        self._flush()
+
+    def on_state(self, state: ContainerState):
+        """EventController listener watching running containers"""
+        if state.status == "running":
+            self.watch(state.container_id)
+        else:
+            self.unwatch(state.container_id)
+
+    def watch(self, container_id: str) -> bool:
+        """
+        Starts reading `container_id`'s stats stream.
+
+        @return False if `max_streams` streams are being read already. The
+        container is then watched as soon as one of them ends.
+        """
+        with self._lock:
+            if container_id in self._watching:
+                return True
+            if len(self._watching) >= self._max_streams:
+                if container_id not in self._refused:
+                    self._refused[container_id] = None
+                    self._refusals += 1
+                    print("[StatsController.watch] all "
+                          f"{self._max_streams} streams busy, not sampling "
+                          f"{container_id} for now")
+                return False
+            self._refused.pop(container_id, None)
+            token = next(self._tokens)
+            self._watching[container_id] = token
+            self._rings.setdefault(
+                container_id, deque(maxlen=self._ring_size))
+
+        threading.Thread(
+            target=self._read_stream,
+            args=(container_id, token),
+            name=f"roker-stats-{container_id[:12]}",
+            daemon=True
+        ).start()
+        return True
+
+    def unwatch(self, container_id: str):
+        """
+        Stops reading `container_id`'s stats stream. Its open buckets are
+        queued for the next flush and its ring buffer is dropped.
+        """
+        with self._lock:
+            self._watching.pop(container_id, None)
+            self._refused.pop(container_id, None)
+            self._rings.pop(container_id, None)
+            for rollup in self._rollups.pop(container_id, {}).values():
+                self._pending.append(rollup.row(container_id))
+        self._watch_refused()
+
+    def get_samples(self, container_id: str) -> list[StatSample]:
+        """The samples in `container_id`'s ring buffer, oldest first"""
+        with self._lock:
+            return list(self._rings.get(container_id, ()))
+
+    def top(self, by: str = "cpu", n: int = 10) -> list[dict]:
+        """
+        The `n` containers using the most CPU or memory, going by their
+        latest sample.
+
+        @raises ValueError if `by` is not "cpu" or "mem"
+        """
+        match by:
+            case "cpu":
+                key = attrgetter("cpu_percent")
+            case "mem":
+                key = attrgetter("mem_bytes")
+            case _:
+                raise ValueError(f"can not rank by '{by}'")
+
+        with self._lock:
+            latest = [(container_id, ring[-1])
+                      for (container_id, ring) in self._rings.items()
+                      if len(ring) > 0]
+
+        latest.sort(key=lambda c: key(c[1]), reverse=True)
+        return [{"container_id": container_id, **asdict(sample)}
+                for (container_id, sample) in latest[:max(0, n)]]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "watching": len(self._watching),
+                "refused": len(self._refused),
+                "refusals": self._refusals,
+                "samples": self._samples,
+                "pending_rows": len(self._pending),
+                "dropped_rows": self._dropped_rows,
+            }
+
+    # PRIVATE
+
+    def _read_stream(self, container_id: str, token: int):
+        try:
+            stream = self._client.api.stats(
+                container_id, decode=True, stream=True)
+            for raw in stream:
+                if not self._is_watching(container_id, token):
+                    return
+                sample = compute_sample(raw, time.time())
+                if sample is not None:
+                    self._add_sample(container_id, sample)
+        except (docker.errors.APIError,
+                docker.errors.DockerException, OSError) as e:
+            print("[StatsController._read_stream] stats stream for "
+                  f"{container_id} ended: {e}")
+        finally:
+            with self._lock:
+                if self._watching.get(container_id) == token:
+                    del self._watching[container_id]
+            self._watch_refused()
+
+    def _is_watching(self, container_id: str, token: int) -> bool:
+        with self._lock:
+            return self._watching.get(container_id) == token
+
+    def _watch_refused(self):
+        """Hands free stream slots to refused containers, oldest first"""
+        while True:
+            with self._lock:
+                if (len(self._refused) == 0
+                        or len(self._watching) >= self._max_streams):
+                    return
+                container_id = next(iter(self._refused))
+            if not self.watch(container_id):
+                return
+
+    def _add_sample(self, container_id: str, sample: StatSample):
+        with self._lock:
+            ring = self._rings.get(container_id)
+            if ring is None:
+                # Unwatched while this sample was in flight
+                return
+            ring.append(sample)
+            self._samples += 1
+            if self._db is None:
+                return
+
+            rollups = self._rollups.setdefault(container_id, {})
+            for resolution in RESOLUTIONS:
+                bucket = int(sample.ts) // resolution * resolution
+                rollup = rollups.get(resolution)
+                if rollup is not None and rollup.bucket != bucket:
+                    self._pending.append(rollup.row(container_id))
+                    rollup = None
+                if rollup is None:
+                    rollup = rollups[resolution] = _Rollup(
+                        resolution, bucket)
+                rollup.add(sample)
+
+    def _flush_loop(self):
+        last_prune = 0.0
+        while not self._stopping.wait(self._flush_interval):
+            self._flush()
+            if time.monotonic() - last_prune >= _PRUNE_INTERVAL:
+                self._prune()
+                last_prune = time.monotonic()
+
+    def _flush(self):
+        """Writes every closed bucket to the database"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if len(rows) == 0 or self._db is None:
+            return
+
+        (status, res) = self._db.add_agent_stats(rows)
+        if status != DB_query_status.SUCCESS:
+            print(f"[StatsController._flush] failed: {res}")
+            with self._lock:
+                self._dropped_rows += len(rows)
+
+    def _prune(self):
+        """Drops buckets older than their resolution's retention"""
+        now = int(time.time())
+        for (resolution, retention) in self._retention.items():
+            self._db.prune_agent_stats(resolution, now - retention)
@@ -0,0 +1,448 @@
+import abc
+import asyncio
+import itertools
+import json
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from dotenv import load_dotenv
+
+from roker.controllers.db_controller import DB_Controller, DB_query_status
+
+load_dotenv()
+
+DEFAULT_TOURNAMENT_PARALLELISM = os.cpu_count() or 1
+DEFAULT_TOURNAMENT_TABLE_SIZE = 2
+
+FORMATS = ("round_robin", "swiss", "knockout")
+
+
+class TOURNAMENT_SC(IntEnum):
+    DB_FAILED = -3
+    TOO_FEW_AGENTS = -2
+    BAD_FORMAT = -1
+    OK = 0
+
+
+@dataclass(frozen=True)
+class Table:
+    """
+    number: position of the table in its tournament, from 0
+    round:  round of the tournament the table belongs to, from 0
+    seats:  agent ids seated at the table, in seeding order
+    """
+    tournament_id: int
+    number: int
+    round: int
+    seats: tuple[int, ...]
+
+
+def winner(table: Table, scores: dict[int, float]) -> int:
+    """Highest scoring agent at a table. Ties go to the better seed."""
+    return max(table.seats, key=lambda agent_id: (
+        scores.get(agent_id, 0), -table.seats.index(agent_id)))
+
+
+def standings(agent_ids: list[int], results: list[tuple[Table, dict]],
+              knockout: bool = False) -> list[dict]:
+    """
+    Agents ordered by tables won, then total score, then seed. `results`
+    is every played table with its scores.
+
+    In a `knockout`, agents still in go first, then the rest by how late
+    they were knocked out.
+    """
+    rows = {agent_id: {"agent_id": agent_id, "wins": 0, "score": 0.0,
+                       "tables": 0}
+            for agent_id in agent_ids}
+    knocked_out = {}
+    for (table, scores) in results:
+        best = winner(table, scores)
+        rows[best]["wins"] += 1
+        for agent_id in table.seats:
+            rows[agent_id]["tables"] += 1
+            rows[agent_id]["score"] += scores.get(agent_id, 0)
+            if agent_id != best:
+                knocked_out[agent_id] = table.round
+
+    seed = {agent_id: i for (i, agent_id) in enumerate(agent_ids)}
+
+    def rank(row: dict) -> tuple:
+        agent_id = row["agent_id"]
+        key = (-row["wins"], -row["score"], seed[agent_id])
+        if not knockout:
+            return key
+        return (agent_id in knocked_out,
+                -knocked_out.get(agent_id, 0)) + key
+
+    return sorted(rows.values(), key=rank)
+
+
+class _Format(abc.ABC):
+    """
+    Builds the tables of a tournament. `start` returns the tables that can
+    be played at once, and `on_result` those a played table unlocks.
+    """
+
+    def __init__(self, tournament_id: int, agent_ids: list[int],
+                 table_size: int, rounds: int | None):
+        self.tournament_id: int = tournament_id
+        self.agent_ids: list[int] = agent_ids
+        self.table_size: int = table_size
+        self.rounds: int | None = rounds
+        self.results: list[tuple[Table, dict]] = []
+        self._numbers = itertools.count()
+
+    @abc.abstractmethod
+    def start(self) -> list[Table]:
+        pass
+
+    def on_result(self, table: Table, scores: dict) -> list[Table]:
+        self.results.append((table, scores))
+        return []
+
+    def _table(self, round: int, seats) -> Table:
+        return Table(self.tournament_id, next(self._numbers), round,
+                     tuple(seats))
+
+
+class _RoundRobin(_Format):
+    """Every group of `table_size` agents meets at one table"""
+
+    def start(self) -> list[Table]:
+        return [self._table(0, seats) for seats in
+                itertools.combinations(self.agent_ids, self.table_size)]
+
+
+class _Swiss(_Format):
+    """
+    `rounds` rounds (log2 of the field by default). Each round seats agents
+    with similar standings together, avoiding rematches where it can, and
+    starts once the round before it has been played out.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        if self.rounds is None:
+            self.rounds = max(1, math.ceil(math.log2(len(self.agent_ids))))
+        self._round: int = 0
+        self._left: int = 0
+        self._met: set[frozenset] = set()
+
+    def start(self) -> list[Table]:
+        return self._pair(self.agent_ids)
+
+    def on_result(self, table: Table, scores: dict) -> list[Table]:
+        super().on_result(table, scores)
+        self._left -= 1
+        if self._left > 0 or self._round + 1 >= self.rounds:
+            return []
+
+        self._round += 1
+        return self._pair([row["agent_id"] for row in
+                           standings(self.agent_ids, self.results)])
+
+    def _pair(self, ranked: list[int]) -> list[Table]:
+        unseated = list(ranked)
+        tables = []
+        while len(unseated) >= 2:
+            seats = [unseated.pop(0)]
+            while len(seats) < self.table_size and len(unseated) > 0:
+                # The best ranked agent not yet met, else the best ranked
+                pick = next((agent_id for agent_id in unseated
+                             if all(frozenset((agent_id, seated))
+                                    not in self._met for seated in seats)),
+                            unseated[0])
+                unseated.remove(pick)
+                seats.append(pick)
+            for pair in itertools.combinations(seats, 2):
+                self._met.add(frozenset(pair))
+            tables.append(self._table(self._round, seats))
+
+        # An agent left over sits the round out
+        self._left = len(tables)
+        return tables
+
+
+class _Knockout(_Format):
+    """
+    Single elimination. Only the winner of each table advances. A table
+    of the next round is played as soon as the tables feeding it are, so
+    one slow table does not hold up the rest of the bracket.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Agents entering each round, None until decided
+        self._slots: list[list[int | None]] = []
+        # table number -> group of its round it was seated from
+        self._group_of: dict[int, int] = {}
+
+    def start(self) -> list[Table]:
+        self._slots.append(list(self.agent_ids))
+        tables = []
+        for group in range(self._groups(0)):
+            tables += self._fill(0, group)
+        return tables
+
+    def on_result(self, table: Table, scores: dict) -> list[Table]:
+        super().on_result(table, scores)
+        return self._advance(table.round + 1, self._group_of[table.number],
+                             winner(table, scores))
+
+    def _groups(self, round: int) -> int:
+        return math.ceil(len(self._slots[round]) / self.table_size)
+
+    def _fill(self, round: int, group: int) -> list[Table]:
+        """Seats group `group` of round `round` once all of it is decided"""
+        if len(self._slots) <= round + 1:
+            self._slots.append([None] * self._groups(round))
+        size = self.table_size
+        seats = self._slots[round][group * size:(group + 1) * size]
+        if any(seat is None for seat in seats):
+            return []
+        if len(seats) == 1:
+            # A bye
+            return self._advance(round + 1, group, seats[0])
+
+        table = self._table(round, seats)
+        self._group_of[table.number] = group
+        return [table]
+
+    def _advance(self, round: int, group: int, agent_id: int) -> list[Table]:
+        self._slots[round][group] = agent_id
+        if len(self._slots[round]) == 1:
+            # The final has been played
+            return []
+        return self._fill(round, group // self.table_size)
+
+
+_FORMATS = {
+    "round_robin": _RoundRobin,
+    "swiss": _Swiss,
+    "knockout": _Knockout,
+}
+
+
+@dataclass
+class _Tournament:
+    format: _Format
+    pending: list[Table] = field(default_factory=list)
+    running: int = 0
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class TournamentController:
+    """
+    Runs tournaments between registered agents.
+
+    A tournament's tables are played by `runner`, an async callable taking
+    a Table and returning the score of each seated agent. Tables of every
+    tournament share `parallelism` slots (the host's CPU count by default)
+    and an agent is never seated at two tables at once, across all
+    tournaments. Whenever a table finishes, the freed slot goes to the
+    first waiting table whose agents are all free, so the slots stay busy
+    for as long as there are playable tables.
+
+    Tournaments and their tables are recorded in sqlite as they are
+    played. A table whose runner raises counts as played with no scores.
+    """
+
+    def __init__(
+        self,
+        db: DB_Controller,
+        runner,
+        parallelism: int = int(os.getenv(
+            "TOURNAMENT_PARALLELISM", DEFAULT_TOURNAMENT_PARALLELISM))
+    ):
+        self._db: DB_Controller = db
+        self._runner = runner
+        self._parallelism: int = max(1, parallelism)
+
+        self._tournaments: dict[int, _Tournament] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._playing: set[asyncio.Task] = set()
+        self._running: int = 0
+        # Agents seated at a table right now
+        self._seated: set[int] = set()
+        self._changed: asyncio.Condition = asyncio.Condition()
+
+        self._tables: int = 0
+        self._failed: int = 0
+        self._most_running: int = 0
+
+    # PUBLIC
+
+    async def start(
+            self,
+            agent_ids: list[int],
+            format: str,
+            table_size: int = DEFAULT_TOURNAMENT_TABLE_SIZE,
+            rounds: int | None = None) -> (TOURNAMENT_SC, int | str | None):
+        """
+        Starts a tournament between `agent_ids`, seeded in that order, and
+        returns its id without waiting for it to be played.
+
+        `format` is one of FORMATS. `rounds` only applies to swiss.
+        """
+        if format not in _FORMATS:
+            return (TOURNAMENT_SC.BAD_FORMAT, None)
+        agent_ids = list(dict.fromkeys(agent_ids))
+        if table_size < 2 or len(agent_ids) < table_size:
+            return (TOURNAMENT_SC.TOO_FEW_AGENTS, None)
+
+        (status, tournament_id) = self._db.add_tournament(
+            format, table_size, agent_ids)
+        if status != DB_query_status.SUCCESS:
+            return (TOURNAMENT_SC.DB_FAILED, str(tournament_id))
+
+        tournament = _Tournament(format=_FORMATS[format](
+            tournament_id, agent_ids, table_size, rounds))
+        self._tournaments[tournament_id] = tournament
+        self._tasks[tournament_id] = asyncio.create_task(
+            self._run(tournament))
+        return (TOURNAMENT_SC.OK, tournament_id)
+
+    async def wait(self, tournament_id: int):
+        """Waits for a tournament to finish, if it is still running"""
+        tournament = self._tournaments.get(tournament_id)
+        if tournament is not None:
+            await tournament.done.wait()
+
+    def get_tournament(self, tournament_id: int) -> dict | None:
+        """A tournament, its standings and its tables, from the database"""
+        (status, data) = self._db.get_tournament(tournament_id)
+        if status != DB_query_status.SUCCESS:
+            return None
+
+        (row, table_rows) = data
+        (_, format, table_size, agents, status, created_at, finished_at) = row
+        agent_ids = json.loads(agents)
+        tables = []
+        results = []
+        for (_, number, round, seats, scores, table_status, started,
+             finished) in table_rows:
+            table = Table(tournament_id, number, round,
+                          tuple(json.loads(seats)))
+            # json object keys are strings
+            scores = None if scores is None else {
+                int(agent_id): score
+                for (agent_id, score) in json.loads(scores).items()}
+            if scores is not None:
+                results.append((table, scores))
+            tables.append({
+                "number": number,
+                "round": round,
+                "seats": list(table.seats),
+                "scores": scores,
+                "status": table_status,
+                "started_at": started,
+                "finished_at": finished,
+            })
+
+        return {
+            "id": tournament_id,
+            "format": format,
+            "table_size": table_size,
+            "status": status,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "standings": standings(agent_ids, results,
+                                   knockout=format == "knockout"),
+            "tables": tables,
+        }
+
+    def get_stats(self) -> dict:
+        return {
+            "tournaments": sum(1 for t in self._tournaments.values()
+                               if not t.done.is_set()),
+            "parallelism": self._parallelism,
+            "running": self._running,
+            "most_running": self._most_running,
+            "waiting": sum(len(t.pending)
+                           for t in self._tournaments.values()),
+            "seated": len(self._seated),
+            "tables": self._tables,
+            "failed": self._failed,
+        }
+
+    async def stop(self):
+        """Abandons every running tournament"""
+        tasks = [*self._tasks.values(), *self._playing]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # PRIVATE
+
+    async def _run(self, tournament: _Tournament):
+        tournament_id = tournament.format.tournament_id
+        status = "finished"
+        try:
+            async with self._changed:
+                tournament.pending = tournament.format.start()
+                while True:
+                    self._dispatch()
+                    if tournament.running == 0 and \
+                            len(tournament.pending) == 0:
+                        break
+                    await self._changed.wait()
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            tournament.pending.clear()
+            self._db.finish_tournament(tournament_id, status)
+            self._tasks.pop(tournament_id, None)
+            self._tournaments.pop(tournament_id, None)
+            tournament.done.set()
+
+    def _dispatch(self):
+        """Seats waiting tables, oldest tournament first, while slots last"""
+        for tournament in self._tournaments.values():
+            for table in list(tournament.pending):
+                if self._running >= self._parallelism:
+                    return
+                if any(seat in self._seated for seat in table.seats):
+                    continue
+
+                tournament.pending.remove(table)
+                tournament.running += 1
+                self._running += 1
+                self._most_running = max(self._most_running, self._running)
+                self._seated.update(table.seats)
+                task = asyncio.create_task(self._play(tournament, table))
+                self._playing.add(task)
+                task.add_done_callback(self._playing.discard)
+
+    async def _play(self, tournament: _Tournament, table: Table):
+        started = time.time()
+        self._db.put_tournament_table(
+            table.tournament_id, table.number, table.round,
+            list(table.seats), None, "running", started)
+
+        status = "played"
+        try:
+            scores = await self._runner(table)
+        except Exception as e:
+            print(f"[TournamentController._play] table {table.number} of"
+                  f" tournament {table.tournament_id} failed: {e!r}")
+            (status, scores) = ("failed", {})
+            self._failed += 1
+        finally:
+            self._seated.difference_update(table.seats)
+            tournament.running -= 1
+            self._running -= 1
+
+        scores = {agent_id: scores.get(agent_id, 0)
+                  for agent_id in table.seats}
+        self._tables += 1
+        self._db.put_tournament_table(
+            table.tournament_id, table.number, table.round,
+            list(table.seats), scores, status, started, time.time())
+
+        async with self._changed:
+            tournament.pending += tournament.format.on_result(table, scores)
+            self._changed.notify_all()
@@ -0,0 +1,179 @@
+import roker.controllers.admission_controller as a
+import asyncio
+import pytest
+
+MB = 1024 ** 2
+
+
+def new_admission(**kwargs) -> a.AdmissionController:
+    kwargs.setdefault("mem_budget", 512 * MB)
+    kwargs.setdefault("cpu_budget", 4)
+    return a.AdmissionController(**kwargs)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Test_AdmissionController:
+    @pytest.mark.asyncio
+    async def test_within_budget(self):
+        """
+        Requests that fit are admitted at once and counted against the
+        budget until released
+        """
+        adm = new_admission()
+        (status, first) = await adm.acquire(256 * MB, 1)
+        assert status == a.ADM_SC.OK
+        (status, second) = await adm.acquire(256 * MB, 1)
+        assert status == a.ADM_SC.OK
+        assert adm.get_stats()["mem_committed"] == 512 * MB
+
+        adm.release(first)
+        adm.release(first)
+        assert adm.get_stats()["mem_committed"] == 256 * MB
+        assert adm.get_stats()["reservations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queue(self):
+        """
+        Requests that do not fit wait, and are admitted in order as
+        capacity frees up
+        """
+        adm = new_admission()
+        (_, held) = await adm.acquire(512 * MB, 1)
+
+        positions = {1: [], 2: []}
+        admitted = []
+
+        async def launch(n):
+            (status, reservation) = await adm.acquire(
+                256 * MB, 1, on_queued=positions[n].append)
+            admitted.append(n)
+            return reservation
+
+        tasks = [asyncio.create_task(launch(n)) for n in (1, 2)]
+        await settle()
+        assert admitted == []
+        assert positions == {1: [1, 1], 2: [2]}
+        assert [entry["position"] for entry in adm.get_queue()] == [1, 2]
+
+        adm.bind(held, "container")
+        adm.release_container("container")
+        await asyncio.gather(*tasks)
+        assert admitted == [1, 2]
+        assert adm.get_stats()["waiting"] == 0
+        assert adm.get_stats()["mem_committed"] == 512 * MB
+
+    @pytest.mark.asyncio
+    async def test_priority(self):
+        """
+        Higher priority waiters go first; equal ones first come first served
+        """
+        adm = new_admission(mem_budget=100)
+        (_, held) = await adm.acquire(100, 1)
+
+        admitted = []
+
+        async def launch(name, priority):
+            (_, reservation) = await adm.acquire(100, 1, priority)
+            admitted.append(name)
+            adm.release(reservation)
+
+        tasks = [asyncio.create_task(launch(name, priority))
+                 for (name, priority) in (("low", 0), ("low2", 0),
+                                          ("high", 5))]
+        await settle()
+        assert [entry["priority"] for entry in adm.get_queue()] == [5, 0, 0]
+
+        adm.release(held)
+        await asyncio.gather(*tasks)
+        assert admitted == ["high", "low", "low2"]
+
+    @pytest.mark.asyncio
+    async def test_head_of_line(self):
+        """
+        A large waiter is not overtaken by smaller ones behind it, and
+        try_acquire never jumps the queue
+        """
+        adm = new_admission(mem_budget=100)
+        (_, held) = await adm.acquire(60, 1)
+
+        big = asyncio.create_task(adm.acquire(100, 1))
+        await settle()
+        small = asyncio.create_task(adm.acquire(10, 1))
+        await settle()
+        assert not small.done()
+        assert adm.try_acquire(10, 1) is None
+
+        adm.release(held)
+        (_, reservation) = await big
+        assert not small.done()
+        adm.release(reservation)
+        assert (await small)[0] == a.ADM_SC.OK
+
+    @pytest.mark.asyncio
+    async def test_cpu_budget(self):
+        """
+        CPUs are budgeted alongside memory
+        """
+        adm = new_admission(cpu_budget=1)
+        assert adm.try_acquire(MB, 0.5) is not None
+        assert adm.try_acquire(MB, 0.5) is not None
+        assert adm.try_acquire(MB, 0.5) is None
+
+    @pytest.mark.asyncio
+    async def test_cancelled(self):
+        """
+        Waiters that give up leave the queue without holding capacity
+        """
+        adm = new_admission(mem_budget=100)
+        (_, held) = await adm.acquire(100, 1)
+
+        waiter = asyncio.create_task(adm.acquire(100, 1))
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert adm.get_stats()["waiting"] == 0
+
+        adm.release(held)
+        assert adm.get_stats()["mem_committed"] == 0
+
+    @pytest.mark.asyncio
+    async def test_rejected(self):
+        """
+        Requests larger than the whole budget, or past the queue limit, are
+        refused outright
+        """
+        adm = new_admission(mem_budget=100, queue_limit=1)
+        assert (await adm.acquire(101, 1))[0] == a.ADM_SC.TOO_LARGE
+        assert (await adm.acquire(1, 5))[0] == a.ADM_SC.TOO_LARGE
+
+        await adm.acquire(100, 1)
+        waiter = asyncio.create_task(adm.acquire(100, 1))
+        await settle()
+        assert (await adm.acquire(100, 1))[0] == a.ADM_SC.QUEUE_FULL
+        waiter.cancel()
+        assert adm.get_stats()["rejected"] == 3
+
+    @pytest.mark.asyncio
+    async def test_adopt(self):
+        """
+        Containers already running are counted once, even past the budget,
+        and hold up waiters until they are released
+        """
+        adm = new_admission(mem_budget=100)
+        adm.adopt("old", 80, 1)
+        adm.adopt("old", 80, 1)
+        adm.adopt("older", 80, 1)
+        assert adm.get_stats()["mem_committed"] == 160
+
+        waiter = asyncio.create_task(adm.acquire(50, 1))
+        await settle()
+        adm.release_container("old")
+        await settle()
+        assert not waiter.done()
+
+        adm.release_container("older")
+        assert (await waiter)[0] == a.ADM_SC.OK
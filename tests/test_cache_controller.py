@@ -0,0 +1,207 @@
+import roker.controllers.cache_controller as c
+import asyncio
+import os
+import pytest
+
+
+def make_builder(size: int = 10, ok: bool = True) -> (object, list):
+    calls = []
+
+    async def builder(repo_url: str, commit_sha: str, out_dir: str) -> bool:
+        calls.append((repo_url, commit_sha))
+        # Give concurrent callers a chance to pile up
+        await asyncio.sleep(0.01)
+        with open(os.path.join(out_dir, c.ARTIFACT_NAME), "wb") as f:
+            f.write(b"x" * size)
+        return ok
+
+    return (builder, calls)
+
+
+class Test_ArtifactCache:
+
+    @pytest.mark.asyncio
+    async def test_single_flight(self, tmp_path):
+        """
+        Ensures 20 concurrent requests for one commit trigger one build
+        """
+        (builder, calls) = make_builder()
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+
+        res = await asyncio.gather(
+            *[cache.get("repo", "sha", "recipe") for _ in range(20)])
+
+        assert len(calls) == 1
+        assert all(r.status == c.CACHE_SC.BUILT for r in res)
+        assert len({r.path for r in res}) == 1
+        assert os.path.isfile(os.path.join(res[0].path, c.ARTIFACT_NAME))
+
+        res = await cache.get("repo", "sha", "recipe")
+        assert res.status == c.CACHE_SC.HIT
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_key_includes_commit_and_recipe(self, tmp_path):
+        """
+        Ensures a new commit or a new recipe is a cache miss
+        """
+        (builder, calls) = make_builder()
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+
+        await cache.get("repo", "sha1", "recipe")
+        await cache.get("repo", "sha2", "recipe")
+        await cache.get("repo", "sha1", "recipe2")
+        assert len(calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self, tmp_path):
+        """
+        Ensures the least recently used, unpinned artifact is evicted once
+        the cache exceeds its disk budget
+        """
+        (builder, _) = make_builder(size=10)
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=25)
+
+        a = await cache.get("repo", "a", "r")
+        b = await cache.get("repo", "b", "r")
+        cache.unpin(a.key)
+        cache.unpin(b.key)
+
+        # Touch a, so b is now least recently used
+        cache.unpin((await cache.get("repo", "a", "r")).key)
+
+        cache.unpin((await cache.get("repo", "c", "r")).key)
+        assert not os.path.exists(b.path)
+        assert os.path.exists(a.path)
+        assert cache.get_stats()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_pinned_not_evicted(self, tmp_path):
+        """
+        Ensures a pinned artifact survives eviction until unpinned
+        """
+        (builder, _) = make_builder(size=10)
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=15)
+
+        a = await cache.get("repo", "a", "r")
+        b = await cache.get("repo", "b", "r")
+        assert os.path.exists(a.path)
+        assert os.path.exists(b.path)
+
+        cache.unpin(a.key)
+        assert not os.path.exists(a.path)
+        assert os.path.exists(b.path)
+
+    @pytest.mark.asyncio
+    async def test_failed_build(self, tmp_path):
+        """
+        Ensures a failed build is reported and leaves nothing behind
+        """
+        (builder, calls) = make_builder(ok=False)
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+
+        res = await cache.get("repo", "sha", "recipe")
+        assert res.status == c.CACHE_SC.BUILD_FAILED
+        assert os.listdir(tmp_path) == []
+
+        await cache.get("repo", "sha", "recipe")
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_reload_from_disk(self, tmp_path):
+        """
+        Ensures a new cache picks up artifacts built by a previous one
+        """
+        (builder, calls) = make_builder()
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+        await cache.get("repo", "sha", "recipe")
+
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+        res = await cache.get("repo", "sha", "recipe")
+        assert res.status == c.CACHE_SC.HIT
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_first_caller_cancelled(self, tmp_path):
+        """
+        Ensures the caller that started a build giving up does not fail the
+        callers sharing it
+        """
+        (builder, calls) = make_builder()
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+
+        first = asyncio.create_task(cache.get("repo", "sha", "recipe"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get("repo", "sha", "recipe"))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        res = await second
+        assert res.status == c.CACHE_SC.BUILT
+        assert len(calls) == 1
+        assert first.cancelled()
+
+        # Only the caller that got the artifact holds a pin
+        cache.unpin(res.key)
+        assert cache._pins == {}
+
+    @pytest.mark.asyncio
+    async def test_all_callers_cancelled(self, tmp_path):
+        """
+        Ensures a build nobody waits for any more is cancelled and leaves
+        nothing behind
+        """
+        started = asyncio.Event()
+
+        async def builder(repo_url, commit_sha, out_dir):
+            started.set()
+            await asyncio.sleep(10)
+            return True
+
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+        callers = [asyncio.create_task(cache.get("repo", "sha", "recipe"))
+                   for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+
+        for _ in range(100):
+            if os.listdir(tmp_path) == []:
+                break
+            await asyncio.sleep(0.01)
+        assert os.listdir(tmp_path) == []
+        assert cache._building == {}
+
+    @pytest.mark.asyncio
+    async def test_lookup_and_prefetch(self, tmp_path):
+        """
+        Ensures lookup never builds, and prefetch builds in the background
+        without pinning
+        """
+        (builder, calls) = make_builder()
+        cache = c.ArtifactCache(builder, cache_dir=str(tmp_path),
+                                disk_budget=1000)
+
+        assert cache.lookup("repo", "sha", "recipe") is None
+        cache.prefetch("repo", "sha", "recipe")
+        cache.prefetch("repo", "sha", "recipe")
+        for _ in range(100):
+            if cache.get_stats()["entries"] == 1:
+                break
+            await asyncio.sleep(0.01)
+        assert len(calls) == 1
+        assert cache._pins == {}
+
+        res = cache.lookup("repo", "sha", "recipe")
+        assert res.status == c.CACHE_SC.HIT
+        assert cache._pins == {res.key: 1}
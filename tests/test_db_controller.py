@@ -1,4 +1,6 @@
 import roker.controllers.db_controller as d
+import json
+import threading
 from datetime import datetime
 
 start_time_1 = datetime.now()
@@ -454,3 +456,308 @@ class Test_DB_controller:
         assert res_status == d.DB_query_status.QUERY_FAILED
         assert res_body == ("Failed to update. Most likely caused by the agent"
                             " '1' not existing in the agents table.")
+
+    def test_add_new_agents(self):
+        """
+        Asserts DB_Controller.add_new_agents adds every agent and returns
+        their row ids in order.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+
+        (res_status, res_body) = db.add_new_agents([agent_1, agent_2])
+        assert res_status == d.DB_new_agent_status.SUBMITTED
+        assert res_body == [1, 2]
+
+        (get_status, get_body) = db.get_agent_data(" test name 2")
+        assert get_status == d.DB_query_status.SUCCESS
+        assert get_body.id == 2
+
+    def test_add_new_agents_all_or_nothing(self):
+        """
+        Ensures DB_Controller.add_new_agents adds nothing when one agent
+        is invalid, or when the transaction fails part way.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+
+        (res_status, res_body) = db.add_new_agents([agent_1, d.Agent()])
+        assert res_status == d.DB_new_agent_status.MISSING_ATTRIBUTE
+        assert res_body == "agent 1: missing container_name"
+
+        # container_id is UNIQUE, so the second insert fails
+        (res_status, res_body) = db.add_new_agents([agent_1, agent_1])
+        assert res_status == d.DB_new_agent_status.FAILED_EXECUTION
+
+        (get_status, get_body) = db.get_agent_data(1)
+        assert get_status == d.DB_query_status.NO_RESULT
+
+    def test_connection_per_thread(self):
+        """
+        Ensures each thread gets its own connection to the same database
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+        db.add_new_agent(agent_1)
+
+        res = {}
+
+        def worker():
+            res["con"] = db._con
+            res["data"] = db.get_agent_data("test id 1")
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+
+        assert res["con"] is not db._con
+        assert res["data"][0] == d.DB_query_status.SUCCESS
+        assert res["data"][1].container_name == "test name 1"
+
+    def test_wal_reads_do_not_wait_on_writer(self, tmp_path, monkeypatch):
+        """
+        Ensures a file database runs in WAL mode, and a reader on another
+        thread is not blocked by an open write transaction
+        """
+        monkeypatch.setenv("HOME", str(tmp_path))
+        db = d.DB_Controller(db_dir="/", db_name="wal.db", in_memory_db=False)
+        assert db.connect() == d.DB_connect_status.OK
+
+        mode = db._con.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+
+        db.add_new_agent(agent_1)
+
+        # Leave a write transaction open on this thread
+        db._con.execute("UPDATE agents SET team_name='writing' WHERE id=1")
+
+        res = {}
+
+        def reader():
+            res["data"] = db.get_agent_data(1)
+
+        t = threading.Thread(target=reader)
+        t.start()
+        t.join(timeout=2)
+
+        assert not t.is_alive()
+        assert res["data"][0] == d.DB_query_status.SUCCESS
+        assert res["data"][1].team_name is None
+
+        db._con.rollback()
+        db.close()
+
+    def test_update_agent_data_quotes(self):
+        """
+        Ensures values containing quotes are stored as-is rather than
+        breaking the statement.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+
+        id = db.add_new_agent(agent_1)[1]
+
+        (res_status, res_body) = db.update_agent_data(id, {
+            "team_name": "O'Brien's \"Aces\"",
+            "team_members": "'); DROP TABLE agents; --"
+        })
+        assert res_status == d.DB_query_status.SUCCESS
+
+        (get_status, get_body) = db.get_agent_data(id)
+        assert get_status == d.DB_query_status.SUCCESS
+        assert get_body.team_name == "O'Brien's \"Aces\""
+        assert get_body.team_members == "'); DROP TABLE agents; --"
+
+    def test_update_sql_memoized_by_shape(self):
+        """
+        Ensures updates with the same columns, in any order, share one
+        statement string.
+        """
+        a = d.update_agent_sql(("active", "team_name"), "id")
+        b = d.update_agent_sql(("active", "team_name"), "id")
+        assert a is b
+        assert a == "UPDATE agents SET active=?, team_name=? WHERE id=?"
+
+        db = d.DB_Controller(in_memory_db=True)
+        (_, x) = db._agent_update_statement(1, {"team_name": "t", "active": 1})
+        (_, y) = db._agent_update_statement(2, {"active": 0, "team_name": "u"})
+        assert x[0] is y[0]
+        assert x[1] == (1, "t", 1)
+        assert y[1] == (0, "u", 2)
+
+    def test_update_agents_data(self):
+        """
+        Asserts DB_Controller.update_agents_data applies every update in one
+        call, matching on both row id and container id, and skips agents
+        that do not exist.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+        db.add_new_agents([agent_1, agent_2])
+
+        (res_status, res_body) = db.update_agents_data([
+            (1, {"active": True}),
+            (" test name 2", {"active": True}),
+            (2, {"team_name": "two"}),
+            (99, {"active": True}),
+        ])
+        assert res_status == d.DB_query_status.SUCCESS
+        assert res_body == 3
+
+        assert db.get_agent_data(1)[1].active
+        assert db.get_agent_data(2)[1].active
+        assert db.get_agent_data(2)[1].team_name == "two"
+
+    def test_update_agents_data_all_or_nothing(self):
+        """
+        Ensures DB_Controller.update_agents_data updates nothing when one
+        update is invalid.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+        db.add_new_agent(agent_1)
+
+        (res_status, res_body) = db.update_agents_data([
+            (1, {"active": True}),
+            (1, {"extra_attribute": "test"}),
+        ])
+        assert res_status == d.DB_query_status.BAD_PARAM_TYPE
+        assert res_body == ("update 1: Bad 'data', unexpected key. Got"
+                            " 'extra_attribute : test'")
+        assert not db.get_agent_data(1)[1].active
+
+    def test_write_behind_update(self):
+        """
+        Ensures a write-behind update is queued, resolves to the same result
+        as a direct update, and is visible once it resolves.
+        """
+        db = d.DB_Controller(in_memory_db=True, write_behind=True,
+                             write_behind_interval_ms=10)
+        assert db.connect() == d.DB_connect_status.OK
+        id = db.add_new_agent(agent_1)[1]
+
+        (res_status, future) = db.update_agent_data(id, {"team_name": "wb"})
+        assert res_status == d.DB_query_status.QUEUED
+        assert future.result(timeout=2) == (d.DB_query_status.SUCCESS, None)
+        assert db.get_agent_data(id)[1].team_name == "wb"
+
+        (res_status, future) = db.update_agent_data(99, {"team_name": "x"})
+        assert res_status == d.DB_query_status.QUEUED
+        assert future.result(timeout=2)[0] == d.DB_query_status.QUERY_FAILED
+
+        db.close()
+
+    def test_write_behind_group_commit(self):
+        """
+        Ensures many queued updates are committed in batches, and a failing
+        update does not undo the rest of its batch.
+        """
+        db = d.DB_Controller(in_memory_db=True, write_behind=True,
+                             write_behind_interval_ms=1000,
+                             write_behind_batch_size=10)
+        assert db.connect() == d.DB_connect_status.OK
+        db.add_new_agents([agent_1, agent_2])
+
+        commits = []
+        commit_batch = db._commit_batch
+
+        def counting_commit_batch(batch):
+            commits.append(len(batch))
+            commit_batch(batch)
+
+        db._commit_batch = counting_commit_batch
+
+        futures = []
+        for i in range(19):
+            futures.append(db.update_agent_data(1, {"port_number": i})[1])
+        futures.append(db.update_agent_data(99, {"port_number": 1})[1])
+
+        results = [f.result(timeout=5) for f in futures]
+        assert commits == [10, 10]
+        assert results[-1][0] == d.DB_query_status.QUERY_FAILED
+        assert all(r == (d.DB_query_status.SUCCESS, None)
+                   for r in results[:-1])
+        assert db.get_agent_data(1)[1].port_number == 18
+
+        db.close()
+
+    def test_write_behind_flushed_on_close(self, tmp_path, monkeypatch):
+        """
+        Ensures flush and close commit everything still queued, without
+        waiting out the commit interval.
+        """
+        monkeypatch.setenv("HOME", str(tmp_path))
+        db = d.DB_Controller(db_dir="/", db_name="wb.db", in_memory_db=False,
+                             write_behind=True,
+                             write_behind_interval_ms=60_000)
+        assert db.connect() == d.DB_connect_status.OK
+        db.add_new_agent(agent_1)
+
+        (_, future) = db.update_agents_data([(1, {"active": True})])
+        assert db.flush(timeout=5)
+        assert future.result(timeout=0) == (d.DB_query_status.SUCCESS, 1)
+
+        (_, future) = db.update_agent_data(1, {"team_name": "closing"})
+        db.close()
+        assert future.result(timeout=0) == (d.DB_query_status.SUCCESS, None)
+
+        db = d.DB_Controller(db_dir="/", db_name="wb.db", in_memory_db=False)
+        assert db.connect() == d.DB_connect_status.OK
+        assert db.get_agent_data(1)[1].team_name == "closing"
+        db.close()
+
+    def test_list_agents_filters_and_pages(self):
+        """
+        Asserts DB_Controller.list_agents filters on active, team_name and
+        port range, and pages by keyset across chunk boundaries.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+
+        db.add_new_agents([
+            d.Agent(container_name=f"name {i}", container_id=f"id {i}",
+                    port_number=20000 + i, start_time=start_time_1)
+            for i in range(10)
+        ])
+        db.update_agents_data(
+            [(i, {"active": True, "team_name": "even"})
+             for i in range(1, 11) if i % 2 == 0])
+
+        (status, agents) = db.list_agents(chunk_size=3)
+        assert status == d.DB_query_status.SUCCESS
+        assert [a.id for a in agents] == list(range(1, 11))
+
+        (_, agents) = db.list_agents(active=True, chunk_size=2)
+        assert [a.id for a in agents] == [2, 4, 6, 8, 10]
+
+        (_, agents) = db.list_agents(team_name="even", port_min=20003,
+                                     port_max=20007)
+        assert [a.id for a in agents] == [4, 6, 8]
+
+        (_, agents) = db.list_agents(after_id=4, limit=3, chunk_size=2)
+        assert [a.id for a in agents] == [5, 6, 7]
+
+        (status, body) = db.list_agents(active="yes")
+        assert status == d.DB_query_status.BAD_PARAM_TYPE
+
+    def test_list_agents_uses_indexes(self):
+        """
+        Ensures the listing filters are served by the secondary indexes.
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+
+        for (filters, index) in (((("active", "="),), "agents_active_idx"),
+                                 ((("team_name", "="),),
+                                  "agents_team_name_idx")):
+            sql = d.list_agents_sql(filters)
+            plan = db._con.execute(f"EXPLAIN QUERY PLAN {sql}",
+                                   (0, 1, 10)).fetchall()
+            assert index in str(plan)
+
+    def test_agent_to_json(self):
+        db = d.DB_Controller(in_memory_db=True)
+        data = json.loads(db.agent_to_json(agent_1))
+        assert data["container_id"] == "test id 1"
+        assert data["start_time"] == start_time_1.isoformat()
+        assert data["active"] is False
@@ -0,0 +1,160 @@
+import roker.controllers.docker_controller as dc
+import asyncio
+import docker
+import pytest
+import requests
+import threading
+from types import SimpleNamespace
+
+from roker.controllers.event_controller import ContainerState
+
+
+class FakeBuild:
+    """A build container that runs until it exits or is removed"""
+
+    def __init__(self, exit_code: int | None = None):
+        self.id = "build"
+        self.exit_code = exit_code
+        self.removed = threading.Event()
+
+    def wait(self, timeout: float) -> dict:
+        if self.exit_code is not None:
+            return {"StatusCode": self.exit_code}
+        if not self.removed.wait(timeout):
+            raise requests.exceptions.ReadTimeout("read timed out")
+        return {"StatusCode": 137}
+
+    def remove(self, force: bool = False):
+        assert force
+        self.removed.set()
+
+
+def new_controller(monkeypatch, container) -> dc.AgentController:
+    client = SimpleNamespace(containers=SimpleNamespace(
+        run=lambda *args, **kwargs: container))
+    monkeypatch.setattr(docker, "from_env", lambda: client)
+    monkeypatch.setattr(dc, "BUILD_PARALLELISM", 1)
+    return dc.AgentController()
+
+
+def idle(ac: dc.AgentController) -> bool:
+    return (ac.engine.get_in_flight() == 0
+            and not ac._build_semaphore.locked())
+
+
+class Test_BuildArtifact:
+    @pytest.mark.asyncio
+    async def test_build(self, monkeypatch, tmp_path):
+        """
+        Builds that exit cleanly succeed, and their container is removed
+        """
+        ok = FakeBuild(exit_code=0)
+        ac = new_controller(monkeypatch, ok)
+        assert await ac._build_artifact("url", "commit", str(tmp_path))
+        assert ok.removed.is_set()
+
+        failed = FakeBuild(exit_code=1)
+        ac = new_controller(monkeypatch, failed)
+        assert not await ac._build_artifact("url", "commit", str(tmp_path))
+        assert failed.removed.is_set()
+        assert idle(ac)
+
+    @pytest.mark.asyncio
+    async def test_build_timeout(self, monkeypatch, tmp_path):
+        """
+        A build past BUILD_TIMEOUT fails, frees its slot and is removed
+        """
+        monkeypatch.setattr(dc, "BUILD_TIMEOUT", 0.05)
+        build = FakeBuild()
+        ac = new_controller(monkeypatch, build)
+
+        assert not await ac._build_artifact("url", "commit", str(tmp_path))
+        assert build.removed.is_set()
+        assert idle(ac)
+
+    @pytest.mark.asyncio
+    async def test_build_cancelled(self, monkeypatch, tmp_path):
+        """
+        A cancelled build frees its slot and is removed at once
+        """
+        build = FakeBuild()
+        ac = new_controller(monkeypatch, build)
+
+        task = asyncio.create_task(
+            ac._build_artifact("url", "commit", str(tmp_path)))
+        await asyncio.sleep(0.05)
+        assert ac._build_semaphore.locked()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert build.removed.is_set()
+        assert idle(ac)
+
+
+class Test_CreateNewContainers:
+    @pytest.mark.asyncio
+    async def test_consumer_gone(self, monkeypatch):
+        """
+        When the consumer goes away, launches that had not started are
+        dropped, and those running finish and are passed to `on_created`
+        """
+        ac = new_controller(monkeypatch, None)
+        release = asyncio.Event()
+        started = []
+        created = []
+
+        async def create(gh_url, priority):
+            started.append(gh_url)
+            await release.wait()
+            return dc.ContainerCreation(
+                status=dc.DC_SC.OK, container_id=gh_url)
+
+        async def on_created(res):
+            created.append(res.container_id)
+
+        monkeypatch.setattr(ac, "create_new_container", create)
+        launches = ac.create_new_containers(
+            ["a", "b", "queued"], parallelism=2, on_created=on_created)
+        first = asyncio.ensure_future(launches.__anext__())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert started == ["a", "b"]
+        assert sorted(created) == ["a", "b"]
+        assert len(ac._launches) == 0
+
+
+class Test_RestartContainer:
+    @pytest.mark.asyncio
+    async def test_forgotten(self, monkeypatch):
+        """
+        Containers that no longer hold a port lease are not restarted
+        """
+        ac = new_controller(monkeypatch, None)
+        assert await ac.restart_conatiner("killed") == \
+            dc.DC_SC.FORGOTTEN_DOCKER_C
+
+
+class Test_SyncAdmission:
+    def test_sync(self, monkeypatch):
+        """
+        Containers holding a port lease are admitted while they run and
+        released once they exit or are removed; others are left alone
+        """
+        ac = new_controller(monkeypatch, None)
+        ac.pc.bind(ac.pc.reserve().port, "agent")
+
+        ac._sync_state(ContainerState("agent", "running"))
+        ac._sync_state(ContainerState("build", "running"))
+        assert ac.admission.get_stats()["reservations"] == 1
+
+        ac._sync_state(ContainerState("agent", "exited"))
+        assert ac.admission.get_stats()["reservations"] == 0
+        ac._sync_state(ContainerState("agent", "running"))
+        ac._sync_state(ContainerState("agent", "removed"))
+        assert ac.admission.get_stats()["mem_committed"] == 0
@@ -0,0 +1,106 @@
+import roker.controllers.engine_controller as e
+import asyncio
+import threading
+import time
+import pytest
+
+
+class Test_EngineController:
+
+    @pytest.mark.asyncio
+    async def test_call_returns_result(self):
+        """
+        Simple test ensuring a call is run and its result returned
+        """
+        EC = e.EngineController(max_workers=2, max_concurrency=2)
+        assert await EC.call(lambda a, b=0: a + b, 1, b=2) == 3
+        EC.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_call_reraises(self):
+        """
+        Ensures exceptions raised inside the worker reach the caller
+        """
+        EC = e.EngineController(max_workers=2, max_concurrency=2)
+
+        def boom():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await EC.call(boom)
+        EC.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_call_timeout(self):
+        """
+        Ensures a slow call times out, but keeps its concurrency slot until
+        its worker thread is done
+        """
+        EC = e.EngineController(max_workers=2, max_concurrency=1)
+
+        start = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await EC.call(time.sleep, 0.3, timeout=0.05)
+        assert EC.get_in_flight() == 1
+
+        assert await EC.call(lambda: "ok", timeout=1) == "ok"
+        assert time.monotonic() - start >= 0.3
+        assert EC.get_in_flight() == 0
+        EC.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_call_cancelled_before_running(self):
+        """
+        Ensures a call cancelled while queued for a worker never runs
+        """
+        EC = e.EngineController(max_workers=1, max_concurrency=2)
+        ran = []
+        slow = asyncio.create_task(EC.call(time.sleep, 0.1))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(EC.call(ran.append, 1))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+
+        await slow
+        await asyncio.sleep(0.01)
+        assert ran == []
+        assert EC.get_in_flight() == 0
+        EC.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap(self):
+        """
+        Ensures no more than max_concurrency calls run at once
+        """
+        EC = e.EngineController(max_workers=8, max_concurrency=3)
+        lock = threading.Lock()
+        running = 0
+        peak = 0
+
+        def work():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+        await asyncio.gather(*[EC.call(work) for _ in range(12)])
+        assert peak == 3
+        EC.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_loop_not_blocked(self):
+        """
+        Ensures the event loop keeps running while a call blocks a worker
+        """
+        EC = e.EngineController(max_workers=2, max_concurrency=2)
+        call = asyncio.create_task(EC.call(time.sleep, 0.2))
+
+        start = time.monotonic()
+        await asyncio.sleep(0.01)
+        assert time.monotonic() - start < 0.1
+
+        await call
+        EC.shutdown()
@@ -0,0 +1,160 @@
+import roker.controllers.event_controller as e
+import queue
+import time
+from types import SimpleNamespace
+
+LABEL = "roker.managed"
+
+
+class FakeStream:
+    """Blocking iterator over queued events, like docker's CancellableStream"""
+
+    def __init__(self, events: queue.Queue):
+        self._events = events
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+        self._events.put(None)
+
+
+class FakeClient:
+    def __init__(self, containers: list | None = None):
+        self.queue = queue.Queue()
+        self.streams = []
+        self.filters = []
+        self.containers = SimpleNamespace(
+            list=lambda all, filters: containers or [])
+
+    def events(self, since, decode, filters):
+        self.filters.append(filters)
+        stream = FakeStream(self.queue)
+        self.streams.append(stream)
+        return stream
+
+
+def event(action: str, id: str = "abc123", **attributes) -> dict:
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {"ID": id, "Attributes": attributes},
+        "time": int(time.time()),
+        "timeNano": time.time_ns(),
+    }
+
+
+def wait_for(check):
+    for _ in range(200):
+        if check():
+            return
+        time.sleep(0.005)
+    raise AssertionError("condition never became true")
+
+
+class Test_EventController:
+    def test_seed(self):
+        """
+        The table starts out with the containers that already exist
+        """
+        container = SimpleNamespace(
+            id="abc123", status="exited",
+            attrs={"State": {"ExitCode": 3, "OOMKilled": True}})
+        client = FakeClient([container])
+        ec = e.EventController(client, LABEL)
+        ec.start()
+        wait_for(lambda: ec.get_state("abc123") is not None)
+        ec.stop()
+
+        state = ec.get_state("abc123")
+        assert state.status == "exited"
+        assert state.exit_code == 3
+        assert state.oom_killed
+        assert client.filters[0] == {"type": "container", "label": LABEL}
+
+    def test_lifecycle(self):
+        """
+        Events move a container through its states and notify listeners
+        """
+        client = FakeClient()
+        ec = e.EventController(client, LABEL)
+        seen = []
+        ec.add_listener(lambda state: seen.append(state.status))
+        ec.start()
+
+        client.queue.put(event("create"))
+        client.queue.put(event("start"))
+        client.queue.put(event("exec_start: sh"))
+        wait_for(lambda: seen == ["created", "running"])
+        assert ec.get_state("abc").status == "running"
+
+        client.queue.put(event("oom"))
+        client.queue.put(event("die", exitCode="137"))
+        wait_for(lambda: seen[-1] == "exited")
+        state = ec.get_state("abc123")
+        assert state.exit_code == 137
+        assert state.oom_killed
+
+        client.queue.put(event("restart"))
+        wait_for(lambda: seen[-1] == "running")
+        assert not ec.get_state("abc123").oom_killed
+
+        client.queue.put(event("destroy"))
+        wait_for(lambda: seen[-1] == "removed")
+        assert ec.get_state("abc123") is None
+        assert ec.get_stats()["events"] == 7
+
+        ec.stop()
+        assert client.streams[0].closed
+
+    def test_reconnect(self):
+        """
+        A dropped stream is reopened and events keep flowing
+        """
+        client = FakeClient()
+        ec = e.EventController(client, LABEL, reconnect_delay=0.01)
+        ec.start()
+
+        client.queue.put(event("start", id="one"))
+        wait_for(lambda: ec.get_state("one") is not None)
+        # Ends the current stream
+        client.queue.put(None)
+        wait_for(lambda: len(client.streams) == 2)
+
+        client.queue.put(event("start", id="two"))
+        wait_for(lambda: ec.get_state("two") is not None)
+        ec.stop()
+
+        assert set(ec.get_states().keys()) == {"one", "two"}
+
+    def test_ambiguous_prefix(self):
+        """
+        A prefix matching more than one container finds nothing
+        """
+        client = FakeClient()
+        ec = e.EventController(client, LABEL)
+        ec._handle(event("start", id="abc1"))
+        ec._handle(event("start", id="abc2"))
+
+        assert ec.get_state("abc") is None
+        assert ec.get_state("abc2").status == "running"
+
+    def test_failing_listener(self):
+        """
+        A listener raising does not stop the state from being applied
+        """
+        client = FakeClient()
+        ec = e.EventController(client, LABEL)
+
+        def listener(state):
+            raise RuntimeError("boom")
+        ec.add_listener(listener)
+        ec._handle(event("start"))
+
+        assert ec.get_state("abc123").status == "running"
@@ -0,0 +1,149 @@
+import roker.controllers.db_controller as d
+import roker.controllers.fanout_controller as f
+import roker.controllers.registry_controller as r
+import asyncio
+import json
+import pytest
+import socket
+from datetime import datetime
+
+
+async def agent_server(delay: float = 0.0, status: bytes = b"200 OK",
+                       connections: list | None = None) -> asyncio.Server:
+    """
+    Echoes the json body back as {"echo": body}, after `delay` seconds.
+    Serves many requests per connection.
+    """
+    async def handle(reader, writer):
+        if connections is not None:
+            connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                body = await reader.readexactly(length)
+                await asyncio.sleep(delay)
+                out = json.dumps({"echo": json.loads(body)}).encode()
+                writer.write(b"HTTP/1.1 " + status + b"\r\n"
+                             b"Content-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(out)).encode()
+                             + b"\r\n\r\n" + out)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def new_fanout(**kwargs) -> (r.AgentRegistry, f.FanoutController):
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    registry = r.AgentRegistry(db)
+    return (registry, f.FanoutController(registry, **kwargs))
+
+
+def add_agent(registry: r.AgentRegistry, port: int) -> int:
+    (_, agent_id) = registry.add_new_agent(d.Agent(
+        container_name=f"name {port}",
+        container_id=f"container {port}",
+        port_number=port,
+        start_time=datetime.now()))
+    return agent_id
+
+
+def port_of(server: asyncio.Server) -> int:
+    return server.sockets[0].getsockname()[1]
+
+
+class Test_FanoutController:
+    @pytest.mark.asyncio
+    async def test_send(self):
+        """
+        Every agent gets the payload and its answer is returned by id
+        """
+        servers = [await agent_server() for _ in range(5)]
+        (registry, fanout) = new_fanout()
+        ids = [add_agent(registry, port_of(server)) for server in servers]
+
+        result = await fanout.send(ids, {"hand": 1})
+        await fanout.aclose()
+        for server in servers:
+            server.close()
+
+        assert result.responses == {
+            agent_id: {"echo": {"hand": 1}} for agent_id in ids}
+        assert result.failures == {}
+        assert set(result.latency) == set(ids)
+        assert fanout.get_latency(ids[0])["total"] == 1
+
+    @pytest.mark.asyncio
+    async def test_deadline(self):
+        """
+        Slow agents time out without holding up the rest
+        """
+        fast = await agent_server()
+        slow = await agent_server(delay=1.0)
+        (registry, fanout) = new_fanout()
+        fast_id = add_agent(registry, port_of(fast))
+        slow_id = add_agent(registry, port_of(slow))
+
+        result = await fanout.send([fast_id, slow_id], {}, deadline=0.1)
+        await fanout.aclose()
+        fast.close()
+        slow.close()
+
+        assert list(result.responses) == [fast_id]
+        assert result.failures == {slow_id: f.FANOUT_SC.TIMEOUT}
+        assert result.latency[slow_id] < 0.5
+        assert fanout.get_latency(slow_id) is None
+
+    @pytest.mark.asyncio
+    async def test_failures(self):
+        """
+        Unknown agents, refused connections and error statuses are failures
+        """
+        bad = await agent_server(status=b"500 Internal Server Error")
+        (registry, fanout) = new_fanout()
+        bad_id = add_agent(registry, port_of(bad))
+        dead_id = add_agent(registry, free_port())
+
+        result = await fanout.send([bad_id, dead_id, 9999, "nope"], {})
+        await fanout.aclose()
+        bad.close()
+
+        assert result.responses == {}
+        assert result.failures == {
+            bad_id: f.FANOUT_SC.BAD_RESPONSE,
+            dead_id: f.FANOUT_SC.REQ_FAIL,
+            9999: f.FANOUT_SC.NOT_FOUND,
+            "nope": f.FANOUT_SC.NOT_FOUND,
+        }
+
+    @pytest.mark.asyncio
+    async def test_keep_alive(self):
+        """
+        Repeated fan-outs reuse each agent's connection
+        """
+        connections = []
+        server = await agent_server(connections=connections)
+        (registry, fanout) = new_fanout()
+        agent_id = add_agent(registry, port_of(server))
+
+        for hand in range(5):
+            result = await fanout.send([agent_id], {"hand": hand})
+            assert result.responses[agent_id] == {"echo": {"hand": hand}}
+        await fanout.aclose()
+        server.close()
+
+        assert len(connections) == 1
+        assert fanout.get_stats()["sent"] == 5
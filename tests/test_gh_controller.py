@@ -0,0 +1,251 @@
+import roker.controllers.gh_controller as g
+from roker.controllers.db_controller import DB_Controller
+import asyncio
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO = "https://github.com/owner/repo"
+FILES = {
+    "/owner/repo/refs/heads/main/teamname": b"the team",
+    "/owner/repo/refs/heads/main/teammembers": b"alice, bob",
+    "/owner/long/refs/heads/main/teamname": b"x" * 1000,
+    "/owner/long/refs/heads/main/teammembers": b"x" * 1000,
+}
+# Seconds the server waits before answering /owner/slow/...
+SLOW = 0.2
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: list = []
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.client_address[1],
+                                 time.monotonic()))
+        if self.path.startswith("/owner/slow/"):
+            time.sleep(SLOW)
+        if self.path.startswith("/owner/down/"):
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{hash(body)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(
+        target=httpd.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class Test_GHController:
+    def test_parse_gh_url(self):
+        """
+        Repo urls map to the raw content of their main branch
+        """
+        assert g.parse_gh_url(REPO, "http://raw") == \
+            "http://raw/owner/repo/refs/heads/main/"
+        assert g.parse_gh_url("https://github.com/owner") == ""
+
+    @pytest.mark.asyncio
+    async def test_metadata(self, server):
+        """
+        Both files are fetched, concurrently
+        """
+        gh = g.GHController(base_url=server)
+        meta = await gh.get_gh_metadata(REPO)
+        await gh.aclose()
+
+        assert meta.team_name == g.GHResponse(g.GH_SC.OK, "the team")
+        assert meta.team_members == g.GHResponse(g.GH_SC.OK, "alice, bob")
+
+    @pytest.mark.asyncio
+    async def test_concurrent(self, server):
+        """
+        Slow files are waited on side by side, not one after the other
+        """
+        gh = g.GHController(base_url=server)
+        start = time.monotonic()
+        await gh.get_gh_metadata("https://github.com/owner/slow")
+        elapsed = time.monotonic() - start
+        await gh.aclose()
+
+        assert len(Handler.requests) == 2
+        assert elapsed < SLOW * 2
+
+    @pytest.mark.asyncio
+    async def test_keep_alive(self, server):
+        """
+        Sequential requests reuse the pooled connection
+        """
+        gh = g.GHController(base_url=server, cache_ttl=0, cache_stale=0)
+        for _ in range(3):
+            await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+
+        assert len({port for (_, port, _) in Handler.requests}) == 1
+
+    @pytest.mark.asyncio
+    async def test_errors(self, server):
+        """
+        Missing files, oversized files and bad urls map to status codes
+        """
+        gh = g.GHController(base_url=server)
+
+        meta = await gh.get_gh_metadata("https://github.com/owner/missing")
+        assert meta.team_name.status == g.GH_SC.HTTP_ERROR
+        assert meta.team_members.status == g.GH_SC.HTTP_ERROR
+
+        meta = await gh.get_gh_metadata("https://github.com/owner/long")
+        assert meta.team_name.status == g.GH_SC.TEAM_NAME_TOO_LONG
+        assert meta.team_members.status == g.GH_SC.TEAM_MEMBER_TOO_LONG
+
+        res = await gh.get_gh_team_name("not a url")
+        assert res.status == g.GH_SC.BAD_URL
+        await gh.aclose()
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, server):
+        """
+        A server slower than the read timeout is reported as a timeout
+        """
+        gh = g.GHController(base_url=server, read_timeout=SLOW / 4)
+        res = await gh.get_gh_team_name("https://github.com/owner/slow")
+        await gh.aclose()
+
+        assert res.status == g.GH_SC.TIMEOUT
+
+    @pytest.mark.asyncio
+    async def test_connect_failure(self):
+        """
+        Nothing listening is a failed request
+        """
+        gh = g.GHController(base_url="http://127.0.0.1:1")
+        res = await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+
+        assert res.status == g.GH_SC.REQ_FAIL_H
+
+
+class Test_GHCache:
+    @pytest.mark.asyncio
+    async def test_fresh(self, server):
+        """
+        Fresh files are served without a request
+        """
+        gh = g.GHController(base_url=server)
+        for _ in range(3):
+            res = await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+
+        assert res == g.GHResponse(g.GH_SC.OK, "the team")
+        assert len(Handler.requests) == 1
+        assert gh.get_stats()["hits"] == 2
+
+    @pytest.mark.asyncio
+    async def test_revalidate(self, server):
+        """
+        Expired files are revalidated with their ETag and cost a 304
+        """
+        gh = g.GHController(base_url=server, cache_ttl=0, cache_stale=0)
+        await gh.get_gh_team_name(REPO)
+        res = await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+
+        assert res == g.GHResponse(g.GH_SC.OK, "the team")
+        assert len(Handler.requests) == 2
+        assert gh.get_stats()["not_modified"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self, server):
+        """
+        Stale files are served at once and revalidated in the background
+        """
+        gh = g.GHController(base_url=server, cache_ttl=0, cache_stale=60)
+        await gh.get_gh_team_name("https://github.com/owner/slow")
+        start = time.monotonic()
+        await gh.get_gh_team_name("https://github.com/owner/slow")
+        elapsed = time.monotonic() - start
+
+        assert elapsed < SLOW / 2
+        assert gh.get_stats()["stale_hits"] == 1
+        assert gh.get_stats()["inflight"] == 1
+        await gh.aclose()
+
+    @pytest.mark.asyncio
+    async def test_single_flight(self, server):
+        """
+        Concurrent lookups of one file share a single request
+        """
+        gh = g.GHController(base_url=server)
+        await asyncio.gather(*[
+            gh.get_gh_team_name("https://github.com/owner/slow")
+            for _ in range(5)])
+        await gh.aclose()
+
+        assert len(Handler.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_if_error(self, server):
+        """
+        A cached copy is served when revalidation fails, but server errors
+        are never cached themselves
+        """
+        url = server + "/owner/down/refs/heads/main/teamname"
+        gh = g.GHController(base_url=server, cache_ttl=0, cache_stale=0)
+        gh._store(url, g._CachedFile(200, "cached", '"x"', None, 0.0))
+        res = await gh.get_gh_team_name("https://github.com/owner/down")
+        assert res == g.GHResponse(g.GH_SC.OK, "cached")
+
+        res = await gh.get_gh_team_member_names(
+            "https://github.com/owner/down")
+        assert res.status == g.GH_SC.HTTP_ERROR
+        assert len(gh._cache) == 1
+        await gh.aclose()
+
+    @pytest.mark.asyncio
+    async def test_persisted(self, server):
+        """
+        Cached files survive a restart through sqlite
+        """
+        db = DB_Controller(in_memory_db=True)
+        db.connect()
+        gh = g.GHController(base_url=server, db=db)
+        await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+
+        gh = g.GHController(base_url=server, db=db)
+        res = await gh.get_gh_team_name(REPO)
+        await gh.aclose()
+        db.close()
+
+        assert res == g.GHResponse(g.GH_SC.OK, "the team")
+        assert len(Handler.requests) == 1
@@ -0,0 +1,232 @@
+import roker.controllers.db_controller as d
+import roker.controllers.health_controller as h
+import roker.controllers.registry_controller as r
+import asyncio
+import pytest
+import socket
+from datetime import datetime
+from roker.controllers.event_controller import ContainerState
+
+
+def free_port() -> int:
+    """A port nothing is listening on"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def tcp_server() -> asyncio.Server:
+    """Holds connections open, like an agent listening on its port"""
+    async def handle(reader, writer):
+        await reader.read()
+        writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def http_server(status: bytes) -> asyncio.Server:
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def add_agent(registry: r.AgentRegistry, port: int) -> int:
+    (_, agent_id) = registry.add_new_agent(d.Agent(
+        container_name=f"name {port}",
+        container_id=f"container {port}",
+        port_number=port,
+        start_time=datetime.now()))
+    return agent_id
+
+
+def new_health(**kwargs) -> (r.AgentRegistry, h.HealthController):
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    registry = r.AgentRegistry(db)
+    kwargs.setdefault("interval", 0.02)
+    kwargs.setdefault("timeout", 0.5)
+    kwargs.setdefault("flush_interval", 0.01)
+    kwargs.setdefault("path", "")
+    return (registry, h.HealthController(registry, **kwargs))
+
+
+async def until(check, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.01)):
+        if check():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+class Test_LatencyHistogram:
+    def test_buckets(self):
+        """
+        Latencies are counted in their bucket and quantiles read back the
+        bucket bounds
+        """
+        hist = h.LatencyHistogram()
+        assert hist.quantile(0.5) is None
+        for seconds in (0.0005, 0.0005, 0.003, 0.2, 60):
+            hist.observe(seconds)
+
+        assert hist.counts[0] == 2
+        assert hist.counts[-1] == 1
+        assert hist.quantile(0.4) == 0.001
+        assert hist.quantile(0.6) == 0.005
+        assert hist.quantile(0.8) == 0.25
+        assert hist.quantile(1.0) is None
+        assert hist.to_dict()["total"] == 5
+
+
+class Test_HealthController:
+    @pytest.mark.asyncio
+    async def test_tcp(self):
+        """
+        Agents listening on their port turn active, others inactive. A
+        port whose connections are closed at once, like docker's proxy
+        does for an agent that is not listening, counts as down.
+        """
+        server = await tcp_server()
+        proxy = await asyncio.start_server(
+            lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        (registry, health) = new_health(fall=2)
+        up = add_agent(registry, server.sockets[0].getsockname()[1])
+        down = add_agent(registry, free_port())
+        proxied = add_agent(registry, proxy.sockets[0].getsockname()[1])
+        for agent_id in (up, down, proxied):
+            agent = registry.get_agent_data(agent_id)[1]
+            health.watch(agent_id, agent.container_id, agent.port_number)
+
+        health.start()
+        await until(lambda: registry.get_agent_data(down)[1].active is False
+                    and registry.get_agent_data(proxied)[1].active is False
+                    and registry.get_agent_data(up)[1].active)
+        await health.stop()
+        server.close()
+        proxy.close()
+
+        assert health.get_health(up)["healthy"]
+        assert health.get_health(up)["latency"]["total"] > 0
+        assert health.get_health(down)["healthy"] is False
+        assert health.get_health(down)["failures"] >= 2
+        assert health.get_stats()["flushes"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_http(self):
+        """
+        With a path set, only a 2xx answer passes
+        """
+        ok = await http_server(b"200 OK")
+        bad = await http_server(b"503 Service Unavailable")
+        (registry, health) = new_health(path="/health_check", fall=1)
+        ids = []
+        for server in (ok, bad):
+            port = server.sockets[0].getsockname()[1]
+            ids.append(add_agent(registry, port))
+            health.watch(ids[-1], f"container {port}", port)
+
+        health.start()
+        await until(lambda: all(
+            health.get_health(agent_id)["healthy"] is not None
+            for agent_id in ids))
+        await health.stop()
+        ok.close()
+        bad.close()
+
+        assert health.get_health(ids[0])["healthy"]
+        assert health.get_health(ids[1])["healthy"] is False
+
+    @pytest.mark.asyncio
+    async def test_max_probes(self):
+        """
+        No more than `max_probes` probes are ever in flight
+        """
+        in_flight = 0
+        most = 0
+
+        async def handle(reader, writer):
+            nonlocal in_flight, most
+            in_flight += 1
+            most = max(most, in_flight)
+            await asyncio.sleep(0.02)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            in_flight -= 1
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        (registry, health) = new_health(path="/", max_probes=3)
+        for i in range(20):
+            health.watch(i, f"container {i}", port)
+
+        health.start()
+        await until(lambda: health.get_stats()["probes"] >= 20)
+        await health.stop()
+        server.close()
+
+        assert most == 3
+
+    @pytest.mark.asyncio
+    async def test_wait_healthy(self):
+        """
+        Callers can wait for an agent's first passing probe
+        """
+        server = await tcp_server()
+        port = server.sockets[0].getsockname()[1]
+        (registry, health) = new_health()
+        agent_id = add_agent(registry, port)
+        health.start()
+
+        waiting = asyncio.create_task(health.wait_healthy(agent_id, 1))
+        await asyncio.sleep(0.05)
+        health.watch(agent_id, f"container {port}", port)
+        assert await waiting
+        assert await health.wait_healthy(agent_id, 0)
+
+        assert not await health.wait_healthy(agent_id + 1, 0.05)
+        await health.stop()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_on_state(self):
+        """
+        Running agent containers are probed; stopped ones, and containers
+        that are not agents, are not
+        """
+        (registry, health) = new_health()
+        agent_id = add_agent(registry, 20001)
+
+        health.on_state(ContainerState("container 20001", "running"))
+        health.on_state(ContainerState("pooled", "running"))
+        assert health.get_stats()["targets"] == 1
+        assert health.get_health(agent_id)["port"] == 20001
+
+        health.on_state(ContainerState("container 20001", "exited"))
+        assert health.get_stats()["targets"] == 0
+        assert health.get_health(agent_id) is None
+
+    @pytest.mark.asyncio
+    async def test_hold(self):
+        """
+        Events of a held agent are ignored until it is released
+        """
+        (registry, health) = new_health(interval=60)
+        agent_id = add_agent(registry, 20001)
+        health.watch(agent_id, "container 20001", 20001)
+        version = health._targets[agent_id].version
+
+        health.hold(agent_id)
+        health.hold(agent_id)
+        health.on_state(ContainerState("container 20001", "exited"))
+        health.on_state(ContainerState("container 20001", "running"))
+        assert health._targets[agent_id].version == version
+
+        health.release(agent_id)
+        health.on_state(ContainerState("container 20001", "running"))
+        assert health._targets[agent_id].version == version
+
+        health.release(agent_id)
+        health.on_state(ContainerState("container 20001", "exited"))
+        assert health.get_health(agent_id) is None
@@ -0,0 +1,149 @@
+import roker.controllers.db_controller as d
+import roker.controllers.job_controller as j
+import asyncio
+import pytest
+
+
+def new_jobs(runners: dict, **kwargs) -> (d.DB_Controller, j.JobController):
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    return (db, j.JobController(db, runners, **kwargs))
+
+
+async def launch(params: dict, progress) -> (bool, dict | str):
+    """Goes through two stages, then fails if asked to"""
+    progress("admission", queue_position=1)
+    await asyncio.sleep(0.01)
+    progress("create")
+    await asyncio.sleep(0.01)
+    if params.get("fail"):
+        return (False, "NO_CAPACITY")
+    return (True, {"port": params["port"]})
+
+
+async def finished(jc: j.JobController, job_id: int) -> dict:
+    async for job in jc.follow(job_id):
+        pass
+    return job
+
+
+class Test_JobController:
+    @pytest.mark.asyncio
+    async def test_run(self):
+        """
+        A job goes through its stages and its result is kept in sqlite
+        """
+        (db, jc) = new_jobs({"launch": launch})
+        jc.start()
+        (status, job_id) = jc.submit("launch", {"port": 10000})
+        assert status == j.JOB_SC.OK
+        assert jc.get_job(job_id)["status"] == "queued"
+
+        job = await finished(jc, job_id)
+        assert job["status"] == "done"
+        assert job["result"] == {"port": 10000}
+        assert [stage for (stage, _) in job["stages"]] == \
+            ["queued", "running", "admission", "create", "done"]
+
+        # Gone from memory, served from the database
+        assert job_id not in jc._jobs
+        assert jc.get_job(job_id)["result"] == {"port": 10000}
+        await jc.stop()
+
+    @pytest.mark.asyncio
+    async def test_failed(self):
+        """
+        Runners that fail or raise fail their job with the reason
+        """
+        async def crash(params, progress):
+            raise RuntimeError("daemon went away")
+
+        (_, jc) = new_jobs({"launch": launch, "crash": crash})
+        jc.start()
+        (_, failed) = jc.submit("launch", {"port": 1, "fail": True})
+        (_, crashed) = jc.submit("crash", {})
+
+        assert (await finished(jc, failed))["error"] == "NO_CAPACITY"
+        assert (await finished(jc, crashed))["error"] == "daemon went away"
+        assert jc.get_stats()["failed"] == 2
+        await jc.stop()
+
+    @pytest.mark.asyncio
+    async def test_long_poll(self):
+        """
+        `wait` returns as soon as the job changes, or after the timeout
+        """
+        (_, jc) = new_jobs({"launch": launch})
+        (_, job_id) = jc.submit("launch", {"port": 1})
+        version = jc.get_job(job_id)["version"]
+
+        job = await jc.wait(job_id, version, timeout=0.01)
+        assert job["version"] == version
+
+        jc.start()
+        job = await asyncio.wait_for(jc.wait(job_id, version, 5), 1)
+        assert job["version"] != version
+        assert job["status"] == "running"
+        await jc.stop()
+
+    @pytest.mark.asyncio
+    async def test_follow(self):
+        """
+        Followers see the queue position a stage reports
+        """
+        (_, jc) = new_jobs({"launch": launch})
+        jc.start()
+        (_, job_id) = jc.submit("launch", {"port": 1})
+
+        seen = [job async for job in jc.follow(job_id)]
+        assert {"queue_position": 1} in [job["progress"] for job in seen]
+        assert seen[-1]["status"] == "done"
+        await jc.stop()
+
+    @pytest.mark.asyncio
+    async def test_priority(self):
+        """
+        With the workers busy, higher priority jobs are run first
+        """
+        order = []
+
+        async def record(params, progress):
+            order.append(params["name"])
+            await asyncio.sleep(0.01)
+            return (True, {})
+
+        (_, jc) = new_jobs({"record": record}, workers=1)
+        ids = [jc.submit("record", {"name": name}, priority)[1]
+               for (name, priority) in (("a", 0), ("b", 0), ("c", 5))]
+        jc.start()
+        for job_id in ids:
+            await finished(jc, job_id)
+        assert order == ["c", "a", "b"]
+        await jc.stop()
+
+    @pytest.mark.asyncio
+    async def test_rejected(self):
+        """
+        Unknown kinds and jobs past the queue limit are refused
+        """
+        (_, jc) = new_jobs({"launch": launch}, queue_limit=1)
+        assert jc.submit("build", {})[0] == j.JOB_SC.BAD_KIND
+        assert jc.submit("launch", {"port": 1})[0] == j.JOB_SC.OK
+        assert jc.submit("launch", {"port": 2})[0] == j.JOB_SC.QUEUE_FULL
+        assert jc.get_job(99) is None
+
+    @pytest.mark.asyncio
+    async def test_interrupted(self):
+        """
+        Jobs left unfinished are failed on stop, and on the next start
+        """
+        (db, jc) = new_jobs({"launch": launch})
+        (_, job_id) = jc.submit("launch", {"port": 1})
+        await jc.stop()
+        assert jc.get_job(job_id)["error"] == "roker shut down"
+
+        db.add_job("launch", {"port": 2}, 0)
+        later = j.JobController(db, {"launch": launch})
+        later.start()
+        assert later.get_job(job_id + 1)["status"] == "failed"
+        await later.stop()
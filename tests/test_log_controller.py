@@ -0,0 +1,312 @@
+import roker.controllers.log_controller as l
+import docker
+import pytest
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeStream:
+    def __init__(self, chunks: list[bytes]):
+        self._chunks = iter(chunks)
+        self.pulled = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if self.closed:
+            raise ValueError("read of closed stream")
+        self.pulled += 1
+        return next(self._chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(chunks: list[bytes] | None = None, calls: list = None):
+    def logs(container_id, **kwargs):
+        if container_id == "missing":
+            raise docker.errors.NotFound("no such container")
+        if calls is not None:
+            calls.append(kwargs)
+        return FakeStream(chunks or [])
+    return SimpleNamespace(api=SimpleNamespace(logs=logs))
+
+
+class BlockingLogs:
+    """Log streams that give one line, then block until released"""
+
+    def __init__(self):
+        self.streams: list[tuple[str, threading.Event]] = []
+
+    def logs(self, container_id, **kwargs):
+        release = threading.Event()
+        self.streams.append((container_id, release))
+        line = f"1970-01-01T00:00:0{len(self.streams)}Z line\n".encode()
+
+        def chunks():
+            yield line
+            release.wait(5)
+        stream = FakeStream([])
+        stream._chunks = chunks()
+        stream.close = release.set
+        return stream
+
+
+def wait_until(check) -> bool:
+    for _ in range(400):
+        if check():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class Test_LogController:
+    @pytest.mark.asyncio
+    async def test_stream(self):
+        """
+        Chunks come through in order and the stream closes at its end
+        """
+        calls = []
+        lc = l.LogController(fake_client([b"a\n", b"b\n"], calls))
+        (status, stream) = await lc.open("c", tail=10, since=5)
+        assert status == l.LOG_SC.OK
+        assert calls[0]["tail"] == 10
+        assert calls[0]["since"] == 5
+        assert calls[0]["stream"]
+
+        assert [chunk async for chunk in stream] == [b"a\n", b"b\n"]
+        assert stream._stream.closed
+        assert lc.get_open() == 0
+
+    @pytest.mark.asyncio
+    async def test_pull_based(self):
+        """
+        Chunks are only read from the daemon as they are consumed
+        """
+        lc = l.LogController(fake_client([b"x"] * 100))
+        (_, stream) = await lc.open("c", follow=True)
+
+        assert await stream.__anext__() == b"x"
+        assert await stream.__anext__() == b"x"
+        assert stream._stream.pulled == 2
+
+        stream.close()
+        assert stream._stream.closed
+        assert lc.get_open() == 0
+        # Closing twice does not hand back a second slot
+        stream.close()
+        assert lc.get_open() == 0
+
+    @pytest.mark.asyncio
+    async def test_max_streams(self):
+        """
+        Streams past `max_streams` are refused until one closes
+        """
+        lc = l.LogController(fake_client([b"x"]), max_streams=1)
+        (_, stream) = await lc.open("c")
+
+        (status, _) = await lc.open("c")
+        assert status == l.LOG_SC.TOO_MANY_STREAMS
+
+        stream.close()
+        (status, _) = await lc.open("c")
+        assert status == l.LOG_SC.OK
+
+    @pytest.mark.asyncio
+    async def test_not_found(self):
+        """
+        Unknown containers are reported and do not hold a slot
+        """
+        lc = l.LogController(fake_client())
+        (status, _) = await lc.open("missing")
+
+        assert status == l.LOG_SC.NOT_FOUND
+        assert lc.get_open() == 0
+
+
+SECOND = 1_000_000_000
+
+
+def new_store(tmp_path, **kwargs) -> l.LogStore:
+    kwargs.setdefault("frame_bytes", 64)
+    return l.LogStore(root_dir=str(tmp_path), **kwargs)
+
+
+class Test_LogStore:
+    def test_parse_docker_timestamp(self):
+        """
+        docker's RFC 3339 timestamps parse to unix nanoseconds
+        """
+        assert l.parse_docker_timestamp(
+            b"1970-01-01T00:00:01.000000002Z") == SECOND + 2
+        assert l.parse_docker_timestamp(
+            b"1970-01-01T00:00:01.5Z") == SECOND + SECOND // 2
+        assert l.parse_docker_timestamp(b"1970-01-01T00:00:01Z") == SECOND
+        assert l.parse_docker_timestamp(b"not a timestamp") is None
+
+    def test_read_window(self, tmp_path):
+        """
+        Reads return only the lines inside the window, in order
+        """
+        store = new_store(tmp_path)
+        for i in range(100):
+            store.append("c", i * SECOND, f"line {i}".encode())
+
+        lines = list(store.read("c", since=10 * SECOND, until=12 * SECOND))
+        assert lines == [(10 * SECOND, b"line 10"), (11 * SECOND, b"line 11"),
+                         (12 * SECOND, b"line 12")]
+        assert len(list(store.read("c"))) == 100
+        assert list(store.read("other")) == []
+
+    def test_seek_skips_frames(self, tmp_path):
+        """
+        The sparse index lets a read start at the frame holding `since`
+        """
+        store = new_store(tmp_path)
+        for i in range(100):
+            store.append("c", i * SECOND, f"line {i}".encode())
+        store.flush("c")
+
+        offset = store._seek("c", 0, 90 * SECOND)
+        assert offset > 0
+        frames = list(store._frames("c", 0, offset))
+        assert frames[0][0] <= 90 * SECOND <= frames[0][1]
+
+    def test_rotation_and_retention(self, tmp_path):
+        """
+        Segments rotate at `segment_bytes` and the oldest are deleted past
+        `retention_bytes`, while the newest lines stay readable
+        """
+        store = new_store(tmp_path, segment_bytes=200, retention_bytes=600)
+        base = time.time_ns() - 1000 * SECOND
+        for i in range(1000):
+            store.append("c", base + i * SECOND, f"line {i:04d}".encode() * 4)
+        store.flush("c")
+
+        segments = store._segments("c")
+        assert len(segments) > 1
+        assert sum(size for (_, size) in segments) <= 600 + 200
+        assert store.get_stats()["segments_deleted"] > 0
+
+        lines = list(store.read("c", since=base + 990 * SECOND))
+        assert [(ts - base) // SECOND for (ts, _) in lines] == list(
+            range(990, 1000))
+
+    def test_retention_age(self, tmp_path):
+        """
+        Segments older than `retention_age` are deleted
+        """
+        store = new_store(tmp_path, segment_bytes=1, retention_age=60)
+        store.append("c", 1 * SECOND, b"ancient")
+        store.flush("c")
+        store.append("c", 2 * SECOND, b"also ancient")
+        store.close("c")
+        store.enforce_retention("c")
+
+        # Only the final segment, judged by its modification time, is left
+        assert [line for (_, line) in store.read("c")] == [b"also ancient"]
+
+    def test_torn_frame(self, tmp_path):
+        """
+        A frame cut short by a crash ends the segment instead of failing
+        """
+        store = new_store(tmp_path)
+        store.append("c", SECOND, b"kept")
+        store.close("c")
+        (start, _) = store._segments("c")[0]
+        with open(store._segment_path("c", start) + ".seg", "ab") as f:
+            f.write(l.FRAME_HEADER.pack(2 * SECOND, 2 * SECOND, 100) + b"x")
+
+        assert list(new_store(tmp_path).read("c")) == [(SECOND, b"kept")]
+
+    def test_last_timestamp(self, tmp_path):
+        """
+        The newest stored line is found again after a restart
+        """
+        store = new_store(tmp_path)
+        store.append("c", 5 * SECOND, b"a")
+        store.append("c", 7 * SECOND, b"b")
+        assert store.last_timestamp("c") == 7 * SECOND
+        store.stop()
+
+        assert new_store(tmp_path).last_timestamp("c") == 7 * SECOND
+        assert new_store(tmp_path).last_timestamp("other") == 0
+
+
+class Test_LogShipper:
+    def test_ship(self, tmp_path):
+        """
+        Followed output is split into timestamped lines and stored, skipping
+        lines stored by an earlier run
+        """
+        store = new_store(tmp_path)
+        store.append("c", 1 * SECOND, b"old")
+
+        chunks = [b"1970-01-01T00:00:01Z old\n1970-01-01T00:00:02Z ne",
+                  b"w\n1970-01-01T00:00:03Z last"]
+        calls = []
+        shipper = l.LogShipper(fake_client(chunks, calls), store)
+        shipper.on_state(l.ContainerState(container_id="c", status="running"))
+        for _ in range(200):
+            if shipper.get_shipping() == 0:
+                break
+            time.sleep(0.005)
+
+        assert calls[0]["since"] == 1
+        assert calls[0]["follow"] and calls[0]["timestamps"]
+        assert [line for (_, line) in store.read("c")] == [
+            b"old", b"new", b"last"]
+        shipper.stop()
+
+    def test_ship_refused(self, tmp_path):
+        """
+        Containers past `max_streams` are refused and counted, and shipped
+        once a stream ends
+        """
+        api = BlockingLogs()
+        shipper = l.LogShipper(
+            SimpleNamespace(api=api), new_store(tmp_path), max_streams=1)
+
+        assert shipper.ship("a")
+        assert not shipper.ship("b")
+        assert not shipper.ship("b")
+        assert shipper.get_stats()["pending"] == 1
+        assert shipper.get_stats()["refusals"] == 1
+
+        assert wait_until(lambda: len(api.streams) == 1)
+        api.streams[0][1].set()
+        assert wait_until(lambda: len(api.streams) == 2)
+        assert api.streams[1][0] == "b"
+        assert shipper.get_stats()["pending"] == 0
+
+        api.streams[1][1].set()
+        shipper.stop()
+
+    def test_ship_restarted(self, tmp_path):
+        """
+        A container restarted while its last run is still being shipped is
+        shipped again once that run's stream ends
+        """
+        api = BlockingLogs()
+        shipper = l.LogShipper(SimpleNamespace(api=api), new_store(tmp_path))
+
+        running = l.ContainerState(container_id="c", status="running")
+        shipper.on_state(running)
+        assert wait_until(lambda: len(api.streams) == 1)
+        # Seen running twice, e.g. by the seed and an event: shipped once
+        shipper.on_state(running)
+        shipper.on_state(l.ContainerState(container_id="c", status="exited"))
+        shipper.on_state(running)
+        assert shipper.get_stats()["pending"] == 1
+
+        api.streams[0][1].set()
+        assert wait_until(lambda: len(api.streams) == 2)
+        assert shipper.get_stats()["refusals"] == 0
+
+        api.streams[1][1].set()
+        assert wait_until(lambda: shipper.get_shipping() == 0)
+        assert len(api.streams) == 2
+        shipper.stop()
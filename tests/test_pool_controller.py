@@ -0,0 +1,132 @@
+import roker.controllers.pool_controller as p
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+MB = 1024 ** 2
+
+
+def make_pool(spawn_delay: float = 0, **kwargs) -> (
+        p.PoolController, list, list):
+    spawned = []
+    removed = []
+
+    async def spawn():
+        await asyncio.sleep(spawn_delay)
+        pooled = p.PooledContainer(
+            container=SimpleNamespace(id=f"c{len(spawned)}"),
+            port=len(spawned))
+        spawned.append(pooled)
+        return pooled
+
+    async def remove(pooled):
+        removed.append(pooled)
+
+    pool = p.PoolController(
+        spawn=spawn,
+        remove=remove,
+        container_mem=128 * MB,
+        refill_interval=0.01,
+        **kwargs
+    )
+    return (pool, spawned, removed)
+
+
+async def wait_for_idle(pool: p.PoolController, idle: int):
+    for _ in range(100):
+        if pool.get_stats()["idle"] == idle:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"pool never reached {idle} idle containers")
+
+
+class Test_PoolController:
+
+    def test_max_size_respects_mem_budget(self):
+        """
+        Ensures the idle memory budget caps the pool below its target
+        """
+        (pool, _, _) = make_pool(target_size=10, idle_mem_budget=512 * MB)
+        assert pool.get_max_size() == 4
+
+        (pool, _, _) = make_pool(target_size=2, idle_mem_budget=512 * MB)
+        assert pool.get_max_size() == 2
+
+    @pytest.mark.asyncio
+    async def test_fills_and_refills(self):
+        """
+        Ensures the pool fills to its max size and refills after a hit
+        """
+        (pool, spawned, removed) = make_pool(
+            target_size=3, idle_mem_budget=1024 * MB)
+
+        await pool.start()
+        await wait_for_idle(pool, 3)
+
+        pooled = pool.acquire()
+        assert pooled is spawned[0]
+        await wait_for_idle(pool, 3)
+        assert len(spawned) == 4
+
+        stats = pool.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 0
+
+        await pool.stop()
+        assert len(removed) == 3
+        assert pool.get_stats()["idle"] == 0
+
+    @pytest.mark.asyncio
+    async def test_miss_when_empty(self):
+        """
+        Ensures an empty or disabled pool counts a miss and returns None
+        """
+        (pool, spawned, _) = make_pool(target_size=0, idle_mem_budget=0)
+
+        await pool.start()
+        assert pool.acquire() is None
+        assert pool.get_stats()["misses"] == 1
+        assert len(spawned) == 0
+        await pool.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_while_spawning(self):
+        """
+        Ensures containers still being spawned on stop are removed once up,
+        not leaked
+        """
+        (pool, spawned, removed) = make_pool(
+            spawn_delay=0.05, target_size=2, idle_mem_budget=1024 * MB)
+
+        await pool.start()
+        await asyncio.sleep(0.01)
+        assert pool.get_stats()["spawning"] == 2
+
+        await pool.stop()
+        assert len(spawned) == 2
+        assert removed == spawned
+        assert pool.get_stats()["idle"] == 0
+
+    @pytest.mark.asyncio
+    async def test_dead_containers(self):
+        """
+        Ensures idle containers that died are removed and replaced, whether
+        an event reports them or they are found dead when handed out
+        """
+        dead = {"c0"}
+        (pool, spawned, removed) = make_pool(
+            target_size=2, idle_mem_budget=1024 * MB,
+            alive=lambda pooled: pooled.container.id not in dead)
+
+        await pool.start()
+        await wait_for_idle(pool, 2)
+        assert pool.acquire() is spawned[1]
+        await asyncio.sleep(0)
+        assert removed == [spawned[0]]
+
+        await wait_for_idle(pool, 2)
+        pool.evict(spawned[2].container.id)
+        await wait_for_idle(pool, 2)
+        assert removed == [spawned[0], spawned[2]]
+        assert pool.get_stats()["dead"] == 2
+        await pool.stop()
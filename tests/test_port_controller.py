@@ -1,8 +1,32 @@
 import roker.controllers.port_controller as pc
+import roker.controllers.db_controller as d
+import asyncio
 import socket
+import threading
 import pytest
 
 
+def is_free(port: int) -> bool:
+    with socket.socket() as s:
+        try:
+            s.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+
+def free_range(size: int) -> (int, int):
+    """
+    Finds a run of `size` ports nothing is using. The run is kept below
+    the ephemeral range, where other tests' outgoing connections would
+    take ports from under it.
+    """
+    start = 20000
+    while not all(is_free(port) for port in range(start, start + size)):
+        start += size
+    return (start, start + size - 1)
+
+
 class Test_PortController:
 
     @pytest.mark.asyncio
@@ -15,4 +39,141 @@ class Test_PortController:
         print(res)
         assert res.status == pc.P_SC.OK
         assert isinstance(res.port, int)
-        assert isinstance(res.socket, socket.socket)
+
+    @pytest.mark.asyncio
+    async def test_reserve_off_loop(self):
+        """
+        Ensures the async API probes ports and records leases off the event
+        loop thread
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        db.connect()
+        (start, end) = free_range(2)
+        PC = pc.PortController(db, range_start=start, range_end=end)
+
+        threads = []
+        is_bindable = PC._is_bindable
+
+        def probe(port):
+            threads.append(threading.get_ident())
+            return is_bindable(port)
+
+        PC._is_bindable = probe
+        res = await PC.get_available_TCP_port()
+        assert res.status == pc.P_SC.OK
+        assert threads != [] and threading.get_ident() not in threads
+        assert res.port in dict(db.get_port_leases()[1])
+
+    def test_reserve_within_range(self):
+        """
+        Ensures ports come from the configured range until it runs out
+        """
+        (start, end) = free_range(3)
+        PC = pc.PortController(range_start=start, range_end=end)
+
+        ports = [PC.reserve().port for _ in range(3)]
+        assert sorted(ports) == [start, start + 1, start + 2]
+
+        res = PC.reserve()
+        assert res.status == pc.P_SC.FAILED_TO_FIND_PORT
+        assert res.port == -1
+
+    def test_release_and_reuse(self):
+        """
+        Ensures a released port goes back to the pool and double release
+        is rejected
+        """
+        (start, end) = free_range(1)
+        PC = pc.PortController(range_start=start, range_end=end)
+
+        port = PC.reserve().port
+        assert PC.release(port) == pc.P_SC.OK
+        assert PC.release(port) == pc.P_SC.NOT_LEASED
+        assert PC.release(end + 1) == pc.P_SC.PORT_OUT_OF_RANGE
+        assert PC.reserve().port == port
+
+    def test_release_container(self):
+        """
+        Ensures the port bound to a container is released with it
+        """
+        (start, end) = free_range(2)
+        PC = pc.PortController(range_start=start, range_end=end)
+
+        port = PC.reserve().port
+        assert PC.bind(port, "container") == pc.P_SC.OK
+        assert PC.get_port("container") == port
+        assert PC.get_leases() == {port: "container"}
+
+        assert PC.release_container("container") == pc.P_SC.OK
+        assert PC.get_port("container") is None
+        assert PC.get_leases() == {}
+        assert PC.release_container("container") == pc.P_SC.NOT_LEASED
+
+    @pytest.mark.asyncio
+    async def test_no_double_assignment(self):
+        """
+        Ensures concurrent reservations never get the same port
+        """
+        (start, end) = free_range(50)
+        PC = pc.PortController(range_start=start, range_end=end)
+
+        async def reserve():
+            return await asyncio.to_thread(PC.reserve)
+
+        res = await asyncio.gather(*[reserve() for _ in range(50)])
+        ports = [r.port for r in res]
+        assert len(set(ports)) == 50
+        assert all(r.status == pc.P_SC.OK for r in res)
+
+    def test_leases_persisted(self):
+        """
+        Ensures a new PortController restores bound leases from the DB
+        and reclaims ports that were never bound to a container
+        """
+        db = d.DB_Controller(in_memory_db=True)
+        assert db.connect() == d.DB_connect_status.OK
+        (start, end) = free_range(2)
+
+        PC = pc.PortController(db, range_start=start, range_end=end)
+        bound = PC.reserve().port
+        PC.bind(bound, "container")
+        unbound = PC.reserve().port
+
+        PC = pc.PortController(db, range_start=start, range_end=end)
+        assert PC.get_leases() == {bound: "container"}
+        assert PC.reserve().port == unbound
+        assert PC.reserve().status == pc.P_SC.FAILED_TO_FIND_PORT
+
+    def test_reconcile(self):
+        """
+        Ensures leases of containers that are gone are released
+        """
+        (start, end) = free_range(3)
+        PC = pc.PortController(range_start=start, range_end=end)
+        kept = PC.reserve().port
+        PC.bind(kept, "kept")
+        gone = PC.reserve().port
+        PC.bind(gone, "gone")
+        unbound = PC.reserve().port
+
+        assert PC.reconcile({"kept"}) == [gone]
+        assert PC.get_leases() == {kept: "kept", unbound: None}
+
+    def test_probe_outside_lock(self):
+        """
+        Ensures ports are probed without holding the lock, and busy ones
+        are skipped
+        """
+        (start, end) = free_range(2)
+        PC = pc.PortController(range_start=start, range_end=end)
+        probed = []
+
+        def is_bindable(port):
+            assert not PC._lock.locked()
+            probed.append(port)
+            return port != start
+        PC._is_bindable = is_bindable
+
+        assert PC.reserve().port == start + 1
+        assert probed == [start, start + 1]
+        assert PC.reserve().status == pc.P_SC.FAILED_TO_FIND_PORT
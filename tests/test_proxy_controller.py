@@ -0,0 +1,166 @@
+import roker.controllers.db_controller as d
+import roker.controllers.proxy_controller as p
+import roker.controllers.registry_controller as r
+import asyncio
+import pytest
+import socket
+from datetime import datetime
+
+
+async def agent_server(connections: list | None = None) -> asyncio.Server:
+    """
+    Answers every request with its request line, then its body, keeping
+    the connection open between requests
+    """
+    async def handle(reader, writer):
+        if connections is not None:
+            connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                body = await reader.readexactly(length)
+                out = head.split(b"\r\n")[0] + b"\n" + body
+                writer.write(b"HTTP/1.1 201 Created\r\n"
+                             b"X-Agent: yes\r\n"
+                             b"Content-Length: " + str(len(out)).encode()
+                             + b"\r\n\r\n" + out)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def new_proxy(**kwargs) -> (r.AgentRegistry, p.ProxyController):
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    registry = r.AgentRegistry(db)
+    return (registry, p.ProxyController(registry, **kwargs))
+
+
+def add_agent(registry: r.AgentRegistry, port: int) -> int:
+    (_, agent_id) = registry.add_new_agent(d.Agent(
+        container_name=f"name {port}",
+        container_id=f"container {port}",
+        port_number=port,
+        start_time=datetime.now()))
+    return agent_id
+
+
+async def read(proxy: p.ProxyController, response) -> bytes:
+    try:
+        return b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await proxy.close(response)
+
+
+class Test_ProxyController:
+    @pytest.mark.asyncio
+    async def test_forward(self):
+        """
+        Method, path, query and status come through, hop-by-hop headers do
+        not
+        """
+        server = await agent_server()
+        (registry, proxy) = new_proxy()
+        agent_id = add_agent(registry, server.sockets[0].getsockname()[1])
+
+        (status, response) = await proxy.open(
+            agent_id, "GET", "get_team_name", query="x=1",
+            headers={"connection": "close", "x-client": "a"})
+        assert status == p.PROXY_SC.OK
+        assert response.status_code == 201
+        assert response.headers["x-agent"] == "yes"
+        assert await read(proxy, response) == \
+            b"GET /get_team_name?x=1 HTTP/1.1\n"
+        assert proxy.get_latency(agent_id)["total"] == 1
+        await proxy.aclose()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_stream_body(self):
+        """
+        Request bodies are streamed upstream as they arrive
+        """
+        server = await agent_server()
+        (registry, proxy) = new_proxy()
+        agent_id = add_agent(registry, server.sockets[0].getsockname()[1])
+
+        async def body():
+            for chunk in (b"a" * 10, b"b" * 10):
+                yield chunk
+
+        (_, response) = await proxy.open(
+            agent_id, "POST", "/respond",
+            headers={"content-length": "20"}, body=body())
+        assert (await read(proxy, response)).endswith(b"a" * 10 + b"b" * 10)
+        assert proxy.get_stats()["in_flight"] == 0
+        await proxy.aclose()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_keep_alive(self):
+        """
+        An agent's connection is reused from one request to the next
+        """
+        connections = []
+        server = await agent_server(connections)
+        (registry, proxy) = new_proxy()
+        agent_id = add_agent(registry, server.sockets[0].getsockname()[1])
+
+        for _ in range(5):
+            (_, response) = await proxy.open(agent_id, "GET", "/")
+            await read(proxy, response)
+        await proxy.aclose()
+        server.close()
+
+        assert len(connections) == 1
+
+    @pytest.mark.asyncio
+    async def test_failures(self):
+        """
+        Unknown and unreachable agents are reported
+        """
+        (registry, proxy) = new_proxy()
+        agent_id = add_agent(registry, free_port())
+
+        (status, _) = await proxy.open(9999, "GET", "/")
+        assert status == p.PROXY_SC.NOT_FOUND
+        (status, _) = await proxy.open(agent_id, "GET", "/")
+        assert status == p.PROXY_SC.REQ_FAIL
+        assert proxy.get_stats()["in_flight"] == 0
+        await proxy.aclose()
+
+    @pytest.mark.asyncio
+    async def test_evict(self):
+        """
+        Past `max_agents`, the least recently used idle client is closed
+        """
+        servers = [await agent_server() for _ in range(3)]
+        (registry, proxy) = new_proxy(max_agents=2)
+        ids = [add_agent(registry, server.sockets[0].getsockname()[1])
+               for server in servers]
+
+        (_, busy) = await proxy.open(ids[0], "GET", "/")
+        for agent_id in ids[1:]:
+            (_, response) = await proxy.open(agent_id, "GET", "/")
+            await read(proxy, response)
+
+        # The first agent is still being read from, so the second went
+        assert list(proxy._upstreams) == [ids[0], ids[2]]
+        assert proxy.get_stats()["evicted"] == 1
+        await read(proxy, busy)
+        await proxy.aclose()
+        for server in servers:
+            server.close()
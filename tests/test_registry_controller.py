@@ -0,0 +1,161 @@
+import dataclasses
+import roker.controllers.db_controller as d
+import roker.controllers.registry_controller as r
+from datetime import datetime
+
+
+def new_agent(i: int) -> d.Agent:
+    return d.Agent(
+        container_name=f"name {i}",
+        container_id=f"container {i}",
+        port_number=20000 + i,
+        start_time=datetime.now(),
+        active=True)
+
+
+def new_registry(**kwargs) -> (d.DB_Controller, r.AgentRegistry):
+    db = d.DB_Controller(in_memory_db=True, **kwargs)
+    db.connect()
+    return (db, r.AgentRegistry(db))
+
+
+class Test_AgentRegistry:
+    def test_add_is_written_through(self):
+        """
+        Added agents are in the database and served from the cache
+        """
+        (db, registry) = new_registry()
+        (status, id) = registry.add_new_agent(new_agent(1))
+        assert status == d.DB_new_agent_status.SUBMITTED
+
+        assert db.get_agent_data(id)[1].container_id == "container 1"
+
+        (status, agent) = registry.get_agent_data(id)
+        assert status == d.DB_query_status.SUCCESS
+        assert agent.id == id
+        assert registry.get_stats()["hits"] == 1
+        assert registry.get_stats()["misses"] == 0
+
+    def test_add_active(self):
+        """
+        Agents added active are active in the database and the cache,
+        though the database inserts them inactive
+        """
+        (db, registry) = new_registry()
+        (_, id) = registry.add_new_agent(new_agent(1))
+        (_, ids) = registry.add_new_agents([
+            new_agent(2), dataclasses.replace(new_agent(3), active=False)])
+
+        assert [db.get_agent_data(i)[1].active for i in [id, *ids]] == \
+            [True, True, False]
+        assert [registry.get_agent_data(i)[1].active
+                for i in [id, *ids]] == [True, True, False]
+
+    def test_lookup_keys(self):
+        """
+        Agents can be found by id, container id and port
+        """
+        (_, registry) = new_registry()
+        (_, ids) = registry.add_new_agents([new_agent(1), new_agent(2)])
+
+        assert registry.get_agent_data(ids[1])[1].port_number == 20002
+        assert registry.get_agent_data("container 1")[1].id == ids[0]
+        assert registry.get_by_port(20002).id == ids[1]
+        assert registry.get_stats()["hit_rate"] == 1.0
+
+    def test_miss_falls_through_to_db(self):
+        """
+        Agents only in the database are cached on first lookup
+        """
+        (db, registry) = new_registry()
+        (_, id) = db.add_new_agent(new_agent(1))
+
+        assert registry.get_agent_data(id)[1].container_id == "container 1"
+        assert registry.get_agent_data(id)[1].container_id == "container 1"
+        assert registry.get_stats()["misses"] == 1
+        assert registry.get_stats()["hits"] == 1
+
+        assert registry.get_by_port(20001).id == id
+        assert registry.get_by_port(1) is None
+
+    def test_unknown_agent(self):
+        """
+        Unknown agents return the database's failure
+        """
+        (_, registry) = new_registry()
+        (status, _) = registry.get_agent_data(42)
+        assert status == d.DB_query_status.NO_RESULT
+
+    def test_update_is_written_through(self):
+        """
+        Updates reach the database and the cache, rejected ones neither
+        """
+        (db, registry) = new_registry()
+        (_, id) = registry.add_new_agent(new_agent(1))
+
+        (status, _) = registry.update_agent_data(id, {"team_name": "team"})
+        assert status == d.DB_query_status.SUCCESS
+        assert registry.get_agent_data(id)[1].team_name == "team"
+        assert db.get_agent_data(id)[1].team_name == "team"
+
+        (status, _) = registry.update_agent_data(id, {"not_a_column": 1})
+        assert status != d.DB_query_status.SUCCESS
+        assert registry.get_agent_data(id)[1].team_name == "team"
+
+        registry.update_agents_data([(id, {"port_number": 30000})])
+        assert registry.get_by_port(30000).id == id
+        assert registry.get_agent_data(id)[1].port_number == 30000
+
+    def test_write_behind_update(self):
+        """
+        Queued updates are visible in the cache before they are flushed
+        """
+        (db, registry) = new_registry(write_behind=True)
+        (_, id) = registry.add_new_agent(new_agent(1))
+
+        (status, _) = registry.update_agent_data(id, {"active": False})
+        assert status == d.DB_query_status.QUEUED
+        assert registry.get_agent_data(id)[1].active is False
+
+        db.flush()
+        assert not db.get_agent_data(id)[1].active
+        db.close()
+
+    def test_invalidate(self):
+        """
+        Invalidated agents are dropped from every key
+        """
+        (_, registry) = new_registry()
+        (_, id) = registry.add_new_agent(new_agent(1))
+        registry.invalidate("container 1")
+
+        assert registry.all() == []
+        assert registry.get_stats()["agents"] == 0
+
+    def test_load(self):
+        """
+        load warms the cache from the database
+        """
+        (db, registry) = new_registry()
+        db.add_new_agents([new_agent(i) for i in range(5)])
+
+        assert registry.load() == d.DB_query_status.SUCCESS
+        assert [a.port_number for a in registry.all()] == [
+            20000 + i for i in range(5)]
+
+    def test_copies(self):
+        """
+        Mutating a returned agent does not change the cache
+        """
+        (_, registry) = new_registry()
+        (_, id) = registry.add_new_agent(new_agent(1))
+        registry.get_agent_data(id)[1].team_name = "changed"
+
+        assert registry.get_agent_data(id)[1].team_name is None
+
+    def test_parse_agent_id(self):
+        """
+        Digit strings are row ids, anything else a container id
+        """
+        assert r.parse_agent_id("12") == 12
+        assert r.parse_agent_id("abc123") == "abc123"
@@ -0,0 +1,127 @@
+import roker.controllers.snapshot_controller as s
+import asyncio
+import pytest
+
+
+def make_source(data: dict, delay: float = 0.0) -> (object, list):
+    calls = []
+
+    async def source() -> dict:
+        calls.append(None)
+        await asyncio.sleep(delay)
+        return dict(data)
+    return (source, calls)
+
+
+class Test_SnapshotController:
+    @pytest.mark.asyncio
+    async def test_coalesced_refresh(self):
+        """
+        Concurrent callers share one refresh of the source
+        """
+        (source, calls) = make_source({"a": 1}, delay=0.05)
+        sc = s.SnapshotController(source, ttl=10)
+
+        snapshots = await asyncio.gather(*[sc.get() for _ in range(20)])
+
+        assert len(calls) == 1
+        assert all(snap is snapshots[0] for snap in snapshots)
+        assert sc.get_stats()["coalesced"] == 19
+
+    @pytest.mark.asyncio
+    async def test_ttl(self):
+        """
+        Snapshots are served from cache until they are `ttl` old
+        """
+        (source, calls) = make_source({"a": 1})
+        sc = s.SnapshotController(source, ttl=0.05)
+        await sc.get()
+        await sc.get()
+        assert len(calls) == 1
+
+        await asyncio.sleep(0.06)
+        await sc.get()
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_version_only_moves_on_change(self):
+        """
+        The version and ETag stay put while the data does not change
+        """
+        data = {"a": 1}
+        (source, _) = make_source(data)
+        sc = s.SnapshotController(source, ttl=0)
+
+        first = await sc.get()
+        assert (await sc.get()).etag == first.etag
+
+        data["b"] = 2
+        second = await sc.get()
+        assert second.version == first.version + 1
+        assert second.etag != first.etag
+
+    @pytest.mark.asyncio
+    async def test_delta(self):
+        """
+        Deltas carry only changed and removed keys since a version
+        """
+        data = {"a": 1, "b": 2, "c": 3}
+        (source, _) = make_source(data)
+        sc = s.SnapshotController(source, ttl=0)
+        v1 = (await sc.get()).version
+
+        data["a"] = 10
+        del data["b"]
+        await sc.get()
+        data["d"] = 4
+        data["b"] = 20
+
+        delta = await sc.delta(v1)
+        assert delta.complete
+        assert delta.changed == {"a": 10, "b": 20, "d": 4}
+        assert delta.removed == []
+
+        del data["c"]
+        current = await sc.delta(delta.version)
+        assert current.changed == {}
+        assert current.removed == ["c"]
+
+        unchanged = await sc.delta(current.version)
+        assert unchanged.complete
+        assert (unchanged.changed, unchanged.removed) == ({}, [])
+
+    @pytest.mark.asyncio
+    async def test_delta_too_old(self):
+        """
+        Versions older than the history get the whole snapshot
+        """
+        data = {"a": 0}
+        (source, _) = make_source(data)
+        sc = s.SnapshotController(source, ttl=0, history=2)
+        for i in range(1, 5):
+            data["a"] = i
+            await sc.get()
+
+        delta = await sc.delta(1)
+        assert not delta.complete
+        assert delta.changed == {"a": 4}
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh(self):
+        """
+        A failing source fails every caller of that refresh, not the next
+        """
+        fail = [True]
+
+        async def source() -> dict:
+            await asyncio.sleep(0.01)
+            if fail[0]:
+                raise RuntimeError("source down")
+            return {}
+        sc = s.SnapshotController(source, ttl=10)
+
+        res = await asyncio.gather(sc.get(), sc.get(), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in res)
+
+        fail[0] = False
+        assert (await sc.get()).version == 1
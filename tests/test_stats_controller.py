@@ -0,0 +1,224 @@
+import roker.controllers.db_controller as d
+import roker.controllers.stats_controller as s
+import pytest
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from roker.controllers.event_controller import ContainerState
+
+
+def raw_stats(total: int, system: int, usage: int = 100 * 1024 ** 2) -> dict:
+    return {
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": total},
+            "system_cpu_usage": system,
+            "online_cpus": 2,
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": 0},
+            "system_cpu_usage": 0,
+        },
+        "memory_stats": {
+            "usage": usage,
+            "limit": 128 * 1024 ** 2,
+            "stats": {"inactive_file": 1024},
+        },
+        "networks": {
+            "eth0": {"rx_bytes": 10, "tx_bytes": 20},
+            "eth1": {"rx_bytes": 1, "tx_bytes": 2},
+        },
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"op": "read", "value": 300},
+                {"op": "write", "value": 400},
+                {"op": "Read", "value": 5},
+            ],
+        },
+    }
+
+
+def sample(ts: float, cpu: float = 0.0, mem: int = 0) -> s.StatSample:
+    return s.StatSample(ts=ts, cpu_percent=cpu, mem_bytes=mem, mem_limit=0,
+                        net_rx=ts, net_tx=0, blk_read=0, blk_write=0)
+
+
+class BlockingStats:
+    """Stats streams that give one sample, then block until released"""
+
+    def __init__(self):
+        self.streams: list[threading.Event] = []
+
+    def stats(self, id, decode, stream):
+        release = threading.Event()
+        self.streams.append(release)
+        yield raw_stats(total=50, system=100)
+        release.wait(5)
+
+
+def wait_until(check) -> bool:
+    for _ in range(400):
+        if check():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def new_stats(client=None, **kwargs) -> (d.DB_Controller, s.StatsController):
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    return (db, s.StatsController(client, db, **kwargs))
+
+
+class Test_StatsController:
+    def test_compute_sample(self):
+        """
+        Samples are computed the way the docker CLI computes them
+        """
+        res = s.compute_sample(raw_stats(total=50, system=100), ts=1.0)
+
+        assert res.cpu_percent == 100.0
+        assert res.mem_bytes == 100 * 1024 ** 2 - 1024
+        assert res.mem_limit == 128 * 1024 ** 2
+        assert (res.net_rx, res.net_tx) == (11, 22)
+        assert (res.blk_read, res.blk_write) == (305, 400)
+
+    def test_compute_sample_not_running(self):
+        """
+        Stopped containers report no CPU counters and give no sample
+        """
+        assert s.compute_sample({"cpu_stats": {}}, ts=1.0) is None
+
+    def test_ring_is_bounded(self):
+        """
+        Only the latest `ring_size` samples are kept
+        """
+        (_, stats) = new_stats(ring_size=3)
+        stats._rings["c"] = deque(maxlen=3)
+        for ts in range(10):
+            stats._add_sample("c", sample(ts))
+
+        assert [x.ts for x in stats.get_samples("c")] == [7, 8, 9]
+
+    def test_rollups(self):
+        """
+        Closed buckets are aggregated and written on flush
+        """
+        (db, stats) = new_stats()
+        stats._rings["c"] = deque(maxlen=10)
+        stats._add_sample("c", sample(3600, cpu=10.0, mem=100))
+        stats._add_sample("c", sample(3600.5, cpu=30.0, mem=300))
+        stats._add_sample("c", sample(3601, cpu=5.0, mem=50))
+        stats._flush()
+
+        (status, rows) = db.get_agent_stats("c", 1)
+        assert status == d.DB_query_status.SUCCESS
+        assert rows == [("c", 1, 3600, 2, 20.0, 30.0, 200, 300,
+                         3600.5, 0, 0, 0)]
+        # The minute and hour buckets are still open
+        assert db.get_agent_stats("c", 60)[1] == []
+
+        stats.unwatch("c")
+        stats._flush()
+        assert len(db.get_agent_stats("c", 1)[1]) == 2
+        assert db.get_agent_stats("c", 60)[1][0][3] == 3
+        assert db.get_agent_stats("c", 3600)[1][0][3] == 3
+        assert stats.get_samples("c") == []
+
+    def test_prune(self):
+        """
+        Buckets past their retention are dropped
+        """
+        (db, stats) = new_stats(retention={1: 10, 60: 10, 3600: 10})
+        now = int(time.time())
+        db.add_agent_stats([
+            ("c", 1, now - 100, 1, 0.0, 0.0, 0, 0, 0, 0, 0, 0),
+            ("c", 1, now, 1, 0.0, 0.0, 0, 0, 0, 0, 0, 0),
+        ])
+        stats._prune()
+
+        assert [row[2] for row in db.get_agent_stats("c", 1)[1]] == [now]
+
+    def test_top(self):
+        """
+        Containers are ranked by their latest sample
+        """
+        (_, stats) = new_stats()
+        for (id, cpu, mem) in (("a", 5.0, 300), ("b", 50.0, 100),
+                               ("c", 20.0, 200)):
+            stats._rings[id] = deque(maxlen=10)
+            stats._add_sample(id, sample(1, cpu=90.0, mem=0))
+            stats._add_sample(id, sample(2, cpu=cpu, mem=mem))
+
+        assert [x["container_id"] for x in stats.top("cpu", 2)] == ["b", "c"]
+        assert [x["container_id"] for x in stats.top("mem", 5)] == [
+            "a", "c", "b"]
+        with pytest.raises(ValueError):
+            stats.top("disk")
+
+    def test_watch_stream(self):
+        """
+        Running containers have their stats stream read until they stop
+        """
+        raws = [raw_stats(total=50 * i, system=100 * i) for i in range(1, 4)]
+        client = SimpleNamespace(api=SimpleNamespace(
+            stats=lambda id, decode, stream: iter(raws)))
+        (_, stats) = new_stats(client)
+
+        stats.on_state(ContainerState(container_id="c", status="running"))
+        for _ in range(200):
+            if len(stats.get_samples("c")) == 3:
+                break
+            time.sleep(0.005)
+        assert len(stats.get_samples("c")) == 3
+        assert stats.get_stats()["samples"] == 3
+
+        stats.on_state(ContainerState(container_id="c", status="exited"))
+        assert stats.get_samples("c") == []
+        stats.stop()
+
+    def test_streams_refused(self):
+        """
+        Containers past `max_streams` are refused and counted, and watched
+        once a stream is freed
+        """
+        api = BlockingStats()
+        (_, stats) = new_stats(SimpleNamespace(api=api), max_streams=1)
+
+        assert stats.watch("a")
+        assert not stats.watch("b")
+        assert not stats.watch("b")
+        assert stats.get_stats()["refused"] == 1
+        assert stats.get_stats()["refusals"] == 1
+
+        stats.on_state(ContainerState(container_id="a", status="exited"))
+        assert stats.get_stats()["refused"] == 0
+        assert wait_until(lambda: len(stats.get_samples("b")) == 1)
+
+        for release in api.streams:
+            release.set()
+        stats.stop()
+
+    def test_rewatch(self):
+        """
+        A restarted container stays watched when its old stream ends after
+        the new one started
+        """
+        api = BlockingStats()
+        (_, stats) = new_stats(SimpleNamespace(api=api))
+
+        stats.on_state(ContainerState(container_id="c", status="running"))
+        assert wait_until(lambda: len(api.streams) == 1)
+        stats.on_state(ContainerState(container_id="c", status="exited"))
+        stats.on_state(ContainerState(container_id="c", status="running"))
+        assert wait_until(lambda: len(api.streams) == 2)
+
+        api.streams[0].set()
+        assert wait_until(lambda: sum(
+            thread.name == "roker-stats-c"
+            for thread in threading.enumerate()) == 1)
+        assert stats.get_stats()["watching"] == 1
+
+        api.streams[1].set()
+        stats.stop()
@@ -0,0 +1,161 @@
+import roker.controllers.db_controller as d
+import roker.controllers.tournament_controller as t
+import asyncio
+import itertools
+import pytest
+
+
+class FakeRunner:
+    """
+    Plays a table in `delay` seconds, or 0.2 if an agent in `slow` is
+    seated. The lowest agent id wins, unless the table is in `fail`.
+    """
+
+    def __init__(self, delay: float = 0.01, fail: set | None = None,
+                 slow: set | None = None):
+        self.delay = delay
+        self.fail = fail or set()
+        self.slow = slow or set()
+        self.seated: set[int] = set()
+        self.running = 0
+        self.most_running = 0
+        self.tables: list[t.Table] = []
+
+    async def __call__(self, table: t.Table) -> dict[int, float]:
+        assert not self.seated & set(table.seats), "agent seated twice"
+        self.seated.update(table.seats)
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            await asyncio.sleep(
+                0.2 if self.slow & set(table.seats) else self.delay)
+        finally:
+            self.seated.difference_update(table.seats)
+            self.running -= 1
+        self.tables.append(table)
+        if table.number in self.fail:
+            raise RuntimeError("agent crashed")
+        return {agent_id: 100 - agent_id for agent_id in table.seats}
+
+
+def new_tournaments(runner, **kwargs) -> t.TournamentController:
+    db = d.DB_Controller(in_memory_db=True)
+    db.connect()
+    return t.TournamentController(db, runner, **kwargs)
+
+
+async def play(tc: t.TournamentController, *args, **kwargs) -> dict:
+    (status, tournament_id) = await tc.start(*args, **kwargs)
+    assert status == t.TOURNAMENT_SC.OK
+    await tc.wait(tournament_id)
+    return tc.get_tournament(tournament_id)
+
+
+class Test_TournamentController:
+    @pytest.mark.asyncio
+    async def test_round_robin(self):
+        """
+        Every pair meets once and the slots are kept full
+        """
+        runner = FakeRunner()
+        tc = new_tournaments(runner, parallelism=4)
+        result = await play(tc, list(range(1, 9)), "round_robin")
+
+        assert result["status"] == "finished"
+        assert len(result["tables"]) == 28
+        assert {frozenset(table.seats) for table in runner.tables} == {
+            frozenset(pair)
+            for pair in itertools.combinations(range(1, 9), 2)}
+        assert runner.most_running == 4
+        assert [row["agent_id"] for row in result["standings"]] == \
+            list(range(1, 9))
+        assert result["standings"][0]["wins"] == 7
+
+    @pytest.mark.asyncio
+    async def test_knockout(self):
+        """
+        Winners advance until one is left, with byes for odd fields
+        """
+        runner = FakeRunner()
+        tc = new_tournaments(runner, parallelism=8)
+        result = await play(tc, [5, 4, 3, 2, 1], "knockout")
+
+        # 5 v 4, 3 v 2, 1 bye; 4 v 2, 1 bye; 2 v 1
+        assert [(table["round"], table["seats"])
+                for table in result["tables"]] == [
+            (0, [5, 4]), (0, [3, 2]), (1, [4, 2]), (2, [2, 1])]
+        assert [row["agent_id"] for row in result["standings"]] == \
+            [1, 2, 4, 3, 5]
+
+    @pytest.mark.asyncio
+    async def test_knockout_pipelined(self):
+        """
+        A next round table starts as soon as its own feeders are played
+        """
+        runner = FakeRunner(slow={7})
+        tc = new_tournaments(runner, parallelism=8)
+        await play(tc, [1, 2, 3, 4, 5, 6, 7, 8], "knockout")
+
+        # 1 v 3 (round 1) was played before the slow 7 v 8 (round 0) ended
+        order = [table.seats for table in runner.tables]
+        assert order.index((1, 3)) < order.index((7, 8))
+
+    @pytest.mark.asyncio
+    async def test_swiss(self):
+        """
+        Rounds pair agents by standings without rematches
+        """
+        runner = FakeRunner()
+        tc = new_tournaments(runner, parallelism=8)
+        result = await play(tc, list(range(1, 9)), "swiss", rounds=3)
+
+        rounds = [table["round"] for table in result["tables"]]
+        assert rounds == [0] * 4 + [1] * 4 + [2] * 4
+        pairs = [frozenset(table.seats) for table in runner.tables]
+        assert len(set(pairs)) == len(pairs)
+        assert result["standings"][0] == {
+            "agent_id": 1, "wins": 3, "score": 297.0, "tables": 3}
+
+    @pytest.mark.asyncio
+    async def test_shared_agents(self):
+        """
+        Concurrent tournaments never seat one agent at two tables
+        """
+        runner = FakeRunner()
+        tc = new_tournaments(runner, parallelism=16)
+        (_, first) = await tc.start([1, 2, 3, 4], "round_robin")
+        (_, second) = await tc.start([1, 2, 3, 4], "swiss")
+        await tc.wait(first)
+        await tc.wait(second)
+
+        assert tc.get_tournament(first)["status"] == "finished"
+        assert tc.get_tournament(second)["status"] == "finished"
+        assert runner.most_running == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_table(self):
+        """
+        A table whose runner fails counts as played with no scores
+        """
+        runner = FakeRunner(fail={0})
+        tc = new_tournaments(runner)
+        result = await play(tc, [1, 2, 3], "round_robin")
+
+        assert result["tables"][0]["status"] == "failed"
+        assert result["tables"][0]["scores"] == {1: 0, 2: 0}
+        assert tc.get_stats()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_bad_request(self):
+        """
+        Unknown formats and fields too small for a table are refused
+        """
+        tc = new_tournaments(FakeRunner())
+
+        (status, _) = await tc.start([1, 2], "poker")
+        assert status == t.TOURNAMENT_SC.BAD_FORMAT
+        (status, _) = await tc.start([1, 1], "swiss")
+        assert status == t.TOURNAMENT_SC.TOO_FEW_AGENTS
+        (status, _) = await tc.start([1, 2], "swiss", table_size=3)
+        assert status == t.TOURNAMENT_SC.TOO_FEW_AGENTS
+        assert tc.get_tournament(1) is None